@@ -3,9 +3,36 @@ Judith Verstegen, 2011-01-27
 
 """
 
+import os
+
+import numpy
 from pcraster import *
 from pcraster.framework import *
 import Parameters
+import activecells
+import compact
+import competition
+import csf
+import distance
+import inputs
+from instrumentation import log, profiler
+import instrumentation
+import landusedeltas
+import outputwriter
+import postprocessing
+import randomfields
+from randomstreams import streams
+import summedarea
+import transitions
+import zonal
+
+#######################################
+
+def getError(errors, name):
+  """Return the standard normal error map of input name, or white noise."""
+  if name in errors:
+    return errors[name]
+  return streams.normal(name)
 
 #######################################
 
@@ -40,8 +67,14 @@ class LandUseType:
     self.noise = noise
     self.toMeters = Parameters.getConversionUnit()
     self.stochDistance = Parameters.getStochDistance()
+    self.distanceTransform = Parameters.getDistanceTransform()
     self.stochWindow = Parameters.getStochWindow()
     self.windowLengthRealization = windowLengthRealization
+    self.compact = Parameters.getCompactStorage()
+    ## Cells deforestated in the current time step, see removeForest()
+    self.deforestated = None
+    ## TransitionCounter that records every change, or None
+    self.transitions = None
     if self.typeNr == Parameters.getForestNr():
       self.forest = True
       self.yieldFrac = forestYieldFrac
@@ -55,10 +88,11 @@ class LandUseType:
 
   def createInitialMask(self, globalMapNoGo, privateMapsNoGo):
     """Combine the global no-go map with areas unsuitable for this land use."""
-    self.mask = globalMapNoGo
+    mask = globalMapNoGo
     if privateMapsNoGo is not None:
-      self.mask = pcror(self.mask, privateMapsNoGo)
-##        report(self.mask, 'privMask')
+      mask = pcror(mask, privateMapsNoGo)
+##        report(mask, 'privMask')
+    self.mask = compact.store(mask, self.compact)
 
   def normalizeMap(self, aMap):
     """Return a normalized version of the input map."""
@@ -72,36 +106,57 @@ class LandUseType:
     return normalizedMap
   
   ## 1
-  def getNeighborSuitability(self):
-    """Return suitability map based on nr of neighors with a related type."""
+  def getWindowLength(self):
+    """Return the window length of factor 1, with its random error if any."""
+    windowLength = self.variableDict.get(1)[0]
+    if self.stochWindow == 1:
+      windowLength += (clone().cellSize()/3) * self.windowLengthRealization
+    return windowLength
+
+  def getNeighborSuitability(self, windowLength=None):
+    """Return suitability map based on nr of neighors with a related type.
+
+    The window length is taken from the parameters unless one is given.
+    Neighbours are counted with a summed-area table (see summedarea.py),
+    so large windows cost as much as small ones.
+
+    """
     booleanSelf = pcreq(self.environment, self.typeNr)
     for aType in self.relatedTypeList:
       booleanMap = pcreq(self.environment, aType)
       booleanSelf = pcror(booleanSelf, booleanMap)
-    scalarSelf = scalar(booleanSelf)
+    scalarSelf = pcr2numpy(scalar(booleanSelf), numpy.nan)
     ## Count nr of neighbors with 'true' in a window with length from parameters
     ## and assign this value to the centre cell
-    variableList = self.variableDict.get(1)
-    windowLength = variableList[0]
-    if self.stochWindow == 1:
-      windowLength += (celllength()/3) * self.windowLengthRealization
+    if windowLength is None:
+      windowLength = self.getWindowLength()
 ##      print('windowLength is', float(windowLength))
-    nrNeighborsSameLU = windowtotal(scalarSelf, windowLength) - scalarSelf
+    cellSize = clone().cellSize()
+    nrNeighborsSameLU = summedarea.windowTotal(scalarSelf, windowLength, \
+                                               cellSize) - scalarSelf
     ## The nr of neighbors are turned into suitability values between 0 and 1
-    maxNr = ((windowLength / celllength())**2) - 1
+    maxNr = ((windowLength / cellSize)**2) - 1
     neighborSuitability = nrNeighborsSameLU / maxNr
+    neighborSuitability[numpy.isnan(neighborSuitability)] = -9999
+    neighborSuitability = numpy2pcr(Scalar, neighborSuitability, -9999)
 ##    report(neighborSuitability, 'neighborSuitability')
     return neighborSuitability
 
   ## 2
-  def getDistanceRoadSuitability(self, spreadMapRoads):
-    """Return suitability map based on distance to roads."""
+  def getDistanceRoadSuitability(self, spreadMapRoads, maxDist=None):
+    """Return suitability map based on distance to roads.
+
+    The maximum distance is taken from the parameters unless one is given.
+
+    """
     variableList = self.variableDict.get(2)
     direction = variableList[0]
-    maxDist = variableList[1]
-    if self.stochDistance == 1:
-      maxDist = 2*celllength() + mapuniform() * (2*maxDist - 2*celllength())
-      print('max dist roads is', int(maxDist))
+    if maxDist is None:
+      maxDist = variableList[1]
+      if self.stochDistance == 1:
+        maxDist = 2*celllength() + streams.mapuniform('distance') * \
+                  (2*maxDist - 2*celllength())
+        log(1, 'max dist roads is', int(maxDist))
     friction = variableList[2]
     relationType = variableList[3]
 
@@ -123,14 +178,20 @@ class LandUseType:
     return roadSuitability
 
   ## 3
-  def getDistanceWaterSuitability(self, spreadMapWater):
-    """Return suitability map based on distance to water."""
+  def getDistanceWaterSuitability(self, spreadMapWater, maxDist=None):
+    """Return suitability map based on distance to water.
+
+    The maximum distance is taken from the parameters unless one is given.
+
+    """
     variableList = self.variableDict.get(3)
     direction = variableList[0]
-    maxDist = variableList[1]
-    if self.stochDistance == 1:
-      maxDist = 2*celllength() + mapuniform() * (2*maxDist - 2*celllength())
-      print('max dist water is', int(maxDist))
+    if maxDist is None:
+      maxDist = variableList[1]
+      if self.stochDistance == 1:
+        maxDist = 2*celllength() + streams.mapuniform('distance') * \
+                  (2*maxDist - 2*celllength())
+        log(1, 'max dist water is', int(maxDist))
     friction = variableList[2]
     relationType = variableList[3]
 
@@ -152,14 +213,20 @@ class LandUseType:
     return waterSuitability
 
   ## 4
-  def getDistanceCitySuitability(self, spreadMapCities):
-    """Return suitability map based on distance to large cities."""
+  def getDistanceCitySuitability(self, spreadMapCities, maxDist=None):
+    """Return suitability map based on distance to large cities.
+
+    The maximum distance is taken from the parameters unless one is given.
+
+    """
     variableList = self.variableDict.get(4)
     direction = variableList[0]
-    maxDist = variableList[1]
-    if self.stochDistance == 1:
-      maxDist = 2*celllength() + mapuniform() * (2*maxDist - 2*celllength())
-      print('max dist cities is', int(maxDist))
+    if maxDist is None:
+      maxDist = variableList[1]
+      if self.stochDistance == 1:
+        maxDist = 2*celllength() + streams.mapuniform('distance') * \
+                  (2*maxDist - 2*celllength())
+        log(1, 'max dist cities is', int(maxDist))
     friction = variableList[2]
     relationType = variableList[3]
 
@@ -231,8 +298,31 @@ class LandUseType:
     currentLandUseSuitbaility = self.normalizeMap(current)
     return currentLandUseSuitbaility
   
+  def getStaticFactorMap(self, aFactor, distRoads, distWater, distCities, \
+                         densPopulation, densCattle, maxDist=None):
+    """Return the normalized suitability map of static factor aFactor.
+
+    Returns None for dynamic or unknown factors. maxDist overrides the
+    maximum distance of the distance factors 2, 3 and 4.
+
+    """
+    if aFactor == 2:
+      return self.getDistanceRoadSuitability(distRoads, maxDist)
+    elif aFactor == 3:
+      return self.getDistanceWaterSuitability(distWater, maxDist)
+    elif aFactor == 4:
+      return self.getDistanceCitySuitability(distCities, maxDist)
+    elif aFactor == 5:
+      return self.getYieldSuitability()
+    elif aFactor == 6:
+      return self.getPopulationSuitability(densPopulation)
+    elif aFactor == 7:
+      return self.getCattleSuitability(densCattle)
+    return None
+
   def createInitialSuitabilityMap(self, distRoads, distWater, distCities, \
-                                  densPopulation, densCattle):
+                                  densPopulation, densCattle, \
+                                  keepFactorMaps=False):
     """Return the initial suitability map, i.e. for static factors.
 
     Given six maps:
@@ -248,10 +338,14 @@ class LandUseType:
     parameters -- the input parameters for those factors
     weights -- the weights that belong to those factors (how they're combined).
 
+    With keepFactorMaps the normalized map of every static factor is kept in
+    self.factorMaps, so other weights can be tried without recomputing them.
+
     """
 
     self.weightInitialSuitabilityMap = 0
     self.initialSuitabilityMap = spatial(scalar(0))
+    self.factorMaps = {}
     i = 0
     ## For every number in the suitability factor list
     ## that belongs to a STATIC factor
@@ -259,39 +353,29 @@ class LandUseType:
     ## and the partial suitability map is added to the total
     ## taking into account its relative importance (weight)
     for aFactor in self.suitFactorList:
-      if aFactor == 2:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                 self.getDistanceRoadSuitability(distRoads)
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor == 3:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                 self.getDistanceWaterSuitability(distWater)
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor == 4:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                 self.getDistanceCitySuitability(distCities)
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor == 5:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                      self.getYieldSuitability()
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor == 6:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                 self.getPopulationSuitability(densPopulation)
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor == 7:
-        self.initialSuitabilityMap += self.weightList[i] * \
-                                 self.getCattleSuitability(densCattle)
-        self.weightInitialSuitabilityMap += self.weightList[i]
-      elif aFactor in (1, 8, 9):
-        ## Dynamic factors are captured in the total suitability map
-        pass
-      else:
-        print('ERROR: unknown suitability factor for landuse', self.typeNr)
+      with profiler.phase('staticSuitability', landUseType=self.typeNr, \
+                          factor=aFactor):
+        factorMap = self.getStaticFactorMap(aFactor, distRoads, distWater, \
+                                            distCities, densPopulation, \
+                                            densCattle)
+        if factorMap is not None:
+          self.initialSuitabilityMap += self.weightList[i] * factorMap
+          self.weightInitialSuitabilityMap += self.weightList[i]
+          if keepFactorMaps:
+            self.factorMaps[aFactor] = factorMap
+        elif aFactor in (1, 8, 9):
+          ## Dynamic factors are captured in the total suitability map
+          pass
+        else:
+          print('ERROR: unknown suitability factor for landuse', self.typeNr)
       i += 1
-    print('weight of initial factors of', self.typeNr, \
+    log(1, 'weight of initial factors of', self.typeNr, \
           'is', self.weightInitialSuitabilityMap)
     self.initialSuitabilityMap += self.noise
+    ## The no-go mask is static: applied here once, the total suitability of
+    ## every time step gets its No Data from the initial suitability
+    self.initialSuitabilityMap = ifthen(pcrnot(compact.load(self.mask)), \
+                                        self.initialSuitabilityMap)
 ##    report(self.initialSuitabilityMap, 'iniSuit' + str(self.typeNr))
 
   def getTotalSuitabilityMap(self):
@@ -312,23 +396,24 @@ class LandUseType:
     ## and the partial suitability map is added to the total
     ## taking into account its relative importance (weight)
     for aFactor in self.suitFactorList:
-      if aFactor == 1:
-        suitabilityMap += self.weightList[i] * self.getNeighborSuitability()
-      elif aFactor == 8:
-        suitabilityMap += self.weightList[i] * self.getEdgeSuitability()
-      elif aFactor == 9:
-        suitabilityMap += self.weightList[i] * \
-                          self.getCurrentLandUseSuitability()
-      elif aFactor in (2, 3, 4, 5, 6, 7):
-        ## Static factors already captured in the initial suitability map
-        pass
-      else:
-        print('ERROR: unknown suitability factor for landuse', self.typeNr)
+      with profiler.phase('suitability', landUseType=self.typeNr, \
+                          factor=aFactor):
+        if aFactor == 1:
+          suitabilityMap += self.weightList[i] * self.getNeighborSuitability()
+        elif aFactor == 8:
+          suitabilityMap += self.weightList[i] * self.getEdgeSuitability()
+        elif aFactor == 9:
+          suitabilityMap += self.weightList[i] * \
+                            self.getCurrentLandUseSuitability()
+        elif aFactor in (2, 3, 4, 5, 6, 7):
+          ## Static factors already captured in the initial suitability map
+          pass
+        else:
+          print('ERROR: unknown suitability factor for landuse', self.typeNr)
       i += 1
     suitabilityMap += self.weightInitialSuitabilityMap * \
                       self.initialSuitabilityMap
-    self.totalSuitabilityMap = ifthen(pcrnot(self.mask), suitabilityMap)
-    self.totalSuitabilityMap = self.normalizeMap(self.totalSuitabilityMap)
+    self.totalSuitabilityMap = self.normalizeMap(suitabilityMap)
     return self.totalSuitabilityMap
 
   def setMaxYield(self, maxYield):
@@ -342,35 +427,52 @@ class LandUseType:
   def updateYield(self, env):
     """Calculate total yield generated by cells occupied by this land use."""
     ## Current cells taken by this land use type
-    self.currentYield = ifthen(env == self.typeNr, self.yieldMap)
-##    report(self.currentYield, 'currentYield' + str(self.typeNr))
-    self.totalYield = float(maptotal(self.currentYield))
+    currentYield = ifthen(env == self.typeNr, self.yieldMap)
+##    report(currentYield, 'currentYield' + str(self.typeNr))
+    self.totalYield = float(maptotal(currentYield))
 
   def allocate(self, demand, tempEnvironment, immutables):
     """ Assess total yield, compare with demand and add or remove difference."""
+    self.deforestated = None
     self.setEnvironment(tempEnvironment)
     self.updateYield(tempEnvironment)
     ownDemand = ifthen(self.environment == self.typeNr, demand)
     self.demand = float(mapmaximum(ownDemand))
-    print('\nland use type', self.typeNr)
-    print('demand is:', self.demand)
+    log(1, '\nland use type', self.typeNr)
+    log(1, 'demand is:', self.demand)
     if self.forest:
-      print('forest,', self.typeNr,'so remove')
+      log(2, 'forest,', self.typeNr,'so remove')
       self.removeForest()
     else:
-      print('total yield is:', self.totalYield)
+      log(1, 'total yield is:', self.totalYield)
       if self.totalYield > self.demand:
-        print('remove')
+        log(2, 'remove')
         self.remove()
       elif self.totalYield < self.demand:
-        print('add')
+        log(2, 'add')
         self.add(immutables)
       else:
-        print('do nothing')
+        log(2, 'do nothing')
     newImmutables = ifthenelse(self.environment == self.typeNr, boolean(1),\
                                immutables)
     return self.environment, newImmutables
     
+  def recordChanges(self, changed, oldClass=None):
+    """Record the cells with a value on changed with the TransitionCounter.
+
+    oldClass -- class of all those cells before the change; None to take
+    the classes from the environment, which must not be changed yet
+
+    """
+    if self.transitions is None or changed is None:
+      return
+    cells = numpy.flatnonzero(pcr2numpy(defined(changed), 0))
+    if oldClass is None:
+      oldClasses = pcr2numpy(self.environment, -1).ravel()[cells]
+    else:
+      oldClasses = numpy.full(len(cells), oldClass)
+    self.transitions.record(cells, oldClasses)
+
   def add(self, immutables):
     """Add cells of this land use type until demand is fullfilled."""
     ## Remove cells from immutables (already changed)
@@ -381,7 +483,7 @@ class LandUseType:
                                       self.totalSuitabilityMap)
     ## Determine maximum suitability and allocate new cells there
     mapMax = mapmaximum(self.totalSuitabilityMap)
-    print('start mapMax =', float(mapMax))
+    log(2, 'start mapMax =', float(mapMax))
     ordered = order(self.totalSuitabilityMap)
     maxIndex = int(mapmaximum(ordered))
     diff = float(self.demand - self.totalYield)
@@ -389,15 +491,17 @@ class LandUseType:
     xPrev = maxIndex
     i = 0
     tempEnv = self.environment
+    allocated = None
     while diff > 0 and xPrev > x:
-      print('cells to add', int(maxIndex - x))
+      log(2, 'cells to add', int(maxIndex - x))
       if x < 0:
-        print('No space left for land use', self.typeNr)
+        log(0, 'No space left for land use', self.typeNr)
         break
       else:
         ## The key: cells with maximum suitability are turned into THIS type
         tempEnvironment = ifthen(ordered > x, nominal(self.typeNr))
         tempEnv = cover(tempEnvironment, self.environment)
+        allocated = tempEnvironment
 
         ## Check the yield of the land use type now that more land is occupied
         self.updateYield(tempEnv)
@@ -406,8 +510,10 @@ class LandUseType:
         ## Number of cells to be allocated
         diff = float(self.demand - self.totalYield)
         x -= int(diff / self.maxYield)
+    self.recordChanges(allocated)
     self.setEnvironment(tempEnv)
-    print('iterations', i, 'end yield is', self.totalYield)
+    log(1, 'iterations', i, 'end yield is', self.totalYield)
+    profiler.count(i)
 
 
   def remove(self):
@@ -417,14 +523,14 @@ class LandUseType:
                                       self.totalSuitabilityMap)
     ordered = order(self.totalSuitabilityMap)
     mapMin = mapminimum(self.totalSuitabilityMap)
-    print('start mapMin =', float(mapMin))
+    log(2, 'start mapMin =', float(mapMin))
     diff = float(self.totalYield - self.demand)
     x = int(diff / (self.maxYield * 0.8))
     xPrev = 0
     i = 0
     tempEnv = self.environment
     while diff > 0 and xPrev < x and i < 100:
-      print('cells to remove', x)
+      log(2, 'cells to remove', x)
       ## The key: cells with minimum suitability are turned into 'abandoned'
       tempEnvironment = ifthen(ordered < x, nominal(99))
       tempEnv = cover(tempEnvironment, self.environment)
@@ -435,20 +541,23 @@ class LandUseType:
       xPrev = x
       diff = float(self.totalYield - self.demand)
       if math.fmod(i, 40) == 0:
-        print('NOT getting there...')
+        log(2, 'NOT getting there...')
         ## Number of cells to be allocated
         x = 2 * (x + int(diff / self.maxYield))      
       else:
         ## Number of cells to be allocated
         x += int(diff / self.maxYield)
+    if i > 0:
+      self.recordChanges(tempEnvironment, self.typeNr)
     self.setEnvironment(tempEnv)
-    print('iterations', i, 'end yield is', self.totalYield)
+    log(1, 'iterations', i, 'end yield is', self.totalYield)
+    profiler.count(i)
 ##    report(self.environment, 'newEnv' + str(self.typeNr))
 
   def removeForest(self):
     """Remove area of forest indicated in time series."""
     if self.demand < 0.01:
-      print('nothing to remove')
+      log(1, 'nothing to remove')
     else:
       ## Only cells already occupied by this land use can be removed
       self.totalSuitabilityMap = ifthen(self.environment == self.typeNr, \
@@ -458,12 +567,12 @@ class LandUseType:
       removedBiomass = self.nullMask
       diff = 1
       tempEnv = self.environment
-      print('start mapMin =', float(mapMin))
+      log(2, 'start mapMin =', float(mapMin))
       x = int(self.demand / self.maxYield * 0.8)
       xPrev = 0
       i = 0
       while diff > 0 and xPrev < x and i < 100:
-        print('cells to remove', x)
+        log(2, 'cells to remove', x)
         ## The key: cells with minimum suitability are turned into 'abandoned'
         tempEnvironment = ifthen(ordered < x, nominal(98))
         tempEnv = cover(tempEnvironment, self.environment)
@@ -474,31 +583,54 @@ class LandUseType:
         xPrev = x
         diff = float(self.demand - self.totalYield)
         if math.fmod(i, 40) == 0:
-          print('NOT getting there...')
+          log(2, 'NOT getting there...')
           ## Number of cells to be allocated
           x = 2 * (x + int(diff / self.maxYield))      
         else:
           ## Number of cells to be allocated
           x += int(diff / self.maxYield)
+      if i > 0:
+        self.deforestated = pcreq(tempEnvironment, 98)
+        self.recordChanges(tempEnvironment, self.typeNr)
       self.setEnvironment(tempEnv)
-      print('iterations', i, 'removed biomass is', self.totalYield)
+      log(1, 'iterations', i, 'removed biomass is', self.totalYield)
+      profiler.count(i)
 
 #######################################
 
 class LandUse:
+  ## Class of the objects made by createLandUseTypeObjects()
+  typeClass = LandUseType
+
   def __init__(self, types, environment, nullMask):
     """Construct a land use object with a nr of types and an environment."""
     self.types = types
     self.nrOfTypes = len(types)
-    print('\nnr of dynamic land use types is:', self.nrOfTypes)
+    log(1, '\nnr of dynamic land use types is:', self.nrOfTypes)
     self.environment = environment
     ## List with the land use type OBJECTS
     self.landUseTypes = []
     ## Map with 0 in study area and No Data outside, used for cover() functions
     self.nullMask = nullMask
     self.toMeters = Parameters.getConversionUnit()
-    self.yearsDeforestated = nullMask
+    self.compact = Parameters.getCompactStorage()
     self.forest = Parameters.getForestNr()
+    ## Cells that regrow to forest, per time step
+    self.regrowthDelay = Parameters.getRegrowthDelay()
+    self.regrowth = {}
+    self.timeStep = 0
+    ## Counter of land use transitions, see setTransitions()
+    self.transitions = None
+    ## Parts of the biofuel exclusion that stay the same during a sample
+    self.biofuelNoGo = None
+    self.steepSlopes = {}
+    ## Maps that are not needed by the configuration stay None
+    self.slopeMap = None
+    self.distRoads = None
+    self.distWater = None
+    self.distCities = None
+    self.distanceTransform = Parameters.getDistanceTransform()
+    self.distanceBuffers = None
 
   def setEnvironment(self, environment):
     """Update environment of the 'overall' class and separate land use types."""
@@ -508,35 +640,58 @@ class LandUse:
 
   def addRandomNoise(self, yieldFrac, forestYieldFrac, scYieldFrac, \
                      populationDensity, cattleDensity, dem, stochYield, \
-                     stochPopulation, stochCattle, stochDem):
-    """Add some random noise to maps as indicated in Parameters.py."""
+                     stochPopulation, stochCattle, stochDem, errors=None):
+    """Add some random noise to maps as indicated in Parameters.py.
+
+    errors -- dict with a standard normal error map per input name, for
+    errors that vary in space; maps not in it get one error for all cells
+
+    """
     self.yieldFrac = yieldFrac
     self.forestYieldFrac = forestYieldFrac
     self.scYieldFrac = scYieldFrac
     self.populationDensity = populationDensity
     self.cattleDensity = cattleDensity
     self.dem = dem
+    if errors is None:
+      errors = {}
     ## Add random noise when required by corresponding method in Parameters.py
+    ## Maps that were not read (None) are not needed, so they are skipped;
+    ## their errors are still drawn, so that the draws of the other maps
+    ## from the shared random stream do not depend on the output list
     if stochYield[0] == 1:
-      self.yieldFrac += stochYield[1] * normal(1) * self.yieldFrac
-      self.forestYieldFrac += stochYield[1] * normal(1) * self.forestYieldFrac
-      self.scYieldFrac += stochYield[1] * normal(1) * self.scYieldFrac
+      yieldError = getError(errors, 'yield')
+      biomassError = getError(errors, 'biomass')
+      scYieldError = getError(errors, 'scYield')
+      self.yieldFrac += stochYield[1] * yieldError * self.yieldFrac
 ##      self.yieldFrac = self.yieldFrac / mapmaximum(self.yieldFrac)
       self.yieldFrac = max(self.yieldFrac, 0)
       self.yieldFrac = min(self.yieldFrac, 1)
-      self.forestYieldFrac = max(self.forestYieldFrac, 0)
-      self.forestYieldFrac = min(self.forestYieldFrac, 1)
-      self.scYieldFrac = max(self.scYieldFrac, 0)
-      self.scYieldFrac = min(self.scYieldFrac, 1)
+      if self.forestYieldFrac is not None:
+        self.forestYieldFrac += stochYield[1] * biomassError * \
+                                self.forestYieldFrac
+        self.forestYieldFrac = max(self.forestYieldFrac, 0)
+        self.forestYieldFrac = min(self.forestYieldFrac, 1)
+      if self.scYieldFrac is not None:
+        self.scYieldFrac += stochYield[1] * scYieldError * self.scYieldFrac
+        self.scYieldFrac = max(self.scYieldFrac, 0)
+        self.scYieldFrac = min(self.scYieldFrac, 1)
     if stochPopulation[0] == 1:
-      self.populationDensity += stochPopulation[1] * normal(1) * \
-                                self.populationDensity
-      self.populationDensity = max(self.populationDensity, 0)
+      populationError = getError(errors, 'popDensity')
+      if self.populationDensity is not None:
+        self.populationDensity += stochPopulation[1] * populationError * \
+                                  self.populationDensity
+        self.populationDensity = max(self.populationDensity, 0)
     if stochCattle[0] == 1:
-      self.cattleDensity += stochCattle[1] * normal(1) * self.cattleDensity
-      self.cattleDensity = max(self.cattleDensity, 0)
+      cattleError = getError(errors, 'cattleDensity')
+      if self.cattleDensity is not None:
+        self.cattleDensity += stochCattle[1] * cattleError * \
+                              self.cattleDensity
+        self.cattleDensity = max(self.cattleDensity, 0)
     if stochDem[0] == 1:
-      self.dem += stochDem[1] * normal(1)
+      demError = getError(errors, 'dem')
+      if self.dem is not None:
+        self.dem += stochDem[1] * demError
     self.euYieldFrac = self.yieldFrac
     
   def createLandUseTypeObjects(self, relatedTypeDict, suitabilityDict, \
@@ -553,7 +708,7 @@ class LandUse:
     noise -- small random noise that determines order when same suitability
 
     """
-    windowLengthRealization = float(mapnormal())
+    windowLengthRealization = float(streams.mapnormal('window'))
     
     for aType in self.types:
       ## Get the list that states witch types the current types relates to
@@ -564,24 +719,27 @@ class LandUse:
       weightList = weightDict.get(aType)
       variableDict = variableSuperDict.get(aType)
       ## Parameter list is notincluded yet
-      self.landUseTypes.append(LandUseType(aType, self.environment, \
-                                           relatedTypeList, suitabilityList, \
-                                           weightList, variableDict, noise, \
-                                           self.nullMask, self.yieldFrac,\
-                                           self.forestYieldFrac, \
-                                           windowLengthRealization))
+      self.landUseTypes.append(self.typeClass(aType, self.environment, \
+                                              relatedTypeList, \
+                                              suitabilityList, weightList, \
+                                              variableDict, noise, \
+                                              self.nullMask, self.yieldFrac,\
+                                              self.forestYieldFrac, \
+                                              windowLengthRealization))
       
   def determineNoGoAreas(self, noGoMap, noGoLanduseList, privateNoGoSlopeDict):
     """Create global no-go map, pass it to the types that add own no-go areas."""
-    self.slopeMap = slope(self.dem)
-    self.excluded = noGoMap
+    if self.dem is not None:
+      self.slopeMap = slope(self.dem)
+    excluded = noGoMap
     privateNoGoAreas = None
     ## Check the list with immutable land uses
     if noGoLanduseList is not None:
       for aNumber in noGoLanduseList:
         booleanNoGo = pcreq(self.environment, aNumber)
-        self.excluded = pcror(self.excluded, booleanNoGo)
-##    report(self.excluded, 'excluded')
+        excluded = pcror(excluded, booleanNoGo)
+##    report(excluded, 'excluded')
+    self.excluded = compact.store(excluded, self.compact)
     i = 0
     for aType in self.types:
       ## Get land use type specific no-go areas based on slope from dictionary
@@ -589,32 +747,89 @@ class LandUse:
       aSlope = privateNoGoSlopeDict.get(aType)
       if aSlope is not None:
         privateNoGoAreas = pcrgt(self.slopeMap, aSlope)
-      self.landUseTypes[i].createInitialMask(self.excluded, privateNoGoAreas)
+      self.landUseTypes[i].createInitialMask(excluded, privateNoGoAreas)
       i += 1
 
   def determineDistanceToRoads(self, booleanMapRoads):
     """Create map with distance to roads, given a boolean map with roads."""
-    self.distRoads = spread(booleanMapRoads, 0, 1)
+    if booleanMapRoads is None:
+      return
+    self.distRoads = self.getDistance(booleanMapRoads, 2)
 ##    report(self.distRoads, 'distRoads')
     
   def determineDistanceToWater(self, booleanMapWater):
     """Create map with distance to water, given a boolean map with water."""
-    self.distWater = spread(booleanMapWater, 0, 1)
+    if booleanMapWater is None:
+      return
+    self.distWater = self.getDistance(booleanMapWater, 3)
 ##    report(self.distWater, 'distWater')
 
   def determineDistanceToLargeCities(self, booleanMapCities):
     """Create map with distance to cities, using a boolean map with cities."""
-    self.distCities = spread(booleanMapCities, 0, 1)
+    if booleanMapCities is None:
+      return
+    self.distCities = self.getDistance(booleanMapCities, 4)
 ##    report(self.distCities, 'distCities')
+
+  def getMaxDistance(self, aFactor):
+    """Return the largest maximum distance of aFactor over the types.
+
+    Returns None when no type uses the factor.
+
+    """
+    suitFactorDict = Parameters.getSuitFactorDict()
+    variableSuperDict = Parameters.getVariableSuperDict()
+    maxDists = [variableSuperDict.get(aType).get(aFactor)[1] \
+                for aType in self.types if aFactor in suitFactorDict.get(aType)]
+    if len(maxDists) == 0:
+      return None
+    if Parameters.getStochDistance() == 1:
+      ## The random maximum distance is at most twice the parameter
+      return 2 * max(maxDists)
+    return max(maxDists)
+
+  def getDistance(self, booleanMap, aFactor):
+    """Return a map with the distance to the True cells of booleanMap.
+
+    aFactor -- suitability factor (2, 3 or 4) that uses the distances
+
+    """
+    if self.distanceTransform == 0:
+      return spread(booleanMap, 0, 1)
+    values = pcr2numpy(booleanMap, 255)
+    if self.distanceBuffers is None:
+      self.distanceBuffers = [numpy.empty(values.shape, dtype=numpy.float32) \
+                              for i in range(2)]
+    maxDist = self.getMaxDistance(aFactor)
+    if self.distanceTransform == 2 and maxDist is not None:
+      distances = distance.bounded(values == 1, clone().cellSize(), maxDist, \
+                                   *self.distanceBuffers)
+      log(1, 'distances up to', maxDist, 'for factor', aFactor)
+    else:
+      distances = distance.euclidean(values == 1, clone().cellSize(), \
+                                     *self.distanceBuffers)
+    ## No Data as in spread(), the map is a copy so the buffers are free again
+    distances[(values == 255) | numpy.isnan(distances)] = -9999
+    return numpy2pcr(Scalar, distances, -9999)
   
-  def calculateStaticSuitabilityMaps(self):
-    """Get the part of the suitability maps that remains the same."""
+  def calculateStaticSuitabilityMaps(self, keepFactorMaps=False):
+    """Get the part of the suitability maps that remains the same.
+
+    With keepFactorMaps the types keep their static factor maps and the
+    distance maps are kept as well, for weight and parameter sweeps.
+
+    """
     for aType in self.landUseTypes:
       ## Check whether the type has static suitability factors
       ## Those have to be calculated only once (in initial)
       aType.createInitialSuitabilityMap(self.distRoads, self.distWater, \
                                         self.distCities, self.populationDensity, \
-                                        self.cattleDensity)
+                                        self.cattleDensity, keepFactorMaps)
+    if self.compact == 1 and not keepFactorMaps:
+      ## Distances are only used for the static suitability
+      self.distRoads = None
+      self.distWater = None
+      self.distCities = None
 
   def calculateSuitabilityMaps(self):      
     """Get the total suitability maps (static plus dynamic part)."""
@@ -625,48 +840,114 @@ class LandUse:
 
   def allocate(self, maxYield, demand):
     """Allocate as much of a land use type as indicated in the demand tss."""
+    self.timeStep += 1
     tempEnvironment = self.environment
-    immutables = self.excluded
+    immutables = compact.load(self.excluded)
     for aType in self.landUseTypes:
-      aType.setMaxYield(maxYield)
-      tempEnvironment, immutables = aType.allocate(demand, tempEnvironment, \
-                                                   immutables)
+      with profiler.phase('allocate', landUseType=aType.typeNr):
+        aType.setMaxYield(maxYield)
+        tempEnvironment, immutables = aType.allocate(demand, \
+                                                     tempEnvironment, \
+                                                     immutables)
+        self.scheduleRegrowth(aType.deforestated)
     self.setEnvironment(tempEnvironment)    
 
+  def scheduleRegrowth(self, deforestated):
+    """Queue cells deforestated in this time step (Boolean map) to regrow.
+
+    Counting the year of deforestation, forest regrows after regrowthDelay
+    years, so with 9 it is available again in the 10th year. The cells are
+    queued as their positions in the raster, as in ActiveLandUse.
+
+    """
+    if deforestated is None:
+      return
+    regrowthStep = self.timeStep + self.regrowthDelay - 1
+    self.regrowth.setdefault(regrowthStep, []).append( \
+                             numpy.flatnonzero(pcr2numpy(deforestated, 0)))
+
   def growForest(self):
-    """Regrow forest at deforestated areas after 10 years."""
-    ## Get all cells that are abandoned in the timestep
-    deforestated = pcreq(self.environment, 98)
-    ## Update map that counts the years a cell is deforestated
-    increment = ifthen(deforestated, self.yearsDeforestated + 1)
-    self.yearsDeforestated = cover(increment, self.yearsDeforestated)
-    ## Regrow forest after 9 years of abandonement, so it's available
-    ## again after 10 years
-    regrown = ifthen(self.yearsDeforestated == 9, nominal(self.forest))
-    reset = ifthen(regrown == nominal(self.forest), scalar(0))
-    self.yearsDeforestated = cover(reset, self.yearsDeforestated)
-    ## Update environment
-    filledEnvironment = cover(regrown, self.environment)
-    self.setEnvironment(filledEnvironment)
+    """Regrow forest at the cells queued for this time step.
+
+    Cells that were taken by another land use in the meantime stay as
+    they are; nothing is done in time steps without queued cells.
+
+    """
+    queued = self.regrowth.pop(self.timeStep, [])
+    if len(queued) == 0:
+      return
+    values = pcr2numpy(self.environment, -1).ravel()
+    cells = numpy.concatenate(queued)
+    cells = cells[values[cells] == 98]
+    if len(cells) == 0:
+      return
+    if self.transitions is not None:
+      self.transitions.record(cells, values[cells])
+    values[cells] = self.forest
+    values = values.reshape((clone().nrRows(), clone().nrCols()))
+    self.setEnvironment(numpy2pcr(Nominal, values, -1))
+
+  def setTransitions(self, counter):
+    """Count the land use transitions from the change sets of the types."""
+    self.transitions = counter
+    for aType in self.landUseTypes:
+      aType.transitions = counter
+
+  def finishTransitions(self):
+    """Count the transitions of this time step, see transitions.py.
+
+    The land use map is only read for the classes at the end of the step
+    when cells were changed.
+
+    """
+    values = None
+    if len(self.transitions.changes) > 0:
+      values = pcr2numpy(self.environment, -1).ravel()
+    self.transitions.finishStep(self.timeStep, values)
     
   def getEnvironment(self):
     """Return the current land use map."""
     return self.environment
 
-  def getBiofuelPotential(self, noGoMap, food, slope, provinces):
-    """Return Boolean map with area suitable for energy crops and its total."""
-    noBiofuels = pcror(self.excluded, noGoMap)
+  def getBiofuelExclusion(self, noGoMap, food):
+    """Return Boolean map of cells not available for any energy crop.
+
+    Same for all crops: no-go areas plus cells with food crops. The no-go
+    part does not change and is made in the first time step only.
+
+    """
+    if self.biofuelNoGo is None:
+      self.biofuelNoGo = compact.store(pcror(compact.load(self.excluded), \
+                                             compact.load(noGoMap)), \
+                                       self.compact)
+      self.nrStudyCells = maptotal(self.nullMask + 1)
+    noBiofuels = compact.load(self.biofuelNoGo)
     for aType in food:
       booleanMap = pcreq(self.environment, aType)
       noBiofuels = pcror(noBiofuels, booleanMap)
-    slopeGt = pcrgt(self.slopeMap, slope)
-##    report(slopeGt, 'slope' + str(slope))
-    noBiofuels = pcror(noBiofuels, slopeGt)
+    return noBiofuels
+
+  def getBiofuelPotential(self, noBiofuels, slope, provinces):
+    """Return Boolean map with area suitable for an energy crop and its total.
+
+    noBiofuels -- cells excluded for all crops, see getBiofuelExclusion()
+    slope -- maximum slope of the crop
+    provinces -- Zones of the provinces (see zonal.py) or None
+
+    The suitable fraction per province is a vector with a value per zone.
+
+    """
+    if slope not in self.steepSlopes:
+      self.steepSlopes[slope] = compact.store(pcrgt(self.slopeMap, slope), \
+                                              self.compact)
+    noBiofuels = pcror(noBiofuels, compact.load(self.steepSlopes[slope]))
     biofuelPotential = pcrnot(noBiofuels)
     scalarMap = cover(scalar(biofuelPotential), self.nullMask)
-    perProvince = areaaverage(scalarMap, provinces)
+    perProvince = None
+    if provinces is not None:
+      perProvince = provinces.mean(pcr2numpy(scalarMap, numpy.nan))
     totalArea = maptotal(scalarMap)
-    totalArea = totalArea / maptotal(self.nullMask + 1)
+    totalArea = totalArea / self.nrStudyCells
 ##    totalArea = self.reduceToOneCell(totalArea)
     return biofuelPotential, perProvince, totalArea
 
@@ -683,13 +964,30 @@ class LandUse:
     currentYieldMap = ifthen(biofuelPotential, yieldFracMap * \
                              convertedMaxYield)
     currentYield = cover(currentYieldMap, self.nullMask)
-    yieldPerProvince = areaaverage(currentYield, provinces)
+    yieldPerProvince = None
+    if provinces is not None:
+      yieldPerProvince = provinces.mean(pcr2numpy(currentYield, numpy.nan))
     totalBiofuelYield = maptotal(currentYieldMap)
 ##    totalBiofuelYield = areaaverage(currentYield, nominal(self.nullMask + 1))
-    totalBiofuelYield = totalBiofuelYield / maptotal(self.nullMask + 1)
+    totalBiofuelYield = totalBiofuelYield / self.nrStudyCells
 ##    totalBiofuelYield = self.reduceToOneCell(totalBiofuelYield)
     return currentYield, yieldPerProvince, totalBiofuelYield
 
+  def getStoredMaps(self):
+    """Return the maps kept alive between time steps, for memory reports."""
+    storedMaps = [self.environment, self.excluded, self.slopeMap, \
+                  self.distRoads, self.distWater, self.distCities, \
+                  self.yieldFrac, self.forestYieldFrac, self.scYieldFrac, \
+                  self.populationDensity, self.cattleDensity, self.dem]
+    for queued in self.regrowth.values():
+      storedMaps.extend(queued)
+    storedMaps.append(self.biofuelNoGo)
+    storedMaps.extend(self.steepSlopes.values())
+    for aType in self.landUseTypes:
+      storedMaps.extend([aType.mask, aType.initialSuitabilityMap, \
+                         aType.yieldFrac, aType.noise])
+    return storedMaps
+
   def reduceToOneCell(self, aMap):
     cloneMap = ifthen(aMap > 0, boolean(1))
     x=xcoordinate(cloneMap)
@@ -701,46 +999,462 @@ class LandUse:
 ##    print('\n',Value)
     return oneCellMap
   
+#######################################
+
+class ActiveLandUseType(LandUseType):
+  """Land use type that keeps its state as arrays over the active cells.
+
+  The static suitability is calculated with PCRaster, as in LandUseType,
+  and compressed once; dynamic factors, normalization and the allocation
+  loops work on arrays (see activecells.py). The environment is an array
+  of land use classes with -1 for No Data.
+
+  """
+
+  def setActiveCells(self, cells, environment):
+    """Switch to arrays over cells (ActiveCells) for the given environment."""
+    self.cells = cells
+    self.environment = environment
+    self.yieldValues = cells.compress(self.yieldFrac)
+    self.cellArea = cells.cellSize ** 2
+    ## TransitionCounter that records every change, or None
+    self.transitions = None
+
+  def createInitialMask(self, globalMapNoGo, privateMapsNoGo):
+    LandUseType.createInitialMask(self, globalMapNoGo, privateMapsNoGo)
+    ## No Data in the mask is excluded as well
+    self.allowed = self.cells.compress(compact.load(self.mask), 255) == 0
+
+  def createInitialSuitabilityMap(self, distRoads, distWater, distCities, \
+                                  densPopulation, densCattle, \
+                                  keepFactorMaps=False):
+    LandUseType.createInitialSuitabilityMap(self, distRoads, distWater, \
+                                            distCities, densPopulation, \
+                                            densCattle, keepFactorMaps)
+    self.initialSuitability = self.cells.compress(self.initialSuitabilityMap)
+    self.initialSuitabilityMap = None
+
+  def getNeighborSuitability(self, windowLength=None):
+    related = numpy.isin(self.environment, \
+                         [self.typeNr] + list(self.relatedTypeList))
+    scalarSelf = related.astype(numpy.float32)
+    scalarSelf[self.environment < 0] = numpy.nan
+    if windowLength is None:
+      windowLength = self.getWindowLength()
+    nrNeighborsSameLU = self.cells.windowTotal(scalarSelf, windowLength) - \
+                        scalarSelf
+    maxNr = ((windowLength / self.cells.cellSize)**2) - 1
+    return nrNeighborsSameLU / maxNr
+
+  def getEdgeSuitability(self):
+    notSelf = (self.environment != self.typeNr).astype(numpy.uint8)
+    notSelf[self.environment < 0] = 255
+    if self.distanceTransform == 0:
+      ## Distances along the map are left to spread()
+      distEdge = spread(self.cells.expand(notSelf, Boolean, 255), 1, 1)
+      return activecells.normalize(-1 / self.cells.compress(distEdge))
+    sources = self.cells.toGrid(notSelf == 1, False)
+    distEdge = distance.euclidean(sources, self.cells.cellSize, \
+                                  *self.cells.getDistanceBuffers())
+    ## Initial distance 1, as in spread(notSelf, 1, 1)
+    distEdge = distEdge.ravel()[self.cells.index] + 1
+    distEdge[notSelf == 255] = numpy.nan
+    return activecells.normalize(-1 / distEdge)
+
+  def getCurrentLandUseSuitability(self):
+    variableDict = self.variableDict.get(9)
+    current = numpy.zeros(self.cells.nrCells, dtype=numpy.float32)
+    for aKey in variableDict.keys():
+      current[self.environment == aKey] = variableDict.get(aKey)
+    current[self.environment < 0] = numpy.nan
+    return activecells.normalize(current)
+
+  def getTotalSuitabilityMap(self):
+    """Return the total suitability as array, NaN where not allowed."""
+    suitability = numpy.zeros(self.cells.nrCells, dtype=numpy.float32)
+    i = 0
+    for aFactor in self.suitFactorList:
+      with profiler.phase('suitability', landUseType=self.typeNr, \
+                          factor=aFactor):
+        if aFactor == 1:
+          suitability += self.weightList[i] * self.getNeighborSuitability()
+        elif aFactor == 8:
+          suitability += self.weightList[i] * self.getEdgeSuitability()
+        elif aFactor == 9:
+          suitability += self.weightList[i] * \
+                         self.getCurrentLandUseSuitability()
+        elif aFactor not in (2, 3, 4, 5, 6, 7):
+          print('ERROR: unknown suitability factor for landuse', self.typeNr)
+      i += 1
+    suitability += self.weightInitialSuitabilityMap * self.initialSuitability
+    suitability[~self.allowed] = numpy.nan
+    self.totalSuitabilityMap = activecells.normalize(suitability)
+    return self.totalSuitabilityMap
+
+  def getOwnMaximum(self, values):
+    """Return the maximum of values on the cells of this type."""
+    own = values[self.environment == self.typeNr]
+    if len(own) == 0:
+      return 0.0
+    return float(numpy.nanmax(own))
+
+  def setMaxYield(self, maxYield):
+    """Set the maximum yield per cell from an array of the tss values."""
+    convertedMaxYield = (maxYield / self.toMeters) * self.cellArea
+    self.setMaxYieldPerCell(self.getOwnMaximum(convertedMaxYield))
+
+  def setMaxYieldPerCell(self, maxYield):
+    """Set the maximum yield per cell of this type (a number)."""
+    self.maxYield = maxYield
+    self.yieldMap = numpy.nan_to_num(self.yieldValues * self.maxYield)
+
+  def updateYield(self, env):
+    self.totalYield = float(self.yieldMap[env == self.typeNr].sum())
+
+  def allocate(self, demand, tempEnvironment, immutables):
+    """Assess total yield, compare with demand and add or remove difference.
+
+    Same as LandUseType.allocate() with arrays for the demand, environment
+    and immutables (Boolean). The demand can also be the number for this
+    type already.
+
+    """
+    self.setDemand(demand, tempEnvironment)
+    if self.forest:
+      log(2, 'forest,', self.typeNr,'so remove')
+      self.removeForest()
+    else:
+      log(1, 'total yield is:', self.totalYield)
+      if self.totalYield > self.demand:
+        log(2, 'remove')
+        self.remove()
+      elif self.totalYield < self.demand:
+        log(2, 'add')
+        self.add(immutables)
+      else:
+        log(2, 'do nothing')
+    newImmutables = immutables | (self.environment == self.typeNr)
+    return self.environment, newImmutables
+
+  def setDemand(self, demand, tempEnvironment):
+    """Start the allocation: set environment, yield on it and demand."""
+    self.deforestated = None
+    self.setEnvironment(tempEnvironment)
+    self.updateYield(tempEnvironment)
+    if isinstance(demand, numpy.ndarray):
+      demand = self.getOwnMaximum(demand)
+    self.demand = demand
+    log(1, '\nland use type', self.typeNr)
+    log(1, 'demand is:', self.demand)
+
+  def rank(self, cells, descending):
+    """Return cells sorted on suitability + the running total of their yield.
+
+    The totals replace the yield update of every loop iteration: the yield
+    of the first n ranked cells is totals[n].
+
+    """
+    suitability = self.totalSuitabilityMap[cells]
+    if descending:
+      suitability = -suitability
+    ranked = cells[numpy.argsort(suitability, kind='stable')]
+    totals = numpy.zeros(len(ranked) + 1)
+    numpy.cumsum(self.yieldMap[ranked], out=totals[1:])
+    return ranked, totals
+
+  def setClass(self, cells, typeNr):
+    """Give cells the class typeNr in a copy of the environment."""
+    if self.transitions is not None:
+      self.transitions.record(cells, self.environment[cells])
+    environment = self.environment.copy()
+    environment[cells] = typeNr
+    self.setEnvironment(environment)
+
+  def add(self, immutables):
+    """Add cells of this land use type until demand is fullfilled."""
+    candidates = numpy.flatnonzero(~immutables & \
+                                   (self.environment != self.typeNr) & \
+                                   ~numpy.isnan(self.totalSuitabilityMap))
+    ranked, gained = self.rank(candidates, True)
+    ownYield = self.totalYield
+    ## Cells are taken from the top of the ranking, as with order()
+    maxIndex = len(ranked)
+    diff = float(self.demand - self.totalYield)
+    x = int(maxIndex - diff / self.maxYield)
+    xPrev = maxIndex
+    i = 0
+    nrAdded = 0
+    while diff > 0 and xPrev > x:
+      log(2, 'cells to add', int(maxIndex - x))
+      if x < 0:
+        log(0, 'No space left for land use', self.typeNr)
+        break
+      else:
+        nrAdded = maxIndex - x
+        self.totalYield = ownYield + gained[nrAdded]
+        i += 1
+        xPrev = x
+        ## Number of cells to be allocated
+        diff = float(self.demand - self.totalYield)
+        x -= int(diff / self.maxYield)
+    self.setClass(ranked[:nrAdded], self.typeNr)
+    log(1, 'iterations', i, 'end yield is', self.totalYield)
+    profiler.count(i)
+
+  def remove(self):
+    """Remove cells of this land use type until demand is fullfilled."""
+    own = numpy.flatnonzero((self.environment == self.typeNr) & \
+                            ~numpy.isnan(self.totalSuitabilityMap))
+    ranked, lost = self.rank(own, False)
+    ownYield = self.totalYield
+    diff = float(self.totalYield - self.demand)
+    x = int(diff / (self.maxYield * 0.8))
+    xPrev = 0
+    i = 0
+    nrRemoved = 0
+    while diff > 0 and xPrev < x and i < 100:
+      log(2, 'cells to remove', x)
+      ## Ranks below x, as ordered < x, are turned into 'abandoned'
+      nrRemoved = min(max(x - 1, 0), len(ranked))
+      self.totalYield = ownYield - lost[nrRemoved]
+      i += 1
+      xPrev = x
+      diff = float(self.totalYield - self.demand)
+      if i % 40 == 0:
+        log(2, 'NOT getting there...')
+        x = 2 * (x + int(diff / self.maxYield))
+      else:
+        x += int(diff / self.maxYield)
+    self.setClass(ranked[:nrRemoved], 99)
+    log(1, 'iterations', i, 'end yield is', self.totalYield)
+    profiler.count(i)
+
+  def removeForest(self):
+    """Remove area of forest indicated in time series."""
+    if self.demand < 0.01:
+      log(1, 'nothing to remove')
+      return
+    own = numpy.flatnonzero((self.environment == self.typeNr) & \
+                            ~numpy.isnan(self.totalSuitabilityMap))
+    ranked, removed = self.rank(own, False)
+    diff = 1
+    x = int(self.demand / self.maxYield * 0.8)
+    xPrev = 0
+    i = 0
+    nrRemoved = 0
+    while diff > 0 and xPrev < x and i < 100:
+      log(2, 'cells to remove', x)
+      nrRemoved = min(max(x - 1, 0), len(ranked))
+      ## Yield of the removed cells only
+      self.totalYield = removed[nrRemoved]
+      i += 1
+      xPrev = x
+      diff = float(self.demand - self.totalYield)
+      if i % 40 == 0:
+        log(2, 'NOT getting there...')
+        x = 2 * (x + int(diff / self.maxYield))
+      else:
+        x += int(diff / self.maxYield)
+    if nrRemoved > 0:
+      self.deforestated = ranked[:nrRemoved]
+    self.setClass(ranked[:nrRemoved], 98)
+    log(1, 'iterations', i, 'removed biomass is', self.totalYield)
+    profiler.count(i)
+
+class ActiveLandUse(LandUse):
+  """Land use with the land use map as array over the active cells.
+
+  self.environment is rebuilt as map by getEnvironment(), for the outputs.
+
+  """
+
+  typeClass = ActiveLandUseType
+
+  def __init__(self, types, environment, nullMask):
+    LandUse.__init__(self, types, environment, nullMask)
+    self.cells = activecells.ActiveCells(nullMask)
+    self.values = self.cells.compress(environment, -1, numpy.int32)
+    self.competitive = Parameters.getCompetitiveAllocation()
+    log(1, 'active cells: %d of %d' %(self.cells.nrCells, \
+          self.cells.shape[0] * self.cells.shape[1]))
+
+  def setEnvironment(self, environment):
+    """Update the array of land use classes of LandUse and the types."""
+    self.values = environment
+    for aType in self.landUseTypes:
+      aType.setEnvironment(environment)
+
+  def createLandUseTypeObjects(self, relatedTypeDict, suitabilityDict, \
+                               weightDict, variableSuperDict, noise):
+    LandUse.createLandUseTypeObjects(self, relatedTypeDict, suitabilityDict, \
+                                     weightDict, variableSuperDict, noise)
+    for aType in self.landUseTypes:
+      aType.setActiveCells(self.cells, self.values)
+
+  def determineNoGoAreas(self, noGoMap, noGoLanduseList, privateNoGoSlopeDict):
+    LandUse.determineNoGoAreas(self, noGoMap, noGoLanduseList, \
+                               privateNoGoSlopeDict)
+    ## No Data is immutable as well
+    self.immutables = self.cells.compress(compact.load(self.excluded), \
+                                          255) != 0
+
+  def allocate(self, maxYield, demand):
+    """Allocate with maps of maximum yield and demand per land use class."""
+    self.timeStep += 1
+    maxYield = self.cells.compress(maxYield)
+    demand = self.cells.compress(demand)
+    tempEnvironment = self.values
+    immutables = self.immutables
+    if self.competitive == 1:
+      for aType in self.landUseTypes:
+        aType.setMaxYield(maxYield)
+      tempEnvironment = competition.allocate(self.landUseTypes, \
+                        [demand] * self.nrOfTypes, tempEnvironment, immutables)
+      for aType in self.landUseTypes:
+        self.scheduleRegrowth(aType.deforestated)
+      self.setEnvironment(tempEnvironment)
+      return
+    for aType in self.landUseTypes:
+      with profiler.phase('allocate', landUseType=aType.typeNr):
+        aType.setMaxYield(maxYield)
+        tempEnvironment, immutables = aType.allocate(demand, \
+                                                     tempEnvironment, \
+                                                     immutables)
+        self.scheduleRegrowth(aType.deforestated)
+    self.setEnvironment(tempEnvironment)
+
+  def scheduleRegrowth(self, deforestated):
+    """Queue cells deforestated in this time step (positions) to regrow."""
+    if deforestated is None:
+      return
+    regrowthStep = self.timeStep + self.regrowthDelay - 1
+    self.regrowth.setdefault(regrowthStep, []).append(deforestated)
+
+  def growForest(self):
+    """Regrow forest at the cells queued for this time step."""
+    queued = self.regrowth.pop(self.timeStep, [])
+    if len(queued) == 0:
+      return
+    cells = numpy.concatenate(queued)
+    cells = cells[self.values[cells] == 98]
+    if self.transitions is not None:
+      self.transitions.record(cells, self.values[cells])
+    environment = self.values.copy()
+    environment[cells] = self.forest
+    self.setEnvironment(environment)
+
+  def finishTransitions(self):
+    self.transitions.finishStep(self.timeStep, self.values)
+
+  def getEnvironment(self):
+    """Return the current land use map, built from the array."""
+    self.environment = self.cells.expand(self.values, Nominal, -1)
+    return self.environment
+
+  def getStoredMaps(self):
+    storedMaps = LandUse.getStoredMaps(self)
+    storedMaps.extend([self.values, self.immutables])
+    for aType in self.landUseTypes:
+      storedMaps.extend([aType.allowed, aType.initialSuitability, \
+                         aType.yieldValues])
+    return storedMaps
+
 ######################################
 
 class LandUseChangeModel(DynamicModel, MonteCarloModel):
-  def __init__(self):
+  def __init__(self, keepFactorMaps=False):
     DynamicModel.__init__(self)
     MonteCarloModel.__init__(self)
     setclone('landuse.map')
+    ## Keep the static suitability per factor, see sweep.py
+    self.keepFactorMaps = keepFactorMaps
+
+  def inputToMap(self, valueScale, cells, mv):
+    """Return the map of input cells read by inputs.InputLoader."""
+    dataTypes = {csf.VS_BOOLEAN: Boolean, csf.VS_NOMINAL: Nominal, \
+                 csf.VS_ORDINAL: Ordinal, csf.VS_SCALAR: Scalar, \
+                 csf.VS_DIRECTION: Directional, csf.VS_LDD: Ldd}
+    return numpy2pcr(dataTypes[valueScale], cells, mv)
+
+  def coverInput(self, booleanMap):
+    """Return a Boolean input with false for No Data in the study area."""
+    if booleanMap is None:
+      return None
+    covered = cover(booleanMap, boolean(self.nullMask))
+    return compact.store(covered, self.compact)
+
+  def normalizeInput(self, scalarMap):
+    """Return a scalar input divided by its maximum."""
+    if scalarMap is None:
+      return None
+    return scalarMap / mapmaximum(scalarMap)
+
+  def getSampleNumbers(self):
+    """Return the nrs of the Monte Carlo samples of the run."""
+    return list(self.sampleNumbers())
 
   def premcloop(self):
-    self.initialEnvironment = self.readmap('landuse')
-    self.nullMask = self.readmap('nullMask')
-    roads = self.readmap('roads')
-    water = self.readmap('water')
-    cities = self.readmap('cities')
-    bioNoGo = self.readmap('bioNoGo')
-    noGoMap = readmap('noGo')
-    yieldFrac = self.readmap('yield')
-    forestYieldFrac = self.readmap('biomass')
-    scYieldFrac = self.readmap('scYield')
-    population = self.readmap('popDensity')
-    cattle = self.readmap('cattleDensity')
-    self.dem = self.readmap('dem')
-    self.provinces = self.readmap('provinces')
-
-    self.roads = cover(roads, boolean(self.nullMask))
-    self.water = cover(water, boolean(self.nullMask))
-    self.cities = cover(cities, boolean(self.nullMask))
-    self.bioNoGo = cover(bioNoGo, boolean(self.nullMask))
-    self.noGoMap = cover(noGoMap, boolean(self.nullMask))
-    self.yieldFrac = yieldFrac / mapmaximum(yieldFrac)
-    self.forestYieldFrac = forestYieldFrac / mapmaximum(forestYieldFrac)
-    self.scYieldFrac = scYieldFrac / mapmaximum(scYieldFrac)
-    self.populationDensity = population / mapmaximum(population)
-    self.cattleDensity = cattle / mapmaximum(cattle)
+    instrumentation.configure(Parameters.getVerbosity(), \
+                              Parameters.getProfiling())
+    profiler.setContext(None, None)
+    ## Read only the maps the factors, no-go rules and outputs need
+    self.outputs = Parameters.getOutputList()
+    ## Coarser copies of every output map, see overviews.py
+    overviews = Parameters.getOverviews()
+    self.overviewFactors = overviews[1] if overviews[0] == 1 else []
+    self.writer = outputwriter.OutputWriter(*Parameters.getOutputWriting(), \
+                                            self.overviewFactors)
+    ## Land use stored as changes, with a DeltaWriter per sample
+    self.landUseDeltas = Parameters.getLandUseDeltas()
+    self.deltaWriters = {}
+    required = inputs.getRequiredInputs(Parameters.getLandUseList(), \
+                                        Parameters.getSuitFactorDict(), \
+                                        Parameters.getForestNr(), \
+                                        Parameters.getPrivateNoGoSlopeDict(), \
+                                        self.outputs)
+    loader = inputs.InputLoader(self.inputToMap, required)
+    self.compact = Parameters.getCompactStorage()
+    self.activeCells = Parameters.getActiveCells()
+    if Parameters.getCompetitiveAllocation() == 1 and self.activeCells == 0:
+      log(0, 'competitive allocation works on the active cells, ' \
+             'getActiveCells() is taken as 1')
+      self.activeCells = 1
+    self.initialEnvironment = compact.store(loader.get('landuse'), \
+                                            self.compact)
+    self.nullMask = loader.get('nullMask')
+    self.dem = loader.get('dem')
+    self.provinces = None
+    ## Zones for statistics per province and per extra zone map
+    self.zoneSets = {}
+    provinces = loader.get('provinces')
+    if provinces is not None:
+      self.provinces = zonal.Zones('provinces', pcr2numpy(provinces, -1), -1)
+      self.zoneSets['provinces'] = self.provinces
+    zoneMaps = Parameters.getZoneMaps()
+    for aName in zoneMaps:
+      self.zoneSets[aName] = zonal.readZones(aName, zoneMaps.get(aName), \
+                             (clone().nrRows(), clone().nrCols()), \
+                             (clone().west(), clone().north(), \
+                              clone().cellSize()))
+
+    self.roads = self.coverInput(loader.get('roads'))
+    self.water = self.coverInput(loader.get('water'))
+    self.cities = self.coverInput(loader.get('cities'))
+    self.bioNoGo = self.coverInput(loader.get('bioNoGo'))
+    self.noGoMap = self.coverInput(loader.get('noGo'))
+    self.yieldFrac = self.normalizeInput(loader.get('yield'))
+    self.forestYieldFrac = self.normalizeInput(loader.get('biomass'))
+    self.scYieldFrac = self.normalizeInput(loader.get('scYield'))
+    self.populationDensity = self.normalizeInput(loader.get('popDensity'))
+    self.cattleDensity = self.normalizeInput(loader.get('cattleDensity'))
+    loader.close()
 
     ## Check which maps should get random noise
     self.stochYield = Parameters.getStochYield()
     self.stochPopulation = Parameters.getStochPopulationDensity()
     self.stochCattle = Parameters.getStochCattleDensity()
     self.stochDem = Parameters.getStochDem()
+    self.errorFields = Parameters.getErrorFields()
 
     ## List of landuse types in order of 'who gets to choose first'
     self.landUseList = Parameters.getLandUseList()
@@ -754,20 +1468,111 @@ class LandUseChangeModel(DynamicModel, MonteCarloModel):
     self.noGoLanduseList = Parameters.getNoGoLanduseTypes()
     self.privateNoGoSlopeDict = Parameters.getPrivateNoGoSlopeDict()
 
+    ## Draws per sample from counter-based streams, or the global stream
+    streams.configure(*Parameters.getRandomStreams())
     ## Uniform map of very small numbers, used to avoid equal suitabilities
-    self.noise = uniform(1)/10000
+    self.noise = streams.uniform('noise')/10000
+
+    ## Post-processing runs in the background while the samples are simulated
+    self.postProcessing = postprocessing.PostProcessingPipeline()
+    self.registerPostProcessing(zoneMaps)
+
+  def registerPostProcessing(self, zoneMaps):
+    """Register the movies, statistics and tables made during the run."""
+    if 'landUse' in self.outputs:
+      self.postProcessing.register(postprocessing.LandUseMovie(1))
+    if len(self.getSampleNumbers()) > 1:
+      ## Stochastic variables for which mean, var and percentiles are needed
+      names = ['euSc', 'euTo', 'euPr', 'eY', 'eYPr', 'eYTo']
+      names = [aName for aName in names if aName in self.outputs]
+      if len(names) > 0:
+        self.postProcessing.register(postprocessing.McStatistics(names, \
+                                     self.getSampleNumbers(), self.provinces, \
+                                     self.overviewFactors))
+      if 'euSc' in names:
+        self.postProcessing.register(postprocessing.AvailabilityMovie( \
+                                     'euSc-ave', self.nrTimeSteps()))
+    if len(zoneMaps) > 0:
+      ## Area and yield of the bioenergy crops per zone, for every zone set
+      self.postProcessing.register(postprocessing.ZonalTable( \
+                                   ['scSc', 'sY', 'euSc', 'eY'], \
+                                   self.zoneSets))
+
+  def startRandomStreams(self):
+    """Start the random streams of the current sample."""
+    streams.setSample(self.currentSampleNumber())
+
+  def getErrorFields(self):
+    """Return a standard normal random field map per input that gets noise."""
+    correlationLengths = self.errorFields[1]
+    names = []
+    if self.stochYield[0] == 1:
+      for aName, aMap in [('yield', self.yieldFrac), \
+                          ('biomass', self.forestYieldFrac), \
+                          ('scYield', self.scYieldFrac)]:
+        if aMap is not None:
+          names.append(aName)
+    if self.stochPopulation[0] == 1 and self.populationDensity is not None:
+      names.append('popDensity')
+    if self.stochCattle[0] == 1 and self.cattleDensity is not None:
+      names.append('cattleDensity')
+    if self.stochDem[0] == 1 and self.dem is not None:
+      names.append('dem')
+    rng = randomfields.getGenerator(self.errorFields[2], \
+                                    streams.getSample('fields'))
+    shape = (clone().nrRows(), clone().nrCols())
+    lengths = {aName: correlationLengths[aName] for aName in names}
+    fields = randomfields.getErrorFields(lengths, shape, clone().cellSize(), \
+                                         rng)
+    return {aName: numpy2pcr(Scalar, aField, -9999) \
+            for aName, aField in fields.items()}
+
+  def getTransitionCounter(self):
+    """Return a TransitionCounter for the land use, also per province."""
+    labels = None
+    ids = None
+    if self.provinces is not None:
+      labels = numpy.full(clone().nrRows() * clone().nrCols(), -1)
+      labels[self.provinces.cells] = self.provinces.labels
+      if self.activeCells == 1:
+        labels = labels[self.landUse.cells.index]
+      ids = self.provinces.ids
+    ## Area in the unit of the maximum yield, e.g. ha
+    cellArea = clone().cellSize() ** 2 / Parameters.getConversionUnit()
+    return transitions.TransitionCounter(labels, ids, cellArea)
 
   def initial(self):
+    profiler.setContext(self.currentSampleNumber(), 0)
+    self.startRandomStreams()
+    if self.currentSampleNumber() == max(self.getSampleNumbers()):
+      ## Statistics over the samples read the outputs of the other samples
+      with profiler.phase('report', output='flush'):
+        self.writer.flush()
     ## Create the 'overall' landuse class
-    self.environment = self.initialEnvironment
-    self.landUse = LandUse(self.landUseList, self.environment, self.nullMask)
+    self.environment = compact.load(self.initialEnvironment)
+    if self.landUseDeltas[0] == 1 and 'landUse' in self.outputs:
+      sample = self.currentSampleNumber()
+      os.makedirs(str(sample), exist_ok=True)
+      self.deltaWriters[sample] = landusedeltas.DeltaWriter( \
+                                  landusedeltas.getPath('landUse', str(sample)), \
+                                  postprocessing.toArray(self.environment), \
+                                  self.landUseDeltas[1])
+    if self.activeCells == 1:
+      self.landUse = ActiveLandUse(self.landUseList, self.environment, \
+                                   self.nullMask)
+    else:
+      self.landUse = LandUse(self.landUseList, self.environment, self.nullMask)
 
     ## Add some random noise to maps for which this in indicated in Parameters
+    errors = None
+    if self.errorFields[0] == 1:
+      with profiler.phase('errorFields'):
+        errors = self.getErrorFields()
     self.landUse.addRandomNoise(self.yieldFrac, self.forestYieldFrac, \
                                 self.scYieldFrac, self.populationDensity, \
                                 self.cattleDensity, self.dem, \
                                 self.stochYield, self.stochPopulation, \
-                                self.stochCattle, self.stochDem)
+                                self.stochCattle, self.stochDem, errors)
 
     ## Create an object for every landuse type in the list
     self.landUse.createLandUseTypeObjects(self.relatedTypeDict, \
@@ -775,25 +1580,39 @@ class LandUseChangeModel(DynamicModel, MonteCarloModel):
                                           self.weightDict, \
                                           self.variableSuperDictionary, \
                                           self.noise)
+    if 'transitions' in self.outputs:
+      self.landUse.setTransitions(self.getTransitionCounter())
 
     ## Static suitability factors
-    self.landUse.determineNoGoAreas(self.noGoMap, self.noGoLanduseList, \
+    self.landUse.determineNoGoAreas(compact.load(self.noGoMap), \
+                                    self.noGoLanduseList, \
                                     self.privateNoGoSlopeDict)
-    self.landUse.determineDistanceToRoads(self.roads)
-    self.landUse.determineDistanceToWater(self.water)
-    self.landUse.determineDistanceToLargeCities(self.cities)
-    self.landUse.calculateStaticSuitabilityMaps()
+    with profiler.phase('distance', target='roads'):
+      self.landUse.determineDistanceToRoads(compact.load(self.roads))
+    with profiler.phase('distance', target='water'):
+      self.landUse.determineDistanceToWater(compact.load(self.water))
+    with profiler.phase('distance', target='cities'):
+      self.landUse.determineDistanceToLargeCities(compact.load(self.cities))
+    self.landUse.calculateStaticSuitabilityMaps(self.keepFactorMaps)
+    ## Memory of maps kept during the sample, as stored and without compaction
+    actual, full = compact.getFootprint(self.landUse.getStoredMaps() + \
+                   [self.initialEnvironment, self.bioNoGo, self.noGoMap, \
+                    self.roads, self.water, self.cities])
+    log(1, 'maps kept in memory: %.1f MB (%.1f MB without compact storage)' \
+          %(actual / 1e6, full / 1e6))
           
     ## Draw random numbers between zero and one
     ## To determine yield and demand
-    self.demandStoch = mapuniform()
-    print('FRACTION DEMAND IS',round(float(self.demandStoch),2),'\n')
-    self.maxYieldStoch = mapnormal() * self.stochYield[2]
-    self.bioMaxYieldStoch = mapnormal() * self.stochYield[2]
+    self.demandStoch = streams.mapuniform('demand')
+    log(1, 'FRACTION DEMAND IS',round(float(self.demandStoch),2),'\n')
+    self.maxYieldStoch = streams.mapnormal('maxYield') * self.stochYield[2]
+    self.bioMaxYieldStoch = streams.mapnormal('bioMaxYield') * \
+                            self.stochYield[2]
 
   def dynamic(self):
     timeStep = self.currentTimeStep()
-    print('\ntime step', timeStep)
+    profiler.setContext(self.currentSampleNumber(), timeStep)
+    log(1, '\ntime step', timeStep)
 
     ## Get max yield and demand per land use type
     maxYield = timeinputscalar('maxYield.tss', self.environment)
@@ -818,74 +1637,115 @@ class LandUseChangeModel(DynamicModel, MonteCarloModel):
 
     ## Allocate new land use using demands of current time step
     self.landUse.allocate(maxYield, demand)
-    self.landUse.growForest()
+    with profiler.phase('growForest'):
+      self.landUse.growForest()
+    if self.landUse.transitions is not None:
+      with profiler.phase('transitions'):
+        self.landUse.finishTransitions()
+        if timeStep == self.nrTimeSteps():
+          self.landUse.transitions.write(generateNameS('transitions.csv', \
+                                         self.currentSampleNumber()))
     self.environment = self.landUse.getEnvironment()
 
-    self.report(self.environment, 'landUse')
-    os.system('legend --clone landuse.map -f \"legendLU.txt\" %s ' \
-              %generateNameST('landUse', self.currentSampleNumber(),timeStep))
-
+    outputs = {'landUse': self.environment}
 
     ## Check which area is available for bioenergy crops
     ## and the total area per province and for the whole country
-    sc, scPr, scTot = self.landUse.getBiofuelPotential(self.bioNoGo, \
-                                   self.food, 0.09, self.provinces)
-    eu, euPr, euTot = self.landUse.getBiofuelPotential(self.bioNoGo, \
-                                   self.food, 1, self.provinces)
-    scSc = scalar(sc)
-    euSc = scalar(eu)
-
-    ## sugar cane
-    self.report(sc, 'sc')
-    self.report(scSc, 'scSc')  
-    self.report(scTot, 'scTo')
-    self.report(scPr, 'scPr')
-
-    ## eucalyptus
-    self.report(eu, 'eu')
-    self.report(euSc, 'euSc')
-    self.report(euTot, 'euTo')
-    self.report(euPr, 'euPr') 
-
-    ## Calculate the potential yield per cell, per province and total
-    scYield, syPr, syTot = self.landUse.getPotentialBiofuelYield(sc, 'sc', \
-                                                  scMaxYield, self.provinces)
-    euYield, eyPr, eyTot = self.landUse.getPotentialBiofuelYield(eu, 'eu', \
-                                                  euMaxYield, self.provinces)    
-    ## sugar cane
-    self.report(scYield, 'sY')   
-    self.report(syPr, 'sYPr')    
-    self.report(syTot, 'sYTo')
-
-    ## eucalyptus
-    self.report(euYield, 'eY')
-    self.report(eyPr, 'eYPr')
-    self.report(eyTot, 'eYTo')
+    ## and calculate the potential yield per cell, per province and total
+    self.addBiofuelOutputs(outputs, scMaxYield, euMaxYield)
+
+    self.reportOutputs(outputs)
+
+    ## Hand the outputs over to the post-processing consumers
+    sample = self.currentSampleNumber()
+    self.postProcessing.timeStepFinished(sample, timeStep, outputs)
+    if timeStep == self.nrTimeSteps():
+      self.postProcessing.sampleFinished(sample)
     
+  def addBiofuelOutputs(self, outputs, scMaxYield, euMaxYield):
+    """Add area and yield outputs of sugar cane and eucalyptus to outputs.
+
+    Only done for outputs in the output list; the names per crop are in the
+    order area, scalar area, total, per province, yield, yield per province
+    and total yield, e.g. 'sc', 'scSc', 'scTo', 'scPr', 'sY', 'sYPr', 'sYTo'.
+    The exclusion that both crops share is made once; the crops differ in
+    maximum slope (0.09 and 1) and yield.
+
+    """
+    crops = [('sc', inputs.SC_OUTPUTS, 0.09, scMaxYield), \
+             ('eu', inputs.EU_OUTPUTS, 1, euMaxYield)]
+    crops = [aCrop for aCrop in crops \
+             if inputs.needsOutput(self.outputs, aCrop[1])]
+    if len(crops) == 0:
+      return
+    with profiler.phase('biofuel', crop='all'):
+      noBiofuels = self.landUse.getBiofuelExclusion(self.bioNoGo, self.food)
+    for crop, names, slope, maxYield in crops:
+      with profiler.phase('biofuel', crop=crop):
+        area, perProvince, total = self.landUse.getBiofuelPotential( \
+                                   noBiofuels, slope, self.provinces)
+        outputs.update({names[0]: area, names[1]: scalar(area), \
+                        names[2]: total, names[3]: perProvince})
+        if inputs.needsOutput(self.outputs, names[4:]):
+          yieldMap, yieldPerProvince, totalYield = \
+                    self.landUse.getPotentialBiofuelYield(area, crop, \
+                                                          maxYield, \
+                                                          self.provinces)
+          outputs.update({names[4]: yieldMap, names[5]: yieldPerProvince, \
+                          names[6]: totalYield})
+
+  def reportOutputs(self, outputs):
+    """Report the maps in outputs (dict) that are in the output list."""
+    sample = self.currentSampleNumber()
+    for aName in self.outputs:
+      aMap = outputs.get(aName)
+      if aMap is not None:
+        with profiler.phase('report', output=aName):
+          if aName == 'landUse' and sample in self.deltaWriters:
+            self.writeLandUseDelta(sample, aMap)
+            continue
+          if isinstance(aMap, numpy.ndarray):
+            ## Values per province are spread over the provinces
+            aMap = self.provinces.toArray(aMap)
+          legend = None
+          if aName == 'landUse':
+            legend = 'legendLU.txt'
+          self.writer.write(aMap, generateNameST(aName, sample, \
+                            self.currentTimeStep()), legend)
+
+  def writeLandUseDelta(self, sample, landUse):
+    """Add the land use map to the delta file of the sample."""
+    timeStep = self.currentTimeStep()
+    self.deltaWriters[sample].write(timeStep, postprocessing.toArray(landUse))
+    if timeStep == self.nrTimeSteps():
+      self.deltaWriters.pop(sample).close()
+
   def postmcloop(self):
-    print('\nrunning postmcloop...')
-    print('...making movie of land use for 1 sample...')
-    command = "python movie_land_use.py"
-    os.system(command)
-    if int(self.nrSamples()) > 1:
-      ## Stochastic variables for which mean, var and percentiles are needed
-      print('...calculating statistics...')
-      names = ['euSc', 'euTo', 'euPr', 'eY', 'eYPr', 'eYTo']
-      sampleNumbers = self.sampleNumbers()
-      timeSteps = self.timeSteps()
-      percentiles = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
-      mcaveragevariance(names, sampleNumbers, timeSteps)
-      names = ['eY', 'eYPr', 'eYTo']
-      #mcpercentiles(names, percentiles, sampleNumbers, timeSteps)
-      print('...making movie of availability...')
-      command = "python movie_availability.py"
-      os.system(command)
-
-    print('\n...done')
-
-nrOfTimeSteps = Parameters.getNrTimesteps()
-nrOfSamples = Parameters.getNrSamples()
-myModel = LandUseChangeModel()
-dynamicModel = DynamicFramework(myModel,nrOfTimeSteps)
-mcModel = MonteCarloFramework(dynamicModel, nrOfSamples)
-mcModel.run()
+    log(1, '\nrunning postmcloop...')
+    ## Movies and statistics were made during the run, wait for the rest
+    log(1, '...writing the last outputs...')
+    with profiler.phase('report', output='flush'):
+      self.writer.close()
+    log(1, '...finishing post-processing...')
+    self.postProcessing.close()
+    if profiler.enabled == 1:
+      traceFile = Parameters.getProfiling()[1]
+      profiler.writeTrace(traceFile)
+      log(0, '\ntiming per phase, trace written to', traceFile)
+      log(0, profiler.getSummary())
+    peakMemory = instrumentation.getPeakMemory()
+    if peakMemory is not None:
+      log(1, 'peak memory use: %.1f MB' %peakMemory)
+    #names = ['eY', 'eYPr', 'eYTo']
+    #percentiles = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+    #mcpercentiles(names, percentiles, self.sampleNumbers(), self.timeSteps())
+
+    log(1, '\n...done')
+
+if __name__ == '__main__':
+  nrOfTimeSteps = Parameters.getNrTimesteps()
+  nrOfSamples = Parameters.getNrSamples()
+  myModel = LandUseChangeModel()
+  dynamicModel = DynamicFramework(myModel,nrOfTimeSteps)
+  mcModel = MonteCarloFramework(dynamicModel, nrOfSamples)
+  mcModel.run()
@@ -56,6 +56,36 @@ def getStochDem():
   standardDeviation = 1
   return [stochastic, standardDeviation]
 
+def getErrorFields():
+  """Return 1 when the random errors above should vary in space + settings.
+
+  When 0 every map gets one error for all its cells. When 1 every cell gets
+  its own error, from a Gaussian random field with the standard deviation of
+  the methods above and the correlation length (m) per input map below; the
+  correlation between cells at distance d is exp(-(d / length) ** 2).
+  The fields of a sample are generated from the seed and the sample nr."""
+
+  correlated = 0
+  correlationLengths = {'yield': 50000, 'biomass': 50000, 'scYield': 50000, \
+                        'popDensity': 20000, 'cattleDensity': 20000, \
+                        'dem': 2000}
+  seed = 1
+  return [correlated, correlationLengths, seed]
+
+def getRandomStreams():
+  """Return 1 to draw per sample from its own random stream + run seed.
+
+  When 1 all random numbers of a sample (demand, max yield, window length,
+  max distances and the errors above) come from counter-based streams of
+  the seed and the sample nr, so a sample gives the same results when it is
+  run on its own with rerun.py. When 0 (the default) they come from the
+  global stream of PCRaster, which depends on the samples run before; set
+  streams to 1 to rerun samples."""
+
+  streams = 0
+  seed = 1
+  return [streams, seed]
+
 def getStochDistance():
   """Return 1 when the max distance should have a random error.
 
@@ -67,11 +97,152 @@ def getStochDistance():
   stochastic = 0
   return stochastic
 
+def getDistanceTransform():
+  """Return how the distances to roads, water and cities are calculated.
+
+  0 -- spread(), cost distance along the 8 neighbours of every cell
+  1 -- exact Euclidean distance, also for the distance to the edge in
+       suitability factor 8 with getActiveCells() 1
+  2 -- as 1, but roads, water and cities only up to the largest maximum
+       distance of factors 2, 3 and 4 of the types (twice that with
+       getStochDistance()); cells further away get No Data, which the
+       factors treat as beyond their maximum distance"""
+
+  distanceTransform = 0
+  return distanceTransform
+
 def getStochWindow():
   """Return 1 when the window length in suit factor 1 should have add error."""
   stochastic = 0
   return stochastic
 
+def getOutputList():
+  """Return list of outputs reported every time step (see manual, Table 3).
+
+  Inputs that are only needed for outputs not in this list are not read,
+  e.g. without 'sY', 'sYPr' and 'sYTo' the map scYield.map is not needed.
+  'transitions' is not a map: the cells and area that go from one land use
+  class to another are counted during the run, for the whole country and
+  per province, and written to transitions.csv in every sample directory.
+  It is not in the list by default. The changes are recorded by the
+  allocation and forest regrowth as they are made; with the map based land
+  use (see getActiveCells()) the changed cells are read from their maps."""
+
+  outputs = ['landUse', \
+             'sc', 'scSc', 'scTo', 'scPr', 'sY', 'sYPr', 'sYTo', \
+             'eu', 'euSc', 'euTo', 'euPr', 'eY', 'eYPr', 'eYTo']
+  return outputs
+
+def getLandUseDeltas():
+  """Return 1 to store the land use output as changes + keyframe interval.
+
+  With 1 the land use of a sample is written to landUse.deltas in the
+  sample directory instead of a map per time step: the initial map, then
+  per time step the cells that changed and their new class, with the full
+  map again every keyframe interval time steps (see landusedeltas.py).
+  movie_land_use.py renders from this file."""
+
+  deltas = 0
+  keyframeInterval = 10
+  return [deltas, keyframeInterval]
+
+def getZoneMaps():
+  """Return dictionary with extra zone maps (items) and their names (keys).
+
+  e.g. zoneMaps['districts'] = 'districts.map' means: sum, mean and count
+  per district of the area and yield of the bioenergy crops are written to
+  zonal.csv in every sample directory, together with those per province.
+  A zone map must have the rows, columns, west, north and cell size of the
+  clone. Without zone maps the table is not made."""
+
+  zoneMaps = {}
+  return zoneMaps
+
+def getCompactStorage():
+  """Return 1 to keep long-lived maps in compact form, 0 otherwise.
+
+  When 1 Boolean masks are kept as bits, nominal maps and counts as one
+  byte per cell, and distance maps are dropped once the static suitability
+  is calculated. This lowers memory use per sample at the cost of some
+  conversions every time step; a memory comparison is printed. The land
+  use map that changes during the run stays a full nominal map, because
+  every time step reads and changes it; only the initial one is compacted."""
+
+  compact = 0
+  return compact
+
+def getActiveCells():
+  """Return 1 to compute only over the cells of the study area, 0 otherwise.
+
+  When 1 the land use map, suitability and yield are kept as arrays over
+  the cells of nullMask, and the allocation, neighbourhood counts and
+  forest regrowth work on those; maps are built again only for outputs.
+  Static suitability is still calculated with PCRaster, once."""
+
+  activeCells = 0
+  return activeCells
+
+def getCompetitiveAllocation():
+  """Return 1 to allocate all land use types in one pass, 0 otherwise.
+
+  With 0 the types get land one by one, in the order of getLandUseList().
+  With 1 types that need land compete for it in one ranking of all their
+  candidate cells on suitability; the list order decides only between
+  equal suitabilities, and a type stops taking cells once its demand is
+  met. Types then take no land from each other, only from forest. Needs
+  the active cells, so getActiveCells() is taken as 1."""
+
+  competitive = 0
+  return competitive
+
+def getOutputWriting():
+  """Return the nr of threads that write the outputs + max nr of maps queued.
+
+  With threads > 0 the model goes on with the next time step while its
+  outputs are written; it waits when the queue is full. Every written map is
+  synced to disk by its writer. With 0 threads (the default) every map is
+  written with report() before the model continues."""
+
+  nrThreads = 0
+  maxQueued = 32
+  return [nrThreads, maxQueued]
+
+def getOverviews():
+  """Return 1 to write overviews of the output maps + their factors.
+
+  When 1 every output map, and the statistics over the samples, get
+  coarser copies next to them, e.g. landUse0.001.ov4 with a cell per 4 x 4
+  cells: the most common class for land use and Boolean maps, the mean for
+  scalar maps. The movie scripts read the smallest copy that is large
+  enough for the frame (see overviews.py). Each factor is a multiple of
+  the one before. Off (0) by default; set overviews to 1 to write them."""
+
+  overviews = 0
+  factors = [2, 4, 8]
+  return [overviews, factors]
+
+def getVerbosity():
+  """Return how much is printed during a run.
+
+  0 -- only warnings
+  1 -- progress per time step and land use type
+  2 -- also every iteration of the allocation loops"""
+
+  verbosity = 1
+  return verbosity
+
+def getProfiling():
+  """Return 1 to time the phases of the model + name of the trace file.
+
+  When 1 wall time, loop iterations and peak memory of every phase
+  (suitability per type and factor, allocation per type, forest regrowth,
+  reports and biofuel outputs) are written per sample and time step to
+  the trace file, one JSON record per line, and summarised at the end."""
+
+  profiling = 0
+  traceFile = 'trace.jsonl'
+  return [profiling, traceFile]
+
 def getLandUseList():
   """Return list of landuse types in ORDER of 'who gets to choose first'."""
   landUseList = [1, 3, 2, 7, 4]
@@ -86,11 +257,20 @@ def getForestNr():
   """Return class number of land use types considered forest.
 
   Abandoned land of this type will be called 'deforestation'
-  and will grow back to forest after 10 years."""
+  and will grow back to forest, see getRegrowthDelay()."""
 
   forest = 4
   return forest
 
+def getRegrowthDelay():
+  """Return nr of years after which forest regrows on deforestated cells.
+
+  The year of deforestation counts as the first; with 9 the cells are
+  forest again, and can be cut again, in the 10th year."""
+
+  regrowthDelay = 9
+  return regrowthDelay
+
 def getRelatedTypeDict():
   """Return dictionary which type (key) is related to which others (items).
 
@@ -0,0 +1,129 @@
+"""Arrays over the active cells of the study area
+
+The land use map is a bounding box around Mozambique in which more than half
+of the cells are No Data. ActiveCells indexes the cells of the study area
+once; compress() turns a map into a 1-D array over those cells, expand()
+turns an array back into a map when it is written. Window totals come from
+a summed-area table of the map (see summedarea.py), at the same cost for
+any window length.
+
+"""
+
+import numpy
+from pcraster import *
+import summedarea
+
+#######################################
+
+class ActiveCells:
+  def __init__(self, nullMask):
+    """Index the cells that have a value on nullMask."""
+    valid = ~numpy.isnan(pcr2numpy(nullMask, numpy.nan))
+    self.shape = valid.shape
+    self.index = numpy.flatnonzero(valid)
+    self.nrCells = len(self.index)
+    ## Position in the arrays of every cell of the map, -1 when not active
+    self.position = numpy.full(valid.size, -1, dtype=numpy.int32)
+    self.position[self.index] = numpy.arange(self.nrCells)
+    self.cellSize = clone().cellSize()
+    self.lookups = {}
+    self.distanceBuffers = None
+
+  def compress(self, aMap, mv=numpy.nan, dtype=None):
+    """Return the values of a (non-)spatial map on the active cells."""
+    if not aMap.isSpatial():
+      aMap = spatial(aMap)
+    values = pcr2numpy(aMap, mv).ravel()[self.index]
+    if dtype is not None:
+      values = values.astype(dtype)
+    return values
+
+  def toGrid(self, values, fill):
+    """Return a 2-D array with values on the active cells, fill elsewhere."""
+    full = numpy.full(self.shape[0] * self.shape[1], fill, dtype=values.dtype)
+    full[self.index] = values
+    return full.reshape(self.shape)
+
+  def expand(self, values, valueScale, mv):
+    """Return a map with values on the active cells and mv elsewhere."""
+    full = self.toGrid(values, mv)
+    if values.dtype.kind == 'f':
+      full[numpy.isnan(full)] = mv
+    return numpy2pcr(valueScale, full, mv)
+
+  def getDistanceBuffers(self):
+    """Return two float32 grids for the distance transforms, kept for reuse."""
+    if self.distanceBuffers is None:
+      self.distanceBuffers = [numpy.empty(self.shape, dtype=numpy.float32) \
+                              for i in range(2)]
+    return self.distanceBuffers
+
+  def getBoxCorners(self, rowRadius, colRadius):
+    """Return the positions of the corners of the boxes around the cells.
+
+    The box of a cell spans rowRadius rows and colRadius columns on both
+    sides, clipped to the map. Positions are in the summed-area table of
+    windowTotal(), which has an extra row and column of zeros in front;
+    the sum of a box is table[a] - table[b] - table[c] + table[d].
+
+    """
+    key = (rowRadius, colRadius)
+    if key not in self.lookups:
+      nrRows, nrCols = self.shape
+      rows, cols = numpy.divmod(self.index, nrCols)
+      top = numpy.maximum(rows - rowRadius, 0)
+      bottom = numpy.minimum(rows + rowRadius, nrRows - 1) + 1
+      left = numpy.maximum(cols - colRadius, 0)
+      right = numpy.minimum(cols + colRadius, nrCols - 1) + 1
+      width = nrCols + 1
+      self.lookups[key] = (bottom * width + right, top * width + right, \
+                           bottom * width + left, top * width + left)
+    return self.lookups[key]
+
+  def getSummedAreaTable(self, values):
+    """Return the summed-area table of values (NaN as 0), flattened.
+
+    table[i, j] is the sum of the cells above row i and left of column j.
+
+    """
+    return summedarea.getTable(self.toGrid(values, 0.0)).ravel()
+
+  def boxTotal(self, table, rowRadius, colRadius):
+    """Return the sum in the boxes around the cells, see getBoxCorners()."""
+    if rowRadius < 0 or colRadius < 0:
+      return 0.0
+    a, b, c, d = self.getBoxCorners(rowRadius, colRadius)
+    return table[a] - table[b] - table[c] + table[d]
+
+  def windowTotal(self, values, windowLength):
+    """Return the sum of values in a square window around every cell.
+
+    Like windowtotal(): the window is windowLength map units wide, cells
+    partly inside count for the fraction inside, No Data (NaN) is skipped
+    and gives No Data on the cell itself. values can be a stack of arrays
+    (e.g. one per ensemble member) with the cells on the last axis.
+
+    Sums come from a summed-area table, so the cost does not depend on the
+    window length; summedarea.getWindowWeights() gives the boxes.
+
+    """
+    weights = summedarea.getWindowWeights(windowLength, self.cellSize)
+    stack = values.reshape(-1, self.nrCells)
+    total = numpy.zeros(stack.shape, dtype=numpy.float32)
+    for k in range(len(stack)):
+      table = self.getSummedAreaTable(stack[k])
+      for (rowRadius, colRadius), aWeight in weights:
+        total[k] += aWeight * self.boxTotal(table, rowRadius, colRadius)
+    total = total.reshape(values.shape)
+    total[numpy.isnan(values)] = numpy.nan
+    return total
+
+def normalize(values, axis=None):
+  """Return values scaled to 0-1, like LandUseType.normalizeMap().
+
+  With axis=-1 every array of a stack is scaled on its own.
+
+  """
+  valueMin = numpy.nanmin(values, axis=axis, keepdims=True)
+  diff = numpy.nanmax(values, axis=axis, keepdims=True) - valueMin
+  return (values - valueMin) / numpy.maximum(diff, 0.000001)
@@ -0,0 +1,273 @@
+"""Benchmark of the land use change model on synthetic national-scale grids
+
+Generates realistic but synthetic inputs (clustered land use patches, road
+and river networks, cities, provinces, demand series) at multiples of the
+1166 x 1839 Mozambique grid, runs one Monte Carlo sample on them with the
+profiler on and appends the timing per phase to a results file, so that
+regressions show up as ratios against the previous run of the same size.
+
+usage: python benchmark.py [--sizes 1 4 16] [--timesteps 5]
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy
+from pcraster import *
+from pcraster.framework import *
+import instrumentation
+import LU_Moz
+import Parameters
+
+NR_ROWS = 1839
+NR_COLS = 1166
+CELL_SIZE = 1000.0
+
+## Share of the study area per land use class in the synthetic map
+CLASS_SHARES = {1: 0.08, 2: 0.04, 3: 0.05, 4: 0.45, 6: 0.10, 7: 0.05, \
+                8: 0.15, 9: 0.06, 10: 0.02}
+
+#######################################
+## Synthetic inputs
+
+def smoothField(shape, length, rng):
+  """Return a standardised random field with patches of about length cells."""
+  noise = rng.standard_normal(shape)
+  fy = numpy.fft.fftfreq(shape[0])[:, None]
+  fx = numpy.fft.rfftfreq(shape[1])[None, :]
+  kernel = numpy.exp(-2 * (numpy.pi * length) ** 2 * (fx ** 2 + fy ** 2))
+  field = numpy.fft.irfft2(numpy.fft.rfft2(noise) * kernel, s=shape)
+  return (field - field.mean()) / field.std()
+
+def randomWalks(shape, nrWalks, length, rng, valid):
+  """Return a Boolean array with nrWalks persistent random walks (networks)."""
+  lines = numpy.zeros(shape, dtype=bool)
+  starts = numpy.argwhere(valid)
+  for aWalk in range(nrWalks):
+    row, col = starts[rng.integers(len(starts))]
+    direction = rng.uniform(0, 2 * numpy.pi)
+    for aStep in range(length):
+      direction += rng.normal(0, 0.15)
+      row = int(round(row + numpy.sin(direction)))
+      col = int(round(col + numpy.cos(direction)))
+      if not (0 <= row < shape[0] and 0 <= col < shape[1]):
+        break
+      lines[row, col] = True
+  return lines & valid
+
+def generateInputs(directory, scale, seed=1):
+  """Write all input maps and time series for a grid of scale times the area.
+
+  Returns the number of rows and columns.
+
+  """
+  factor = int(round(numpy.sqrt(scale)))
+  shape = (NR_ROWS * factor, NR_COLS * factor)
+  rng = numpy.random.default_rng(seed)
+  setclone(shape[0], shape[1], CELL_SIZE, 0.0, shape[0] * CELL_SIZE)
+
+  ## Study area covers about 45 % of the bounding box, like Mozambique
+  area = smoothField(shape, 150 * factor, rng)
+  valid = area > numpy.quantile(area, 0.55)
+
+  ## Land use in clustered patches: every class has its own random field,
+  ## offsets are tuned until each class takes about its share of the area
+  classes = list(CLASS_SHARES.keys())
+  shares = numpy.array([CLASS_SHARES[aClass] for aClass in classes])
+  scores = numpy.empty((len(classes),) + shape, dtype=numpy.float32)
+  for i in range(len(classes)):
+    scores[i] = smoothField(shape, 6 * factor, rng)
+  offsets = numpy.zeros(len(classes), dtype=numpy.float32)
+  for iteration in range(10):
+    winner = (scores + offsets[:, None, None]).argmax(axis=0)
+    counts = numpy.bincount(winner[valid], minlength=len(classes))
+    actual = numpy.maximum(counts / valid.sum(), 1e-4)
+    offsets += 0.5 * numpy.log(shares / actual)
+  landUse = numpy.array(classes, dtype=numpy.int32)[winner]
+  del scores, winner
+
+  roads = randomWalks(shape, 25 * factor, 400 * factor, rng, valid)
+  water = randomWalks(shape, 15 * factor, 600 * factor, rng, valid) | \
+          (smoothField(shape, 10 * factor, rng) > 3.2) & valid
+  cities = numpy.zeros(shape, dtype=bool)
+  cityCells = numpy.argwhere(valid)
+  cityCells = cityCells[rng.integers(len(cityCells), size=12 * scale)]
+  cities[cityCells[:, 0], cityCells[:, 1]] = True
+  landUse[cities] = 10
+
+  ## Provinces as Voronoi cells of ten random seeds
+  seeds = numpy.argwhere(valid)
+  seeds = seeds[rng.integers(len(seeds), size=10)]
+  provinces = numpy.zeros(shape, dtype=numpy.int32)
+  best = numpy.full(shape, numpy.inf)
+  rows, cols = numpy.indices(shape, sparse=True)
+  for i, (row, col) in enumerate(seeds):
+    distance = (rows - row) ** 2 + (cols - col) ** 2
+    closer = distance < best
+    best[closer] = distance[closer]
+    provinces[closer] = i + 1
+  del best
+
+  def fraction(length):
+    field = smoothField(shape, length * factor, rng)
+    return 1 / (1 + numpy.exp(-field))
+
+  def density(length):
+    return numpy.exp(smoothField(shape, length * factor, rng))
+
+  scalars = {'yield': fraction(20), 'biomass': fraction(20), \
+             'scYield': fraction(20), 'popDensity': density(15), \
+             'cattleDensity': density(25), \
+             'dem': 500 + 400 * smoothField(shape, 60 * factor, rng)}
+  booleans = {'roads': roads, 'water': water, 'cities': cities, \
+              'noGo': (smoothField(shape, 8 * factor, rng) > 2.5) & valid, \
+              'bioNoGo': (smoothField(shape, 8 * factor, rng) > 2.5) & valid}
+
+  def write(name, valueScale, values, mv):
+    values = numpy.where(valid, values, mv)
+    report(numpy2pcr(valueScale, values, mv), \
+           os.path.join(directory, name + '.map'))
+
+  write('landuse', Nominal, landUse, -1)
+  write('provinces', Nominal, provinces, -1)
+  write('nullMask', Scalar, numpy.zeros(shape), -9999)
+  for aName, values in scalars.items():
+    write(aName, Scalar, values, -9999)
+  for aName, values in booleans.items():
+    write(aName, Boolean, values.astype(numpy.uint8), 255)
+
+  writeTimeSeries(directory, landUse, scalars, valid)
+  return shape
+
+def writeTimeSeries(directory, landUse, scalars, valid, nrSteps=26):
+  """Write demand series that grow from the initial yield of each type."""
+  modelDirectory = os.path.dirname(os.path.abspath(__file__))
+  for aName in ['maxYield.tss', 'bioMaxYield.tss', 'legendLU.txt']:
+    shutil.copy(os.path.join(modelDirectory, aName), directory)
+  tssFile = os.path.join(directory, 'maxYield.tss')
+  with open(tssFile) as aFile:
+    ## Header: title, nr of columns, one line per column
+    aFile.readline()
+    nrHeaderLines = 2 + int(aFile.readline())
+  maxYield = numpy.loadtxt(tssFile, skiprows=nrHeaderLines)[0, 1:]
+  cellArea = CELL_SIZE ** 2 / Parameters.getConversionUnit()
+  initial = numpy.zeros(10)
+  for aClass in [1, 2, 3, 7]:
+    cells = (landUse == aClass) & valid
+    initial[aClass - 1] = scalars['yield'][cells].sum() * \
+                          maxYield[aClass - 1] * cellArea
+  ## Forest removes about 0.2 % of its biomass a year
+  forest = (landUse == 4) & valid
+  forestDemand = 0.002 * scalars['biomass'][forest].sum() * maxYield[3] * \
+                 cellArea
+  for aName, spread in [('demandLow.tss', 0.97), ('demandUp.tss', 1.03)]:
+    lines = ['demand per land use type', '11', 'model time with t0 = 2005']
+    lines += ['class %d' %aClass for aClass in range(1, 11)]
+    for step in range(1, nrSteps + 1):
+      demand = initial * 1.02 ** (step - 1) * spread
+      demand[3] = forestDemand * spread
+      lines.append('\t'.join([str(step)] + ['%.0f' %aValue \
+                                            for aValue in demand]))
+    with open(os.path.join(directory, aName), 'w') as tssFile:
+      tssFile.write('\n'.join(lines) + '\n')
+
+#######################################
+## Timing
+
+def runSample(directory, timeSteps, activeCells=0):
+  """Run one sample in directory with the profiler on; return the timings."""
+  traceFile = os.path.join(directory, 'trace.jsonl')
+  ## Competitive allocation would force the active cells on
+  overrides = {'getProfiling': [1, traceFile], 'getActiveCells': activeCells, \
+               'getCompetitiveAllocation': 0}
+  originals = {}
+  for aName, aValue in overrides.items():
+    originals[aName] = getattr(Parameters, aName)
+    setattr(Parameters, aName, lambda aValue=aValue: aValue)
+  instrumentation.profiler.records = []
+  workingDirectory = os.getcwd()
+  os.chdir(directory)
+  try:
+    start = time.perf_counter()
+    myModel = LU_Moz.LandUseChangeModel()
+    dynamicModel = DynamicFramework(myModel, timeSteps)
+    mcModel = MonteCarloFramework(dynamicModel, 1)
+    mcModel.run()
+    total = time.perf_counter() - start
+  finally:
+    os.chdir(workingDirectory)
+    for aName, aMethod in originals.items():
+      setattr(Parameters, aName, aMethod)
+  phases = {}
+  for aRecord in instrumentation.profiler.records:
+    phases[aRecord['phase']] = phases.get(aRecord['phase'], 0) + \
+                               aRecord['seconds']
+  phases['sample'] = total
+  return phases
+
+def getCommit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], \
+                                   text=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def readPrevious(resultsFile, scale, timeSteps, activeCells):
+  """Return the phases of the last stored run with the same settings."""
+  previous = None
+  if os.path.exists(resultsFile):
+    with open(resultsFile) as aFile:
+      for aLine in aFile:
+        aRecord = json.loads(aLine)
+        if aRecord['scale'] == scale and aRecord['timeSteps'] == timeSteps \
+           and aRecord.get('activeCells', 0) == activeCells:
+          previous = aRecord['phases']
+  return previous
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the model on ' \
+                                   'synthetic grids.')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16], \
+                      help='grid areas as multiples of the Mozambique grid')
+  parser.add_argument('--timesteps', type=int, default=5)
+  parser.add_argument('--results', default='benchmark_results.jsonl')
+  parser.add_argument('--keep', action='store_true', \
+                      help='keep the synthetic inputs and outputs')
+  parser.add_argument('--active-cells', type=int, default=0, \
+                      help='1 to compute only over the study area cells')
+  args = parser.parse_args()
+
+  for scale in args.sizes:
+    directory = tempfile.mkdtemp(prefix='pluc_bench_%dx_' %scale)
+    start = time.perf_counter()
+    shape = generateInputs(directory, scale)
+    print('generated %d x %d grid in %.1f s in %s' %(shape[0], shape[1], \
+          time.perf_counter() - start, directory))
+    previous = readPrevious(args.results, scale, args.timesteps, \
+                            args.active_cells)
+    phases = runSample(directory, args.timesteps, args.active_cells)
+    record = {'date': datetime.datetime.now().isoformat(), \
+              'commit': getCommit(), 'scale': scale, 'rows': shape[0], \
+              'cols': shape[1], 'timeSteps': args.timesteps, \
+              'activeCells': args.active_cells, 'phases': phases}
+    with open(args.results, 'a') as aFile:
+      aFile.write(json.dumps(record) + '\n')
+    print('\n%dx grid, %d time steps' %(scale, args.timesteps))
+    print('%-20s %10s %12s' %('phase', 'seconds', 'vs previous'))
+    for aPhase, seconds in sorted(phases.items()):
+      ratio = ''
+      if previous is not None and previous.get(aPhase):
+        ratio = '%.2fx' %(seconds / previous[aPhase])
+      print('%-20s %10.2f %12s' %(aPhase, seconds, ratio))
+    if not args.keep:
+      shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,117 @@
+"""Compact storage of maps that are kept alive during a Monte Carlo sample
+
+PCRaster keeps Boolean maps in one byte, nominal maps in four bytes and
+scalar maps in four bytes (REAL4) per cell. Maps that are stored for a long
+time but used only now and then can be kept smaller: Boolean maps as bits
+and nominal maps or small counts as one byte per cell. store() packs a map
+when compact storage is on, load() gives back a normal PCRaster map.
+
+"""
+
+import numpy
+from pcraster import *
+
+## Bytes per cell PCRaster uses for each value scale
+CELL_BYTES = {VALUESCALE.Boolean: 1, VALUESCALE.Ldd: 1, \
+              VALUESCALE.Nominal: 4, VALUESCALE.Ordinal: 4, \
+              VALUESCALE.Scalar: 4, VALUESCALE.Directional: 4}
+
+def getNrCells():
+  return clone().nrRows() * clone().nrCols()
+
+#######################################
+
+class PackedBooleanMap:
+  def __init__(self, aMap):
+    """Keep a Boolean map as two bit planes: values and missing values."""
+    values = pcr2numpy(aMap, 255)
+    self.shape = values.shape
+    self.bits = numpy.packbits(values == 1)
+    self.valid = numpy.packbits(values != 255)
+    self.fullBytes = getNrCells() * CELL_BYTES[VALUESCALE.Boolean]
+
+  def toMap(self):
+    size = self.shape[0] * self.shape[1]
+    values = numpy.unpackbits(self.bits, count=size).reshape(self.shape)
+    valid = numpy.unpackbits(self.valid, count=size).reshape(self.shape)
+    values[valid == 0] = 255
+    return numpy2pcr(Boolean, values, 255)
+
+  def getBytes(self):
+    return self.bits.nbytes + self.valid.nbytes
+
+class ByteMap:
+  def __init__(self, aMap):
+    """Keep a nominal map or a scalar map of small counts in one byte a cell.
+
+    Values must be whole numbers from 0 to 254; 255 is the missing value.
+
+    """
+    self.valueScale = aMap.dataType()
+    values = pcr2numpy(aMap, 255)
+    valid = pcr2numpy(defined(aMap), 0) == 1
+    ## 255 is the missing value, so a defined 255 would be lost
+    if numpy.any(valid & ((values < 0) | (values >= 255))):
+      raise ValueError('values do not fit in one byte')
+    self.values = values.astype(numpy.uint8)
+    self.fullBytes = getNrCells() * CELL_BYTES[self.valueScale]
+
+  def toMap(self):
+    return numpy2pcr(self.valueScale, self.values, 255)
+
+  def getBytes(self):
+    return self.values.nbytes
+
+#######################################
+
+def store(aMap, compact):
+  """Return aMap in compact form when compact is 1, else aMap itself.
+
+  Scalar maps are returned as they are, PCRaster keeps them in REAL4 already.
+
+  """
+  if compact != 1 or aMap is None or not aMap.isSpatial():
+    return aMap
+  valueScale = aMap.dataType()
+  if valueScale == VALUESCALE.Boolean:
+    return PackedBooleanMap(aMap)
+  if valueScale == VALUESCALE.Nominal:
+    return ByteMap(aMap)
+  return aMap
+
+def load(stored):
+  """Return the PCRaster map of something returned by store()."""
+  if isinstance(stored, (PackedBooleanMap, ByteMap)):
+    return stored.toMap()
+  return stored
+
+def getBytes(stored):
+  """Return the (actual, full PCRaster) bytes of a stored map."""
+  if stored is None:
+    return 0, 0
+  ## Arrays over the active cells, see activecells.py
+  if isinstance(stored, numpy.ndarray):
+    return stored.nbytes, stored.nbytes
+  if isinstance(stored, (PackedBooleanMap, ByteMap)):
+    return stored.getBytes(), stored.fullBytes
+  if not stored.isSpatial():
+    return 0, 0
+  full = getNrCells() * CELL_BYTES.get(stored.dataType(), 4)
+  return full, full
+
+def getFootprint(storedMaps):
+  """Return total (actual, full PCRaster) bytes of a list of stored maps.
+
+  Maps shared by several objects are counted once.
+
+  """
+  actual = 0
+  full = 0
+  unique = {}
+  for aMap in storedMaps:
+    unique[id(aMap)] = aMap
+  for aMap in unique.values():
+    mapActual, mapFull = getBytes(aMap)
+    actual += mapActual
+    full += mapFull
+  return actual, full
@@ -0,0 +1,147 @@
+"""Competitive allocation of all land use types in one pass
+
+The sequential allocation gives land to the types one by one, in the order
+of getLandUseList(): every type ranks its own candidate cells and the cells
+it takes are immutable for the types after it. Here all types that need
+more land compete for the cells at once. Every (suitability, type, cell)
+candidate is put in one ranking, on suitability (high first), then the
+order of the list, then the cell. Going down the ranking a candidate wins
+its cell when the cell is still free and its type still short of its
+demand; a type stops at the candidate that fulfils its demand.
+
+Types that have more land than demanded, and the forest, first give up
+their least suitable cells as in the sequential allocation. The cells of
+the other types in the list are not available, so every type gets its
+demand from abandoned, deforestated and other land.
+
+The walk down the ranking is not done cell by cell. The point where every
+type is full decides which candidates can still win; starting from no
+type full, those points are moved back until they no longer change, which
+gives the same result as the walk with a few passes over all candidates.
+
+"""
+
+import numpy
+from instrumentation import log, profiler
+
+#######################################
+
+def rankCandidates(types, needs, protected):
+  """Return the candidates of the types in one ranking.
+
+  Returns the arrays cell, type (position in types) and yield of the
+  candidates, from the most to the least suitable.
+
+  """
+  cells = []
+  ranks = []
+  suitability = []
+  yields = []
+  for i, aType in enumerate(types):
+    if needs[i] <= 0:
+      continue
+    candidates = numpy.flatnonzero(~protected & \
+                                   ~numpy.isnan(aType.totalSuitabilityMap))
+    cells.append(candidates)
+    ranks.append(numpy.full(len(candidates), i, dtype=numpy.int32))
+    suitability.append(aType.totalSuitabilityMap[candidates])
+    yields.append(aType.yieldMap[candidates])
+  if len(cells) == 0:
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    return empty, empty, numpy.zeros(0)
+  cells = numpy.concatenate(cells)
+  ranks = numpy.concatenate(ranks)
+  suitability = numpy.concatenate(suitability)
+  yields = numpy.concatenate(yields)
+  ## Last key first: suitability, then list order, then cell
+  ordered = numpy.lexsort((cells, ranks, -suitability))
+  return cells[ordered], ranks[ordered], yields[ordered]
+
+def resolve(cells, ranks, yields, needs):
+  """Return which candidates win their cell, and the nr of passes.
+
+  limits[t] is the position in the ranking after the candidate that fills
+  type t. A candidate can win its cell when no candidate of the cell
+  ranked before it can; fewer candidates that can win for one type moves
+  the limits of the others back, never forward.
+
+  """
+  nrCandidates = len(cells)
+  if nrCandidates == 0:
+    return numpy.zeros(0, dtype=bool), 0
+  position = numpy.arange(nrCandidates)
+  ## Candidates grouped per cell, ranked within the group
+  byCell = numpy.argsort(cells, kind='stable')
+  sortedCells = cells[byCell]
+  starts = numpy.flatnonzero(numpy.r_[True, sortedCells[1:] != \
+                                      sortedCells[:-1]])
+  lengths = numpy.diff(numpy.r_[starts, nrCandidates])
+  limits = numpy.where(numpy.asarray(needs) > 0, nrCandidates, 0)
+  firstFree = numpy.empty(nrCandidates, dtype=numpy.int64)
+  passes = 0
+  while True:
+    passes += 1
+    ## First candidate of every cell whose type is not full yet
+    free = numpy.where(position < limits[ranks], position, nrCandidates)
+    firstFree[byCell] = numpy.repeat( \
+                        numpy.minimum.reduceat(free[byCell], starts), lengths)
+    canWin = firstFree >= position
+    newLimits = limits.copy()
+    for i in range(len(needs)):
+      if needs[i] <= 0:
+        continue
+      own = numpy.flatnonzero(canWin & (ranks == i))
+      totals = numpy.cumsum(yields[own])
+      filled = numpy.searchsorted(totals, needs[i])
+      newLimits[i] = own[filled] + 1 if filled < len(own) else nrCandidates
+    if numpy.array_equal(newLimits, limits):
+      break
+    limits = newLimits
+  return firstFree == position, passes
+
+def allocate(types, demands, environment, immutables):
+  """Allocate all types and return the new environment.
+
+  types -- ActiveLandUseType objects in the order of the land use list,
+  with their maximum yield and total suitability of this time step
+  demands -- demand per type, as accepted by ActiveLandUseType.allocate()
+  environment, immutables -- arrays over the active cells
+
+  The deforestated cells are left in the deforestated of the forest type.
+
+  """
+  needs = []
+  for aType, aDemand in zip(types, demands):
+    with profiler.phase('allocate', landUseType=aType.typeNr):
+      aType.setDemand(aDemand, environment)
+      needs.append(0.0)
+      if aType.forest:
+        log(2, 'forest,', aType.typeNr,'so remove')
+        aType.removeForest()
+      elif aType.totalYield > aType.demand:
+        log(2, 'remove')
+        aType.remove()
+      elif aType.totalYield < aType.demand:
+        log(2, 'add')
+        needs[-1] = aType.demand - aType.totalYield
+      environment = aType.environment
+  with profiler.phase('allocate', landUseType='all'):
+    protected = immutables | numpy.isin(environment, \
+                [aType.typeNr for aType in types if not aType.forest])
+    cells, ranks, yields = rankCandidates(types, needs, protected)
+    won, passes = resolve(cells, ranks, yields, needs)
+    for i, aType in enumerate(types):
+      if needs[i] <= 0:
+        continue
+      own = won & (ranks == i)
+      aType.setEnvironment(environment)
+      aType.setClass(cells[own], aType.typeNr)
+      environment = aType.environment
+      aType.totalYield += float(yields[own].sum())
+      log(1, 'land use type', aType.typeNr, 'end yield is', aType.totalYield)
+      if aType.totalYield < aType.demand:
+        log(0, 'No space left for land use', aType.typeNr)
+    log(1, 'competitive allocation: %d candidates, %d passes' \
+          %(len(cells), passes))
+    profiler.count(passes)
+  return environment
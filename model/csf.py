@@ -0,0 +1,136 @@
+"""Memory-mapped reader and a writer for uncompressed PCRaster CSF maps
+
+The cell block of a .map file is exposed as a read-only numpy view on the
+file, so only the pages that are touched are read and no copy is made.
+writeArray() writes an array as map without pcraster.
+
+Layout (CSF version 2): a 64 byte main header, a raster header from byte 64
+and the cells, row by row, from byte 256. Attributes such as legends may
+follow the cells.
+
+"""
+
+import struct
+
+import numpy
+
+## Value scales
+VS_BOOLEAN = 0xE0
+VS_NOMINAL = 0xE2
+VS_ORDINAL = 0xF2
+VS_SCALAR = 0xEB
+VS_DIRECTION = 0xFB
+VS_LDD = 0xF0
+
+## Cell representations and their numpy types
+CELL_TYPES = {0x00: 'u1', 0x04: 'i1', 0x11: 'u2', 0x15: 'i2', \
+              0x22: 'u4', 0x26: 'i4', 0x5A: 'f4', 0xDB: 'f8'}
+
+SIGNATURE = b'RUU CROSS SYSTEM MAP FORMAT'
+DATA_OFFSET = 256
+
+#######################################
+
+class CsfMap:
+  def __init__(self, path):
+    """Open the map at path and map its cells into memory."""
+    self.path = path
+    with open(path, 'rb') as aFile:
+      header = aFile.read(DATA_OFFSET)
+    if len(header) < DATA_OFFSET or not header.startswith(SIGNATURE):
+      raise ValueError('not an uncompressed CSF map: ' + path)
+    ## The byte order field holds 1 in the byte order of the writer
+    if struct.unpack('<I', header[46:50])[0] == 1:
+      order = '<'
+    else:
+      order = '>'
+    self.valueScale, self.cellRepr = struct.unpack(order + 'HH', \
+                                                   header[64:68])
+    self.west, self.north, self.nrRows, self.nrCols = \
+               struct.unpack(order + 'ddII', header[84:108])
+    self.cellSize = struct.unpack(order + 'd', header[108:116])[0]
+    cellType = CELL_TYPES.get(self.cellRepr)
+    if cellType is None:
+      raise ValueError('unknown cell representation in ' + path)
+    self.dtype = numpy.dtype(order + cellType)
+    self.data = numpy.memmap(path, dtype=self.dtype, mode='r', \
+                             offset=DATA_OFFSET, \
+                             shape=(self.nrRows, self.nrCols))
+    self._mask = None
+
+  def getMissingValue(self):
+    """Return the missing value of the cell type (None for reals: NaN)."""
+    if self.dtype.kind == 'f':
+      return None
+    if self.dtype.kind == 'u':
+      return numpy.iinfo(self.dtype).max
+    return numpy.iinfo(self.dtype).min
+
+  @property
+  def mask(self):
+    """Boolean array, True for missing values; computed once on demand."""
+    if self._mask is None:
+      mv = self.getMissingValue()
+      if mv is None:
+        self._mask = numpy.isnan(self.data)
+      else:
+        self._mask = self.data == mv
+    return self._mask
+
+  def masked(self):
+    """Return the cells as masked array, still sharing memory with the file."""
+    return numpy.ma.MaskedArray(self.data, mask=self.mask, copy=False)
+
+  def filled(self, mv, dtype=None):
+    """Return a copy of the cells with mv for missing values."""
+    values = numpy.array(self.data, dtype=dtype or self.dtype.newbyteorder('='))
+    values[self.mask] = mv
+    return values
+
+def readArray(path, mv, dtype=None):
+  """Return the map at path as numpy array with mv for missing values.
+
+  Drop-in for pcr2numpy(readmap(path), mv) without pcraster or a clone."""
+  return CsfMap(path).filled(mv, dtype)
+
+#######################################
+
+## Cell representations written per numpy type, with their missing value
+WRITE_TYPES = {numpy.dtype('uint8'): (0x00, 255), \
+               numpy.dtype('int32'): (0x26, numpy.iinfo(numpy.int32).min), \
+               numpy.dtype('float32'): (0x5A, None)}
+
+def writeArray(path, values, valueScale, west, north, cellSize):
+  """Write a 2-D array as uncompressed CSF map, like report() does.
+
+  values is uint8 (Boolean, Ldd), int32 (Nominal, Ordinal) or float32
+  (Scalar, Directional) with the missing value of its type; NaN for float32.
+  Needs no pcraster, so maps can be written from other threads.
+
+  """
+  cellRepr, mv = WRITE_TYPES[values.dtype]
+  cells = numpy.ascontiguousarray(values).astype(values.dtype.newbyteorder('<'))
+  if mv is None:
+    valid = ~numpy.isnan(cells)
+    ## Real missing values have all bits set
+    cells.view('<u4')[~valid] = 0xFFFFFFFF
+  else:
+    valid = cells != mv
+  if valid.any():
+    extremes = numpy.array([cells[valid].min(), cells[valid].max()], \
+                           dtype=cells.dtype)
+  else:
+    ## No values, minimum and maximum are missing too
+    extremes = cells.ravel()[[0, 0]]
+  limits = b''.join([anExtreme.tobytes().ljust(8, b'\0') \
+                     for anExtreme in extremes])
+  ## Main header: version 2, projection y decreasing top to bottom, raster
+  header = SIGNATURE.ljust(32, b'\0') + \
+           struct.pack('<HIHIHI', 2, 0, 1, 0, 1, 1)
+  header = header.ljust(64, b'\0')
+  header += struct.pack('<HH', valueScale, cellRepr) + limits + \
+            struct.pack('<ddIIddd', west, north, cells.shape[0], \
+                        cells.shape[1], cellSize, cellSize, 0.0)
+  with open(path, 'wb') as aFile:
+    aFile.write(header.ljust(DATA_OFFSET, b'\0'))
+    aFile.write(cells.tobytes())
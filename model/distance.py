@@ -0,0 +1,119 @@
+"""Euclidean distance transforms for the distance suitability factors
+
+spread() computes a cost distance over the whole grid along the 8
+neighbours of every cell. The distance factors only need the straight line
+distance to the nearest road, water or city cell, and only up to their
+maximum distance. Both transforms here are exact Euclidean distances, in
+two passes: along the columns the distance in cells to the nearest source
+in the same column, then along the rows the nearest of those columns.
+
+euclidean() does the second pass with the lower envelope of parabolas of
+Felzenszwalb and Huttenlocher, linear in the nr of cells whatever the
+distances are. bounded() stops at a maximum distance: the second pass
+looks at the columns within that distance only, and cells further away
+from any source get NaN.
+
+Both fill preallocated buffers when given, so distances to several
+targets, or of many samples, reuse the same memory.
+
+"""
+
+import math
+
+import numpy
+
+#######################################
+
+def columnDistances(sources, limit, out):
+  """Fill out with the distance in cells to the nearest source per column.
+
+  Distances over limit become limit + 1.
+
+  """
+  rows = sources.shape[0]
+  out[0] = numpy.where(sources[0], 0, limit + 1)
+  for i in range(1, rows):
+    numpy.minimum(out[i - 1] + 1, limit + 1, out=out[i])
+    out[i][sources[i]] = 0
+  for i in range(rows - 2, -1, -1):
+    numpy.minimum(out[i], out[i + 1] + 1, out=out[i])
+  return out
+
+def getBuffers(shape, out, work):
+  if out is None:
+    out = numpy.empty(shape, dtype=numpy.float32)
+  if work is None:
+    work = numpy.empty(shape, dtype=numpy.float32)
+  return out, work
+
+def euclidean(sources, cellSize, out=None, work=None):
+  """Return the distance (map units) to the nearest True cell of sources.
+
+  sources -- 2-D Boolean array; without any source all cells get NaN
+  out, work -- optional float32 arrays of the shape of sources
+
+  """
+  out, work = getBuffers(sources.shape, out, work)
+  rows, cols = sources.shape
+  ## Larger than any squared distance on the grid
+  limit = rows + cols
+  columnDistances(sources, limit, work)
+  f = work.astype(numpy.float64) ** 2
+  allRows = numpy.arange(rows)
+  ## Per row the columns of the parabolas of the envelope and their bounds
+  v = numpy.zeros((rows, cols), dtype=numpy.int64)
+  z = numpy.empty((rows, cols + 1))
+  z[:, 0] = -numpy.inf
+  z[:, 1] = numpy.inf
+  k = numpy.zeros(rows, dtype=numpy.int64)
+  for q in range(1, cols):
+    fq = f[:, q] + q * q
+    while True:
+      vk = v[allRows, k]
+      s = (fq - (f[allRows, vk] + vk * vk)) / (2 * (q - vk))
+      hidden = s <= z[allRows, k]
+      if not hidden.any():
+        break
+      k[hidden] -= 1
+    k += 1
+    v[allRows, k] = q
+    z[allRows, k] = s
+    z[allRows, k + 1] = numpy.inf
+  k[:] = 0
+  for x in range(cols):
+    while True:
+      further = z[allRows, k + 1] < x
+      if not further.any():
+        break
+      k[further] += 1
+    vk = v[allRows, k]
+    work[:, x] = (x - vk) ** 2 + f[allRows, vk]
+  numpy.sqrt(work, out=out)
+  out *= cellSize
+  out[work >= limit * limit] = numpy.nan
+  return out
+
+def bounded(sources, cellSize, maxDistance, out=None, work=None):
+  """Return the distance (map units) to sources, up to maxDistance.
+
+  Cells further than maxDistance from any source get NaN.
+
+  """
+  out, work = getBuffers(sources.shape, out, work)
+  cols = sources.shape[1]
+  limit = int(math.ceil(maxDistance / cellSize))
+  columnDistances(sources, limit, work)
+  ## Squared distance in cells; limit + 1 in a column is out of reach
+  work[work > limit] = numpy.inf
+  numpy.square(work, out=work)
+  out[:] = work
+  for offset in range(1, min(limit, cols - 1) + 1):
+    extra = offset * offset
+    numpy.minimum(out[:, offset:], work[:, :-offset] + extra, \
+                  out=out[:, offset:])
+    numpy.minimum(out[:, :-offset], work[:, offset:] + extra, \
+                  out=out[:, :-offset])
+  numpy.sqrt(out, out=out)
+  out *= cellSize
+  out[out > maxDistance] = numpy.nan
+  return out
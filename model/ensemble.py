@@ -0,0 +1,460 @@
+"""Ensemble runs: the Monte Carlo samples as one stacked state
+
+The samples of a Monte Carlo run differ in their random draws (demand,
+maximum yield, window length and the errors of the inputs), not in their
+control flow. The ensemble holds K samples (members) as arrays of K rows
+over the active cells (see activecells.py) and takes them through one time
+loop: the inputs are read once, and neighbourhood counts, current land use
+suitability, normalization, forest regrowth and the bioenergy outputs are
+computed for all members at once. Only the allocation runs per member, each
+from its own ranking and running totals of yield.
+
+Members are set up one after the other with the normal initial(), so they
+draw the same random numbers as samples 1 to K of a normal run with
+getActiveCells() 1, and they write their outputs to the same sample
+directories.
+
+usage: python ensemble.py [--members 10] [--timesteps 26]
+
+"""
+
+import argparse
+import os
+
+import numpy
+from pcraster import *
+from pcraster.framework import *
+import activecells
+import compact
+import competition
+import inputs
+from instrumentation import log, profiler
+import LU_Moz
+import Parameters
+
+## Time series read once for all members
+SERIES = ['maxYield', 'bioMaxYield', 'demandUp', 'demandLow']
+
+#######################################
+
+def readSeries(directory='.'):
+  """Return a dict with the time series the ensemble uses, by name."""
+  series = {}
+  for aName in SERIES:
+    series[aName] = inputs.readTimeSeries(os.path.join(directory, \
+                                                       aName + '.tss'))
+  return series
+
+class EnsembleLandUse:
+  def __init__(self, members, zones=None):
+    """Stack the ActiveLandUse objects of the members after initial().
+
+    zones -- Zones of the provinces (see zonal.py), or None
+
+    """
+    self.members = members
+    self.nrMembers = len(members)
+    first = members[0]
+    self.cells = first.cells
+    self.forest = first.forest
+    self.competitive = first.competitive
+    self.regrowthDelay = first.regrowthDelay
+    self.toMeters = first.toMeters
+    self.cellArea = self.cells.cellSize ** 2
+    self.values = numpy.stack([aMember.values for aMember in members])
+    self.immutables = numpy.stack([aMember.immutables for aMember in members])
+    ## Per land use type a list with the type object of every member
+    self.landUseTypes = [list(typeList) for typeList in \
+                         zip(*[aMember.landUseTypes for aMember in members])]
+    self.allowed = []
+    self.initialSuitability = []
+    for typeList in self.landUseTypes:
+      allowed = numpy.stack([aType.allowed for aType in typeList])
+      initial = numpy.stack([aType.initialSuitability for aType in typeList])
+      ## The members keep rows of the stacks instead of their own copies
+      for k, aType in enumerate(typeList):
+        aType.allowed = allowed[k]
+        aType.initialSuitability = initial[k]
+      self.allowed.append(allowed)
+      self.initialSuitability.append(initial)
+    ## Cells that regrow to forest per time step, as (member, positions)
+    self.regrowth = {}
+    self.timeStep = 0
+    self.biofuelNoGo = None
+    self.steepSlopes = {}
+    self.yieldFractions = {}
+    self.zoneLabels = None
+    if zones is not None:
+      self.nrZones = zones.nrZones
+      self.zoneLabels = numpy.full(self.cells.nrCells, -1, dtype=numpy.int64)
+      positions = self.cells.position[zones.cells]
+      inStudyArea = positions >= 0
+      self.zoneLabels[positions[inStudyArea]] = zones.labels[inStudyArea]
+
+  def getZoneMeans(self, values):
+    """Return the mean per zone of every member (member x zone)."""
+    inZone = self.zoneLabels >= 0
+    labels = self.zoneLabels[inZone]
+    counts = numpy.bincount(labels, minlength=self.nrZones)
+    totals = numpy.empty((self.nrMembers, self.nrZones))
+    for k in range(self.nrMembers):
+      totals[k] = numpy.bincount(labels, weights=values[k, inZone], \
+                                 minlength=self.nrZones)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      return numpy.where(counts > 0, totals / counts, numpy.nan)
+
+  #######################################
+  ## Suitability
+
+  def getNeighborSuitability(self, typeList):
+    """Return factor 1 of all members, at once per window length."""
+    aType = typeList[0]
+    related = numpy.isin(self.values, [aType.typeNr] + \
+                         list(aType.relatedTypeList))
+    scalarSelf = related.astype(numpy.float32)
+    scalarSelf[self.values < 0] = numpy.nan
+    suitability = numpy.empty(self.values.shape, dtype=numpy.float32)
+    windowLengths = [memberType.getWindowLength() for memberType in typeList]
+    for aLength in sorted(set(windowLengths)):
+      rows = [k for k, memberLength in enumerate(windowLengths) \
+              if memberLength == aLength]
+      block = scalarSelf[rows]
+      nrNeighborsSameLU = self.cells.windowTotal(block, aLength) - block
+      maxNr = ((aLength / self.cells.cellSize)**2) - 1
+      suitability[rows] = nrNeighborsSameLU / maxNr
+    return suitability
+
+  def getCurrentLandUseSuitability(self, aType):
+    """Return factor 9 of all members, from a table of values per class."""
+    variableDict = aType.variableDict.get(9)
+    table = numpy.zeros(max(int(self.values.max()), max(variableDict)) + 1, \
+                        dtype=numpy.float32)
+    for aKey in variableDict.keys():
+      table[aKey] = variableDict.get(aKey)
+    current = table[numpy.maximum(self.values, 0)]
+    current[self.values < 0] = numpy.nan
+    return activecells.normalize(current, axis=-1)
+
+  def getTotalSuitability(self, i):
+    """Return the total suitability of type i for all members."""
+    typeList = self.landUseTypes[i]
+    aType = typeList[0]
+    suitability = numpy.zeros(self.values.shape, dtype=numpy.float32)
+    for aFactor, aWeight in zip(aType.suitFactorList, aType.weightList):
+      with profiler.phase('suitability', landUseType=aType.typeNr, \
+                          factor=aFactor):
+        if aFactor == 1:
+          suitability += aWeight * self.getNeighborSuitability(typeList)
+        elif aFactor == 8:
+          ## Distances to the edge are computed member by member
+          for k, memberType in enumerate(typeList):
+            memberType.setEnvironment(self.values[k])
+            suitability[k] += aWeight * memberType.getEdgeSuitability()
+        elif aFactor == 9:
+          suitability += aWeight * self.getCurrentLandUseSuitability(aType)
+        elif aFactor not in (2, 3, 4, 5, 6, 7):
+          print('ERROR: unknown suitability factor for landuse', aType.typeNr)
+    suitability += aType.weightInitialSuitabilityMap * \
+                   self.initialSuitability[i]
+    suitability[~self.allowed[i]] = numpy.nan
+    return activecells.normalize(suitability, axis=-1)
+
+  def calculateSuitabilityMaps(self):
+    """Give the type of every member its row of the total suitability."""
+    for i, typeList in enumerate(self.landUseTypes):
+      suitability = self.getTotalSuitability(i)
+      for k, aType in enumerate(typeList):
+        aType.totalSuitabilityMap = suitability[k]
+
+  def step(self, maxYield, demand):
+    """Simulate one time step of all members, see allocate()."""
+    self.calculateSuitabilityMaps()
+    self.allocate(maxYield, demand)
+    with profiler.phase('growForest'):
+      self.growForest()
+    with profiler.phase('transitions'):
+      self.finishTransitions()
+
+  def getState(self):
+    """Return a copy of the state that changes during a run."""
+    return {'values': self.values.copy(), 'timeStep': self.timeStep, \
+            'regrowth': {aStep: list(queued) for aStep, queued \
+                         in self.regrowth.items()}}
+
+  def setState(self, state):
+    """Go back to a state from getState()."""
+    self.values = state['values'].copy()
+    self.timeStep = state['timeStep']
+    self.regrowth = {aStep: list(queued) for aStep, queued \
+                     in state['regrowth'].items()}
+
+  #######################################
+  ## Allocation
+
+  def allocate(self, maxYield, demand):
+    """Allocate every member with its own maximum yield and demand.
+
+    maxYield, demand -- arrays (member x class) with the values of the time
+    series for every land use class
+
+    """
+    self.timeStep += 1
+    ## As in ActiveLandUse, the maximum yield counts for types that are on
+    ## the map at the start of the time step
+    present = [(self.values == typeList[0].typeNr).any(axis=1) \
+               for typeList in self.landUseTypes]
+    convertedMaxYield = (maxYield / self.toMeters) * self.cellArea
+    regrowthStep = self.timeStep + self.regrowthDelay - 1
+    for k in range(self.nrMembers):
+      tempEnvironment = self.values[k]
+      immutables = self.immutables[k]
+      types = [typeList[k] for typeList in self.landUseTypes]
+      for i, aType in enumerate(types):
+        ownMaxYield = 0.0
+        if present[i][k]:
+          ownMaxYield = float(convertedMaxYield[k, aType.typeNr])
+        aType.setMaxYieldPerCell(ownMaxYield)
+      if self.competitive == 1:
+        ## Types are present when the time step starts, see ActiveLandUse
+        demands = [float(demand[k, aType.typeNr]) if present[i][k] else 0.0 \
+                   for i, aType in enumerate(types)]
+        tempEnvironment = competition.allocate(types, demands, \
+                                               tempEnvironment, immutables)
+      else:
+        for aType in types:
+          with profiler.phase('allocate', landUseType=aType.typeNr, \
+                              member=k + 1):
+            ownDemand = 0.0
+            if (tempEnvironment == aType.typeNr).any():
+              ownDemand = float(demand[k, aType.typeNr])
+            tempEnvironment, immutables = aType.allocate(ownDemand, \
+                                                         tempEnvironment, \
+                                                         immutables)
+      for aType in types:
+        if aType.deforestated is not None:
+          self.regrowth.setdefault(regrowthStep, []).append( \
+                                   (k, aType.deforestated))
+      self.values[k] = tempEnvironment
+
+  def growForest(self):
+    """Regrow forest at the cells of every member queued for this step."""
+    for k, cells in self.regrowth.pop(self.timeStep, []):
+      cells = cells[self.values[k, cells] == 98]
+      if self.members[k].transitions is not None:
+        self.members[k].transitions.record(cells, self.values[k, cells])
+      self.values[k, cells] = self.forest
+
+  def finishTransitions(self):
+    """Count the transitions of the members that count them."""
+    for k, aMember in enumerate(self.members):
+      if aMember.transitions is not None:
+        aMember.transitions.finishStep(self.timeStep, self.values[k])
+
+  #######################################
+  ## Bioenergy crops
+
+  def getBiofuelExclusion(self, noGoMap, food):
+    """Return the cells (member x cell) not available for any energy crop.
+
+    The no-go part comes from the no-go maps and the initial land use, so it
+    is the same for all members and made once.
+
+    """
+    if self.biofuelNoGo is None:
+      excluded = pcror(compact.load(self.members[0].excluded), \
+                       compact.load(noGoMap))
+      self.biofuelNoGo = self.cells.compress(excluded, 255) != 0
+    return numpy.isin(self.values, food) | self.biofuelNoGo
+
+  def getBiofuelPotential(self, noBiofuels, slope):
+    """Return cells suitable for an energy crop, fraction per zone and total.
+
+    As LandUse.getBiofuelPotential() for all members; slopes differ per
+    member when the dem has a random error.
+
+    """
+    if slope not in self.steepSlopes:
+      self.steepSlopes[slope] = numpy.stack([ \
+                                self.cells.compress(pcrgt(aMember.slopeMap, \
+                                                          slope), 255) != 0 \
+                                for aMember in self.members])
+    potential = ~(noBiofuels | self.steepSlopes[slope])
+    perProvince = None
+    if self.zoneLabels is not None:
+      perProvince = self.getZoneMeans(potential)
+    total = potential.sum(axis=1) / self.cells.nrCells
+    return potential, perProvince, total
+
+  def getPotentialBiofuelYield(self, potential, crop, maxYield):
+    """Return yield per cell, per zone and total for every member.
+
+    maxYield -- array with the maximum yield of the crop per member
+
+    """
+    if crop not in self.yieldFractions:
+      if crop == 'sc':
+        fractions = [aMember.scYieldFrac for aMember in self.members]
+      else:
+        fractions = [aMember.euYieldFrac for aMember in self.members]
+      self.yieldFractions[crop] = numpy.nan_to_num(numpy.stack( \
+                                  [self.cells.compress(aMap) \
+                                   for aMap in fractions]))
+    convertedMaxYield = (maxYield / float(self.toMeters)) * self.cellArea
+    yields = numpy.where(potential, self.yieldFractions[crop] * \
+                         convertedMaxYield[:, None], 0).astype(numpy.float32)
+    perProvince = None
+    if self.zoneLabels is not None:
+      perProvince = self.getZoneMeans(yields)
+    total = yields.sum(axis=1, dtype=numpy.float64) / self.cells.nrCells
+    return yields, perProvince, total
+
+#######################################
+
+class EnsembleModel(LU_Moz.LandUseChangeModel):
+  def __init__(self, nrMembers):
+    """Model that runs nrMembers samples in one stacked state."""
+    LU_Moz.LandUseChangeModel.__init__(self)
+    self.nrMembers = nrMembers
+    self.member = 1
+
+  def currentSampleNumber(self):
+    ## The member that is set up or reported
+    return self.member
+
+  def getSampleNumbers(self):
+    return list(range(1, self.nrMembers + 1))
+
+  def premcloop(self):
+    LU_Moz.LandUseChangeModel.premcloop(self)
+    ## Members are kept as arrays over the active cells
+    self.activeCells = 1
+    self.series = readSeries()
+    for aMember in self.getSampleNumbers():
+      os.makedirs(str(aMember), exist_ok=True)
+
+  def initial(self):
+    members = []
+    draws = []
+    for aMember in self.getSampleNumbers():
+      self.member = aMember
+      LU_Moz.LandUseChangeModel.initial(self)
+      members.append(self.landUse)
+      draws.append([float(self.demandStoch), float(self.maxYieldStoch), \
+                    float(self.bioMaxYieldStoch)])
+    ## Columns: fraction of demand, error of max yield and bio max yield
+    self.draws = numpy.array(draws)
+    self.ensemble = EnsembleLandUse(members, self.provinces)
+    self.landUse = None
+    log(1, 'ensemble of', self.nrMembers, 'members')
+
+  def getSeries(self, name, timeStep):
+    """Return the values of a time series per class for every member."""
+    series = self.series[name]
+    row = series[series[:, 0] == timeStep][0]
+    return numpy.tile(row, (self.nrMembers, 1))
+
+  def getDrivers(self, timeStep):
+    """Return max yield and demand of the land use types, bio max yields.
+
+    Max yield and demand are arrays with a row per member and a column per
+    land use class; the bio max yields of sugar cane and eucalyptus have a
+    value per member.
+
+    """
+    maxYield = self.getSeries('maxYield', timeStep)
+    bioMaxYield = self.getSeries('bioMaxYield', timeStep)
+    scMaxYield = bioMaxYield[:, 2]
+    euMaxYield = bioMaxYield[:, 1]
+    if self.stochYield[0] == 1:
+      maxYield = numpy.maximum(0, maxYield + self.draws[:, 1:2] * maxYield)
+      scMaxYield = numpy.maximum(0, scMaxYield + self.draws[:, 2] * scMaxYield)
+      euMaxYield = numpy.maximum(0, euMaxYield + self.draws[:, 2] * euMaxYield)
+    demandUp = self.getSeries('demandUp', timeStep)
+    demandLow = self.getSeries('demandLow', timeStep)
+    demand = (demandUp - demandLow) * self.draws[:, 0:1] + demandLow
+    return maxYield, demand, scMaxYield, euMaxYield
+
+  def dynamic(self):
+    timeStep = self.currentTimeStep()
+    profiler.setContext(None, timeStep)
+    log(1, '\ntime step', timeStep)
+    maxYield, demand, scMaxYield, euMaxYield = self.getDrivers(timeStep)
+    self.ensemble.step(maxYield, demand)
+
+    outputs = self.getOutputs(scMaxYield, euMaxYield)
+    for k, memberOutputs in enumerate(outputs):
+      self.member = k + 1
+      self.reportOutputs(memberOutputs)
+      if self.member == self.nrMembers:
+        ## Statistics over the members read the outputs of the others
+        with profiler.phase('report', output='flush'):
+          self.writer.flush()
+      self.postProcessing.timeStepFinished(self.member, timeStep, \
+                                           memberOutputs)
+      if timeStep == self.nrTimeSteps():
+        counter = self.ensemble.members[k].transitions
+        if counter is not None:
+          counter.write(generateNameS('transitions.csv', self.member))
+        self.postProcessing.sampleFinished(self.member)
+
+  def getOutputs(self, scMaxYield, euMaxYield):
+    """Return a dict with the outputs of every member, as in dynamic()."""
+    ensemble = self.ensemble
+    outputs = [{} for k in range(self.nrMembers)]
+    if 'landUse' in self.outputs:
+      for k in range(self.nrMembers):
+        outputs[k]['landUse'] = ensemble.cells.expand(ensemble.values[k], \
+                                                      Nominal, -1)
+    crops = [('sc', inputs.SC_OUTPUTS, 0.09, scMaxYield), \
+             ('eu', inputs.EU_OUTPUTS, 1, euMaxYield)]
+    crops = [aCrop for aCrop in crops \
+             if inputs.needsOutput(self.outputs, aCrop[1])]
+    if len(crops) == 0:
+      return outputs
+    with profiler.phase('biofuel', crop='all'):
+      noBiofuels = ensemble.getBiofuelExclusion(self.bioNoGo, self.food)
+    for crop, names, slope, maxYield in crops:
+      with profiler.phase('biofuel', crop=crop):
+        potential, perProvince, total = ensemble.getBiofuelPotential( \
+                                        noBiofuels, slope)
+        results = [potential, potential, total, perProvince]
+        if inputs.needsOutput(self.outputs, names[4:]):
+          results += ensemble.getPotentialBiofuelYield(potential, crop, \
+                                                       maxYield)
+        for aName, values in zip(names, results):
+          if aName not in self.outputs or values is None:
+            continue
+          for k in range(self.nrMembers):
+            outputs[k][aName] = self.toOutput(aName, names, values[k])
+    return outputs
+
+  def toOutput(self, name, names, values):
+    """Return the output of one member as map, number or vector per zone."""
+    cells = self.ensemble.cells
+    if name == names[0]:
+      return cells.expand(values.astype(numpy.uint8), Boolean, 255)
+    if name in (names[1], names[4]):
+      return cells.expand(values.astype(numpy.float32), Scalar, -9999)
+    if name in (names[2], names[6]):
+      return scalar(float(values))
+    ## Values per province
+    return values
+
+def main():
+  parser = argparse.ArgumentParser(description='Run the Monte Carlo samples ' \
+                                   'of the model as one stacked ensemble.')
+  parser.add_argument('--members', type=int, \
+                      default=Parameters.getNrSamples(), \
+                      help='nr of samples held in the ensemble')
+  parser.add_argument('--timesteps', type=int, \
+                      default=Parameters.getNrTimesteps())
+  args = parser.parse_args()
+
+  myModel = EnsembleModel(args.members)
+  dynamicModel = DynamicFramework(myModel, args.timesteps)
+  ## One framework sample; the model runs all members in it
+  mcModel = MonteCarloFramework(dynamicModel, 1)
+  mcModel.run()
+
+if __name__ == '__main__':
+  main()
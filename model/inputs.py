@@ -0,0 +1,123 @@
+"""Loading of the input maps of the land use change model of Mozambique
+
+Only the maps needed by the configured suitability factors, no-go rules and
+outputs are read, so reduced configurations and runs on clipped regions do
+not pay for inputs they never use. The cells are read in parallel from a
+thread pool with csf.py, which needs no PCRaster; PCRaster is not thread-safe,
+so the maps are made from them in the calling thread.
+
+"""
+
+import concurrent.futures
+import os
+
+import numpy
+import csf
+
+## Input map needed by each static suitability factor
+FACTOR_INPUTS = {2: 'roads', 3: 'water', 4: 'cities', 6: 'popDensity', \
+                 7: 'cattleDensity'}
+
+## Outputs per bioenergy crop; the yield outputs also need a yield map
+SC_OUTPUTS = ['sc', 'scSc', 'scTo', 'scPr', 'sY', 'sYPr', 'sYTo']
+EU_OUTPUTS = ['eu', 'euSc', 'euTo', 'euPr', 'eY', 'eYPr', 'eYTo']
+PROVINCE_OUTPUTS = ['scPr', 'sYPr', 'euPr', 'eYPr']
+
+def getRequiredInputs(landUseList, suitFactorDict, forestNr, \
+                      privateNoGoSlopeDict, outputs):
+  """Return the set of input map names the configuration needs.
+
+  The land use map, null mask, no-go map and yield map are always needed;
+  the yield map because it determines the yield of every allocated cell.
+
+  """
+  required = set(['landuse', 'nullMask', 'noGo', 'yield'])
+  for aType in landUseList:
+    for aFactor in suitFactorDict.get(aType):
+      if aFactor in FACTOR_INPUTS:
+        required.add(FACTOR_INPUTS.get(aFactor))
+  if forestNr in landUseList:
+    required.add('biomass')
+  ## Slope constraints are derived from the dem
+  if len(privateNoGoSlopeDict) > 0:
+    required.add('dem')
+  if needsBiofuel(outputs):
+    required.update(['bioNoGo', 'dem'])
+  if needsOutput(outputs, ['sY', 'sYPr', 'sYTo']):
+    required.add('scYield')
+  if needsOutput(outputs, PROVINCE_OUTPUTS + ['transitions']):
+    required.add('provinces')
+  return required
+
+def needsOutput(outputs, names):
+  """Return True when any of names is in the list of outputs."""
+  for aName in names:
+    if aName in outputs:
+      return True
+  return False
+
+def needsBiofuel(outputs):
+  """Return True when any bioenergy crop output is required."""
+  return needsOutput(outputs, SC_OUTPUTS + EU_OUTPUTS)
+
+#######################################
+
+def readCells(name):
+  """Return value scale, cells and missing value of the map name.map."""
+  csfMap = csf.CsfMap(name + '.map')
+  mv = csfMap.getMissingValue()
+  if mv is None:
+    ## Below any value of the inputs, as numpy2pcr() needs a number
+    mv = float(numpy.finfo(numpy.float32).min)
+  return csfMap.valueScale, csfMap.filled(mv), mv
+
+class InputLoader:
+  def __init__(self, toMap, names, workers=4):
+    """Start reading the cells of the maps in names.
+
+    Cells are read in the background; get() waits for the ones it asks for
+    and makes the map with toMap(valueScale, cells, mv).
+
+    """
+    self.toMap = toMap
+    self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    self.futures = {}
+    for aName in sorted(names):
+      self.futures[aName] = self.pool.submit(readCells, aName)
+
+  def get(self, name):
+    """Return the map called name, or None when it is not required."""
+    future = self.futures.get(name)
+    if future is None:
+      return None
+    return self.toMap(*future.result())
+
+  def close(self):
+    """Wait for all maps and release the threads."""
+    self.pool.shutdown(wait=True)
+
+def linkInputs(source, target, extensions=('.map', '.tss', '.txt')):
+  """Link the input files in directory source into directory target.
+
+  Lets a model run in a scratch directory, so that its sample directories
+  do not replace those of earlier runs.
+
+  """
+  for aName in sorted(os.listdir(source)):
+    path = os.path.abspath(os.path.join(source, aName))
+    if os.path.isfile(path) and aName.endswith(extensions):
+      os.symlink(path, os.path.join(target, aName))
+
+def readTimeSeries(path):
+  """Return the values of a time series (tss) file, a row per time step.
+
+  Column i holds the values of id i, as read by timeinputscalar(); column 0
+  holds the time step.
+
+  """
+  with open(path) as tssFile:
+    tssFile.readline()
+    nrColumns = int(tssFile.readline())
+    for i in range(nrColumns):
+      tssFile.readline()
+    return numpy.loadtxt(tssFile, ndmin=2)
@@ -0,0 +1,132 @@
+"""Timing instrumentation and logging for the land use change model
+
+The profiler records wall time, call counts, loop iteration counts and the
+rise of the peak memory of named phases per sample and time step. Records
+are written as a trace file with one JSON object per line and summarised
+per phase.
+log() replaces print() for messages that depend on the verbosity.
+
+"""
+
+import collections
+import contextlib
+import json
+import time
+try:
+  import resource
+except ImportError:
+  ## resource only exists on Unix
+  resource = None
+
+## 0: only warnings, 1: progress per time step and type, 2: every iteration
+verbosity = 1
+
+def log(level, *args):
+  """Print args when level is not higher than the verbosity."""
+  if level <= verbosity:
+    print(*args)
+
+def getPeakMemory():
+  """Return the peak resident memory of this process in megabytes.
+
+  Returns None where the resource module is missing (Windows).
+
+  """
+  if resource is None:
+    return None
+  ## ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+#######################################
+
+class Profiler:
+  def __init__(self):
+    """Create a disabled profiler; phase() costs next to nothing then."""
+    self.enabled = 0
+    self.records = []
+    self.active = []
+    self.sample = None
+    self.timeStep = None
+
+  def setContext(self, sample, timeStep):
+    """Set sample and time step that are stored with the next records."""
+    self.sample = sample
+    self.timeStep = timeStep
+
+  @contextlib.contextmanager
+  def phase(self, name, **tags):
+    """Time the enclosed code as phase name, with extra tags (e.g. type).
+
+    peakMemory is how much the phase raised the peak resident memory of the
+    process, in megabytes; 0 when an earlier phase reached a higher peak,
+    None when the peak memory is not available.
+
+    """
+    if self.enabled != 1:
+      yield
+      return
+    record = {'phase': name, 'sample': self.sample, \
+              'timeStep': self.timeStep, 'iterations': 0}
+    record.update(tags)
+    self.active.append(record)
+    startMemory = getPeakMemory()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      record['seconds'] = time.perf_counter() - start
+      if startMemory is None:
+        record['peakMemory'] = None
+      else:
+        record['peakMemory'] = getPeakMemory() - startMemory
+      self.active.pop()
+      self.records.append(record)
+
+  def count(self, iterations):
+    """Add loop iterations to the innermost active phase."""
+    if self.enabled == 1 and len(self.active) > 0:
+      self.active[-1]['iterations'] += iterations
+
+  def writeTrace(self, fileName):
+    """Write all records, one JSON object per line."""
+    with open(fileName, 'w') as traceFile:
+      for aRecord in self.records:
+        traceFile.write(json.dumps(aRecord) + '\n')
+
+  def getSummary(self):
+    """Return a table with calls, total, mean and max time per phase.
+
+    Phases are split by their tags other than sample and time step, e.g.
+    suitability per land use type and factor.
+
+    """
+    groups = collections.OrderedDict()
+    for aRecord in self.records:
+      tags = ['%s=%s' %(aKey, aRecord[aKey]) for aKey in sorted(aRecord) \
+              if aKey not in ('phase', 'sample', 'timeStep', 'iterations', \
+                              'seconds', 'peakMemory')]
+      key = ' '.join([aRecord['phase']] + tags)
+      groups.setdefault(key, []).append(aRecord)
+    lines = ['%-40s %7s %10s %9s %9s %11s' %('phase', 'calls', 'total s', \
+             'mean s', 'max s', 'iterations')]
+    for aKey, records in sorted(groups.items(), \
+                                key=lambda item: -sum(aRecord['seconds'] \
+                                                for aRecord in item[1])):
+      seconds = [aRecord['seconds'] for aRecord in records]
+      iterations = sum([aRecord['iterations'] for aRecord in records])
+      lines.append('%-40s %7d %10.2f %9.3f %9.3f %11d' %(aKey, \
+                   len(seconds), sum(seconds), sum(seconds) / len(seconds), \
+                   max(seconds), iterations))
+    peakMemory = getPeakMemory()
+    if peakMemory is not None:
+      lines.append('peak memory %.1f MB' %peakMemory)
+    return '\n'.join(lines)
+
+## One profiler for the whole model run
+profiler = Profiler()
+
+def configure(level, profiling):
+  """Set verbosity and profiling ([on/off, trace file]) from Parameters."""
+  global verbosity
+  verbosity = level
+  profiler.enabled = profiling[0]
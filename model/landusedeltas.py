@@ -0,0 +1,134 @@
+"""Land use output stored as changes per time step
+
+Only a small part of the land use map changes in a time step. Instead of a
+map per time step, one file per sample holds the initial map and per time
+step the cells that changed with their new class. Every keyframeInterval
+time steps the full map is stored again, so a time step is rebuilt from
+the last full map before it and at most keyframeInterval - 1 sets of
+changes.
+
+Classes are stored as one byte with 0 for missing values, as the land use
+frames of the post-processing. File layout, little endian:
+
+header -- b'LUDELTA1', rows and cols (int32)
+record -- time step (int32), kind (uint8, 0 full map, 1 changes), nr of
+          values (int64), then for a full map rows * cols classes (uint8),
+          for changes the cells (uint32, row major) and their classes (uint8)
+
+"""
+
+import os
+import struct
+
+import numpy
+
+MAGIC = b'LUDELTA1'
+HEADER = struct.Struct('<8sii')
+RECORD = struct.Struct('<iBq')
+FULL = 0
+CHANGES = 1
+
+#######################################
+
+class DeltaWriter:
+  def __init__(self, path, initial, keyframeInterval=10):
+    """Start path with the initial map (2-D uint8 array) as time step 0.
+
+    keyframeInterval -- time steps between full maps, 0 for none after the
+    initial map
+
+    """
+    self.keyframeInterval = keyframeInterval
+    self.file = open(path, 'wb')
+    self.file.write(HEADER.pack(MAGIC, initial.shape[0], initial.shape[1]))
+    self.previous = numpy.ascontiguousarray(initial, dtype=numpy.uint8)
+    self.writeRecord(0, FULL, self.previous.size, [self.previous])
+
+  def writeRecord(self, timeStep, kind, nrValues, arrays):
+    self.file.write(RECORD.pack(timeStep, kind, nrValues))
+    for anArray in arrays:
+      self.file.write(anArray.tobytes())
+
+  def write(self, timeStep, values):
+    """Add the land use (2-D uint8 array) of a time step."""
+    values = numpy.ascontiguousarray(values, dtype=numpy.uint8)
+    if self.keyframeInterval > 0 and timeStep % self.keyframeInterval == 0:
+      self.writeRecord(timeStep, FULL, values.size, [values])
+    else:
+      cells = numpy.flatnonzero(values != self.previous).astype(numpy.uint32)
+      self.writeRecord(timeStep, CHANGES, len(cells), \
+                       [cells, values.ravel()[cells]])
+    self.previous = values
+
+  def close(self):
+    self.file.close()
+
+class DeltaReader:
+  def __init__(self, path):
+    """Index the records of a file written by DeltaWriter."""
+    self.path = path
+    size = os.path.getsize(path)
+    with open(path, 'rb') as aFile:
+      magic, rows, cols = HEADER.unpack(aFile.read(HEADER.size))
+      if magic != MAGIC:
+        raise ValueError(path + ' is not a land use delta file')
+      self.shape = (rows, cols)
+      ## Time step: (kind, offset of the values, nr of values)
+      self.records = {}
+      offset = HEADER.size
+      while offset + RECORD.size <= size:
+        aFile.seek(offset)
+        timeStep, kind, nrValues = RECORD.unpack(aFile.read(RECORD.size))
+        end = offset + RECORD.size + nrValues * (1 if kind == FULL else 5)
+        if end > size:
+          ## A record that was not written completely
+          break
+        self.records[timeStep] = (kind, offset + RECORD.size, nrValues)
+        offset = end
+    self.timeSteps = sorted(self.records)
+
+  def readFull(self, timeStep):
+    kind, offset, nrValues = self.records[timeStep]
+    values = numpy.fromfile(self.path, numpy.uint8, nrValues, offset=offset)
+    return values.reshape(self.shape)
+
+  def applyChanges(self, values, timeStep):
+    """Apply the record of timeStep to values (2-D array) in place."""
+    kind, offset, nrValues = self.records[timeStep]
+    if kind == FULL:
+      values[:] = self.readFull(timeStep)
+      return
+    cells = numpy.fromfile(self.path, numpy.uint32, nrValues, offset=offset)
+    classes = numpy.fromfile(self.path, numpy.uint8, nrValues, \
+                             offset=offset + 4 * nrValues)
+    values.ravel()[cells] = classes
+
+  def read(self, timeStep):
+    """Return the land use of a time step as 2-D uint8 array."""
+    if timeStep not in self.records:
+      raise KeyError('time step %d not in %s' %(timeStep, self.path))
+    start = max(aStep for aStep in self.timeSteps \
+                if aStep <= timeStep and self.records[aStep][0] == FULL)
+    values = self.readFull(start).copy()
+    for aStep in self.timeSteps:
+      if start < aStep <= timeStep:
+        self.applyChanges(values, aStep)
+    return values
+
+  def iterate(self, timeSteps):
+    """Yield the land use of increasing time steps, changes applied once."""
+    values = None
+    current = None
+    for timeStep in timeSteps:
+      if values is None:
+        values = self.read(timeStep)
+      else:
+        for aStep in self.timeSteps:
+          if current < aStep <= timeStep:
+            self.applyChanges(values, aStep)
+      current = timeStep
+      yield values.copy()
+
+def getPath(name, directory=''):
+  """Return the path of the delta file of output name in directory."""
+  return os.path.join(directory, name + '.deltas')
@@ -3,14 +3,13 @@ Judith Verstegen, 2017-07-04 (adapted 2025-03-05)
 
 """
 
-from matplotlib import animation
+from matplotlib import cm
 from matplotlib import colors as cls
 from matplotlib import pyplot as plt
 plt.switch_backend('agg')
-import numpy as np
 import os
-from pcraster import *
 import Parameters
+import movie_common
 
 ##############
 ### inputs ###
@@ -22,56 +21,31 @@ init_year = 2005
 fn1 = 'euSc-ave'
 legend_loc = (1.01,0.25)# Moz right bottom
 
+cmap = plt.get_cmap('gist_rainbow')
+# availability is a probability, so one scale for all frames
+norm = cls.Normalize(vmin=0, vmax=1)
+
+def add_colorbar(f, axarr):
+    mappable = cm.ScalarMappable(norm=norm, cmap=cmap)
+    f.colorbar(mappable, ax=axarr, spacing='proportional')
+
 ############
 ### MAIN ###
 ############
 
-# open the raster and read out the data in a numpy array
-wd = os.getcwd()
-if (8 - len(fn1)) > 0: nr_zeros = 8 - len(fn1)
-else:  nr_zeros = 0
-in_fn = os.path.join(wd, fn1 + nr_zeros * '0' + '.001')
-setclone(in_fn)
-amap = readmap(in_fn)
-data = pcr2numpy(amap, -999)
-data = np.ma.masked_where(data<0, data)
-
-# create the figure
-f, axarr = plt.subplots(1)
-plt.axis('off')
-#norm = cls.Normalize(vmin=0, vmax=1)
-
-# text boxes
-title = axarr.text(0.05, 1, '', \
-                   transform=axarr.transAxes)
-year = axarr.text(0.05, 0.95, '', transform=axarr.transAxes)
-
-# use imshow to plot the raster over time
-# in two functions for the animation
-def init_movie():
-    im = axarr.imshow(data, cmap='gist_rainbow', animated=True)
-    cb = plt.colorbar(im, spacing='proportional')
-    return im, year, title
-
-def animate(i):
-    t = i + 1
-    if t < 10:
-        fn = in_fn[:-3] + '00' + str(t)
-    else:
-        fn = in_fn[:-3] + '0' + str(t)
-    ##print fn
-    amap = readmap(fn)
-    data = pcr2numpy(amap, -999)
-    data = np.ma.masked_where(data<0, data)
-    im = axarr.imshow(data, cmap='gist_rainbow', animated=True)
-    year.set_text('year = ' + str(init_year + t - 1))
-    title.set_text('probability of availability for ' + fn1[0:2])
-    return im, year, title
-
-im_ani = animation.FuncAnimation(f, animate, interval=300, \
-                                   blit=False, frames = timesteps,\
-                                   init_func=init_movie)
-writer = animation.PillowWriter(fps=1, metadata={'artist':'Judith Verstegen'})
-im_ani.save('movie_' + fn1 + '.gif', writer=writer, dpi=300)
+def main():
+    args = movie_common.parseArguments('Render a movie of the probability ' \
+                                       'of availability.', fn1, '', timesteps)
+    wd = os.getcwd()
+    in_dir = os.path.join(wd, str(args.sample))
+    paths = [movie_common.frameFileName(args.variable, t, in_dir) \
+             for t in range(1, args.timesteps + 1)]
+    out_fn = args.output or 'movie_' + args.variable + '.gif'
+    title = 'probability of availability for ' + args.variable[0:2]
+    movie_common.renderMovie(paths, out_fn, cmap, norm, -999, title, \
+                             init_year, dpi=args.dpi, workers=args.workers, \
+                             masked=True, decorate=add_colorbar)
 # https://matplotlib.org/stable/gallery/animation/simple_scatter.html
-#plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Shared rendering code for the movie scripts of the LUC model of Mozambique
+
+Frames are read and colour mapped in worker processes, shown through one
+image artist whose data is replaced per frame, and handed to a streaming
+animation writer; at most twice as many frames as there are workers are
+in flight, so no frame list is kept in memory. Frames are read from
+the smallest overview of the maps that still fills the figure at its dpi
+(see overviews.py), or from the maps themselves when there are none.
+
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+
+from matplotlib import animation
+from matplotlib import pyplot as plt
+plt.switch_backend('agg')
+import numpy as np
+import overviews
+
+def frameFileName(fn, t, directory=''):
+    """Return the path of the map of variable fn for time step t.
+
+    The framework writes time steps in 8.3 format, e.g. landUse0.001."""
+    if (8 - len(fn)) > 0: nr_zeros = 8 - len(fn)
+    else: nr_zeros = 0
+    name = fn + nr_zeros * '0' + '.' + '%03d' % t
+    return os.path.join(directory, name)
+
+def readFrame(path, mv, size=None):
+    """Return the map at path as numpy array with mv for missing values.
+
+    size -- cells needed along the longest side; read from an overview of
+    the map when one has enough"""
+    return overviews.readArray(path, mv, size)
+
+def getFrameSize(dpi):
+    """Return the nr of pixels along the longest side of the axes."""
+    rc = plt.rcParams
+    width, height = rc['figure.figsize']
+    width *= rc['figure.subplot.right'] - rc['figure.subplot.left']
+    height *= rc['figure.subplot.top'] - rc['figure.subplot.bottom']
+    return int(max(width, height) * dpi)
+
+def rasterise(path, mv, cmap, norm, masked, size=None):
+    """Read one frame and colour map it into an RGBA uint8 array.
+
+    Runs in a worker process, so only the finished image is sent back."""
+    data = readFrame(path, mv, size)
+    if masked:
+        data = np.ma.masked_where(data < 0, data)
+    return cmap(norm(data), bytes=True)
+
+def getWriter(fps, artist):
+    """Return a streaming writer: ffmpeg when installed, pillow otherwise."""
+    metadata = {'artist': artist}
+    if animation.writers.is_available('ffmpeg'):
+        return animation.FFMpegWriter(fps=fps, metadata=metadata)
+    return animation.PillowWriter(fps=fps, metadata=metadata)
+
+def writeMovie(frames, out_fn, titleText, init_year, dpi=300, \
+               decorate=None, fps=1):
+    """Write an iterable of RGBA frames as an animation to out_fn.
+
+    decorate -- optional function(fig, ax) adding a legend or colour bar."""
+    f, axarr = plt.subplots(1)
+    plt.axis('off')
+    if decorate is not None:
+        decorate(f, axarr)
+    title = axarr.text(0.05, 1, '', transform=axarr.transAxes)
+    year = axarr.text(0.05, 0.95, '', transform=axarr.transAxes)
+    writer = getWriter(fps, 'Judith Verstegen')
+    im = None
+    with writer.saving(f, out_fn, dpi):
+        for i, rgba in enumerate(frames):
+            if im is None:
+                im = axarr.imshow(rgba, zorder=0, interpolation='nearest')
+            else:
+                im.set_data(rgba)
+            year.set_text('year = ' + str(init_year + i))
+            title.set_text(titleText)
+            writer.grab_frame()
+    plt.close(f)
+    return out_fn
+
+def rasteriseInOrder(pool, work, paths, window):
+    """Yield work(path) of the paths in order, with at most window queued."""
+    queued = collections.deque()
+    for path in paths:
+        if len(queued) == window:
+            yield queued.popleft().result()
+        queued.append(pool.submit(work, path))
+    while queued:
+        yield queued.popleft().result()
+
+def renderMovie(paths, out_fn, cmap, norm, mv, titleText, init_year, \
+                dpi=300, workers=None, masked=False, decorate=None, fps=1):
+    """Render the maps in paths as an animation and write it to out_fn."""
+    work = functools.partial(rasterise, mv=mv, cmap=cmap, norm=norm, \
+                             masked=masked, size=getFrameSize(dpi))
+    workers = workers or os.cpu_count() or 1
+    ## Also started from the post-processing thread of the model, where a
+    ## forked worker could inherit locks held by the other threads
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, \
+                                                mp_context=context) as pool:
+        ## frames arrive in order while later ones are still rasterised
+        frames = rasteriseInOrder(pool, work, paths, 2 * workers)
+        return writeMovie(frames, out_fn, titleText, init_year, dpi=dpi, \
+                          decorate=decorate, fps=fps)
+
+def parseArguments(description, variable, sample, timesteps):
+    """Return the command line options shared by the movie scripts."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--variable', default=variable, \
+                        help='output name to animate (default %(default)s)')
+    parser.add_argument('--sample', default=sample, \
+                        help='Monte Carlo sample directory, empty for the ' \
+                        'working directory (default %(default)s)')
+    parser.add_argument('--timesteps', type=int, default=timesteps, \
+                        help='number of frames (default %(default)s)')
+    parser.add_argument('--dpi', type=int, default=300, \
+                        help='output resolution (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, \
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--output', default=None, \
+                        help='output file (default movie_<variable>.gif)')
+    return parser.parse_args()
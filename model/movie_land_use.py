@@ -3,21 +3,19 @@ Judith Verstegen, 2017-07-04 (adapted 2025-03-05)
 
 """
 
-from matplotlib import animation
 from matplotlib import colors as cls
 from matplotlib import pyplot as plt
 plt.switch_backend('agg')
 import numpy as np
 import os
-from pcraster import *
 import Parameters
+import landusedeltas
+import movie_common
 
 ##############
 ### inputs ###
 ##############
 
-setclone('landuse.map')
-
 timesteps = Parameters.getNrTimesteps()
 init_year = 2005
 fn = 'landUse'
@@ -32,73 +30,64 @@ list_all_names = {1:'cropland', 2:'cropland with \ngrassland', \
                   98: 'deforested', 99: 'abandoned'}
 legend_loc = (0.7,0.3)# Moz right bottom
 
-############
-### MAIN ###
-############
-
-# open the raster and read out the data in a numpy array
-wd = os.getcwd()
-if (8 - len(fn)) > 0: nr_zeros = 8 - len(fn)
-else:  nr_zeros = 0
-in_fn = os.path.join(wd, '1', fn + nr_zeros * '0' + '.001')
-setclone(in_fn)
-amap = readmap(in_fn)
-data = pcr2numpy(amap, 0)
-
 # create custom color map
 colorlist = []
 for i in range(0, np.max(np.array(list(list_all_names.keys()))) + 1):
     if i in list_all_colors:
-        colorlist.append(list_all_colors.get(i))     
+        colorlist.append(list_all_colors.get(i))
     else:
         colorlist.append('None')
-
-# create the figure
-f, axarr = plt.subplots(1)
-plt.axis('off')
 # making color map
 # and normalization scheme
 cmap_long = cls.ListedColormap(colorlist, name='long')
 norm_without_mv = cls.Normalize(vmin=0, \
                     vmax=np.max(np.array(list(list_all_names.keys()))))
-# create the legend
-p = []
-s = []
-# loop over reversed list for ascending order
-for nr in list(list_all_names.keys()):#[::-1]:
-  p.append(plt.Circle((0, 0), radius=3, lw=0, fc=list_all_colors[nr]))
-  s.append(list_all_names[nr])
-leg = axarr.legend(p, s, loc='right', bbox_to_anchor=legend_loc,\
-                   prop={'size':8}, ncol=1, fancybox=True,\
-                   borderpad=0.2, bbox_transform=f.transFigure)
-title = axarr.text(0.05, 1, '', transform=axarr.transAxes)
-year = axarr.text(0.05, 0.95, '', transform=axarr.transAxes)
 
-# use imshow to plot the raster over time
-# in two functions for the animation
-def init():
-    im = axarr.imshow(data, norm=norm_without_mv, zorder=0,\
-                            cmap=cmap_long, animated=True)
-    return im, leg, year, title
+def add_legend(f, axarr):
+    # loop over reversed list for ascending order
+    p = []
+    s = []
+    for nr in list(list_all_names.keys()):#[::-1]:
+      p.append(plt.Circle((0, 0), radius=3, lw=0, fc=list_all_colors[nr]))
+      s.append(list_all_names[nr])
+    axarr.legend(p, s, loc='right', bbox_to_anchor=legend_loc,\
+                 prop={'size':8}, ncol=1, fancybox=True,\
+                 borderpad=0.2, bbox_transform=f.transFigure)
 
-def animate(i):
-    t = i + 1
-    if t < 10:
-        fn = in_fn[:-3] + '00' + str(t)
-    else:
-        fn = in_fn[:-3] + '0' + str(t)
-    ##print(fn)
-    amap = readmap(fn)
-    data = pcr2numpy(amap, 0)
-    im = axarr.imshow(data, norm=norm_without_mv, zorder=0,\
-                            cmap=cmap_long, animated=True)
-    year.set_text('year = ' + str(init_year + t - 1))
-    title.set_text('land use for Monte Carlo sample 1')
-    return im, leg, year, title
+############
+### MAIN ###
+############
+
+def main():
+    args = movie_common.parseArguments('Render a land use movie of one ' \
+                                       'Monte Carlo sample.', fn, '1', \
+                                       timesteps)
+    wd = os.getcwd()
+    sample_dir = os.path.join(wd, str(args.sample))
+    paths = [movie_common.frameFileName(args.variable, t, sample_dir) \
+             for t in range(1, args.timesteps + 1)]
+    out_fn = args.output or 'movie_' + args.variable + '.gif'
+    title = 'land use for Monte Carlo sample ' + str(args.sample)
+    deltas = landusedeltas.getPath(args.variable, sample_dir)
+    if use_deltas(deltas, paths[0]):
+        # land use stored as changes, frames rebuilt one after the other
+        reader = landusedeltas.DeltaReader(deltas)
+        frames = (cmap_long(norm_without_mv(frame), bytes=True) \
+                  for frame in reader.iterate(range(1, args.timesteps + 1)))
+        movie_common.writeMovie(frames, out_fn, title, init_year, \
+                                dpi=args.dpi, decorate=add_legend)
+        return
+    movie_common.renderMovie(paths, out_fn, cmap_long, norm_without_mv, 0, \
+                             title, init_year, dpi=args.dpi, \
+                             workers=args.workers, decorate=add_legend)
+
+def use_deltas(deltas, first_map):
+    """Return True when the delta file is there and not older than the maps."""
+    if not os.path.exists(deltas):
+        return False
+    if not os.path.exists(first_map):
+        return True
+    return os.path.getmtime(deltas) >= os.path.getmtime(first_map)
 
-im_ani = animation.FuncAnimation(f, animate, interval=300, \
-                                   blit=False, frames = timesteps,\
-                                   init_func=init)
-writer = animation.PillowWriter(fps=1, metadata={'artist':'Judith Verstegen'})
-im_ani.save('movie_' + fn + '.gif', writer=writer, dpi=300)
-#plt.show()
+if __name__ == '__main__':
+    main()
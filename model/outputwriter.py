@@ -0,0 +1,144 @@
+"""Background writing of the output maps of the land use change model
+
+report() encodes and writes a map while the model waits. The OutputWriter
+takes the cells of a finished map as array and returns at once; writer
+threads write the queued arrays with csf.writeArray(), which needs no
+pcraster. The queue is bounded, so a model that is faster than the disk
+waits when too many maps are pending. An error of a writer is raised in the
+model on its next write or flush. The writers sync every file to disk
+(fsync) right after writing it, so the syncs are spread over the run. The
+writers also write the overviews of every map (see overviews.py), when
+overview factors are given. Without writer threads maps are written with
+report() while the model waits, as before.
+
+"""
+
+import os
+import queue
+import threading
+
+import numpy
+from pcraster import *
+import csf
+import overviews
+
+## Value scales of pcraster and CSF, with the type and missing value of cells
+CELL_TYPES = {VALUESCALE.Boolean: (csf.VS_BOOLEAN, numpy.uint8, 255), \
+              VALUESCALE.Ldd: (csf.VS_LDD, numpy.uint8, 255), \
+              VALUESCALE.Nominal: (csf.VS_NOMINAL, numpy.int32, \
+                                   numpy.iinfo(numpy.int32).min), \
+              VALUESCALE.Ordinal: (csf.VS_ORDINAL, numpy.int32, \
+                                   numpy.iinfo(numpy.int32).min), \
+              VALUESCALE.Scalar: (csf.VS_SCALAR, numpy.float32, numpy.nan), \
+              VALUESCALE.Directional: (csf.VS_DIRECTION, numpy.float32, \
+                                       numpy.nan)}
+
+#######################################
+
+def toCells(aMap):
+  """Return the cells of a (non-)spatial map as array, and its value scale."""
+  if not aMap.isSpatial():
+    aMap = spatial(aMap)
+  valueScale, dtype, mv = CELL_TYPES[aMap.dataType()]
+  return pcr2numpy(aMap, mv).astype(dtype), valueScale
+
+def sync(path):
+  """Flush the written file at path to disk."""
+  aFile = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(aFile)
+  finally:
+    os.close(aFile)
+
+class OutputWriter:
+  def __init__(self, nrThreads=2, maxQueued=32, overviewFactors=()):
+    """Start nrThreads writers; with 0 maps are reported in write() itself.
+
+    maxQueued bounds the nr of maps (and memory) waiting to be written.
+    overviewFactors -- factors of the overviews written next to every map
+
+    """
+    self.overviewFactors = overviewFactors
+    self.location = (clone().west(), clone().north(), clone().cellSize())
+    self.queue = queue.Queue(maxQueued)
+    self.error = None
+    self.workers = []
+    for i in range(nrThreads):
+      aWorker = threading.Thread(target=self.work, daemon=True)
+      aWorker.start()
+      self.workers.append(aWorker)
+
+  def write(self, aMap, path, legend=None):
+    """Queue a map, or an array with a value per cell, for writing to path.
+
+    legend -- file with the legend that is added to the map once written
+
+    """
+    self.checkError()
+    if len(self.workers) == 0:
+      self.reportMap(aMap, path, legend)
+      return
+    if isinstance(aMap, numpy.ndarray):
+      task = (aMap.astype(numpy.float32), csf.VS_SCALAR, path, legend)
+    else:
+      task = toCells(aMap) + (path, legend)
+    self.queue.put(task)
+
+  def reportMap(self, aMap, path, legend):
+    """Write a map with report() and add its legend and overviews."""
+    if isinstance(aMap, numpy.ndarray):
+      aMap = numpy2pcr(Scalar, numpy.where(numpy.isnan(aMap), -9999, \
+                                           aMap), -9999)
+    report(aMap, path)
+    if legend is not None:
+      os.system('legend --clone landuse.map -f \"%s\" %s ' %(legend, path))
+    if len(self.overviewFactors) > 0:
+      cells, valueScale = toCells(aMap)
+      overviews.write(path, cells, valueScale, *self.location, \
+                      factors=self.overviewFactors)
+
+  def work(self):
+    """Write queued maps until a None is queued."""
+    while True:
+      task = self.queue.get()
+      try:
+        if task is None:
+          break
+        if self.error is None:
+          self.writeCells(*task)
+      except Exception as error:
+        ## Keep draining the queue, the error is raised in the model thread
+        self.error = error
+      finally:
+        self.queue.task_done()
+
+  def writeCells(self, cells, valueScale, path, legend):
+    csf.writeArray(path, cells, valueScale, *self.location)
+    if legend is not None:
+      os.system('legend --clone landuse.map -f \"%s\" %s ' %(legend, path))
+    ## After the legend, which changes the map, so the overviews are newer
+    paths = [path]
+    if len(self.overviewFactors) > 0:
+      overviews.write(path, cells, valueScale, *self.location, \
+                      factors=self.overviewFactors)
+      paths.extend(overviews.getPath(path, aFactor) \
+                   for aFactor in self.overviewFactors)
+    for aPath in paths:
+      sync(aPath)
+
+  def checkError(self):
+    if self.error is not None:
+      raise RuntimeError('writing outputs failed') from self.error
+
+  def flush(self):
+    """Wait until all queued maps are written and synced."""
+    self.queue.join()
+    self.checkError()
+
+  def close(self):
+    """Write and sync all maps that are left and stop the writers."""
+    self.flush()
+    for aWorker in self.workers:
+      self.queue.put(None)
+    for aWorker in self.workers:
+      aWorker.join()
@@ -0,0 +1,133 @@
+"""Overviews: coarser copies of output maps for previews and movies
+
+Next to an output map, e.g. 1/landUse0.001, overview levels are written as
+maps of their own with the level in the name, 1/landUse0.001.ov2 for 2 x 2
+cells per overview cell, .ov4 and .ov8 for 4 x 4 and 8 x 8. Nominal,
+ordinal, Boolean and ldd maps get the most common value of the cells in
+the block (the lowest on a tie), scalar and directional maps their mean.
+Missing values do not count; a block without values is missing. Levels are
+exact for every factor: they are built from the class counts, or sums and
+counts, of the level before, so the full map is read once.
+
+readArray() returns the smallest level that still has a given nr of cells
+along its longest side, so a viewer or movie reads 4 to 64 times fewer
+cells. A level older than its map is not used.
+
+"""
+
+import glob
+import os
+
+import numpy
+import csf
+
+## Value scales of which blocks get their mean; the others their mode
+MEAN_SCALES = (csf.VS_SCALAR, csf.VS_DIRECTION)
+
+#######################################
+
+def getPath(path, factor):
+  """Return the path of the overview of factor of the map at path."""
+  return '%s.ov%d' %(path, factor)
+
+def blockSum(values, factor):
+  """Return the sums over blocks of factor x factor of the last two axes."""
+  rows, cols = values.shape[-2:]
+  nrRows = -(-rows // factor)
+  nrCols = -(-cols // factor)
+  padded = numpy.zeros(values.shape[:-2] + (nrRows * factor, \
+                       nrCols * factor), dtype=values.dtype)
+  padded[..., :rows, :cols] = values
+  blocks = padded.reshape(values.shape[:-2] + (nrRows, factor, nrCols, \
+                                                factor))
+  return blocks.sum(axis=(-3, -1))
+
+def countClasses(cells, mv, classes, factor, shape):
+  """Return the nr of cells per class (first axis) in blocks of factor."""
+  valid = cells != mv
+  rows, cols = numpy.nonzero(valid)
+  ## One bin per class per block
+  bins = ((rows // factor) * shape[1] + cols // factor) * len(classes) + \
+         numpy.searchsorted(classes, cells[valid])
+  counts = numpy.bincount(bins, minlength=shape[0] * shape[1] * len(classes))
+  return counts.reshape(shape + (len(classes),)).transpose(2, 0, 1).astype( \
+                        numpy.int32)
+
+def getLevels(cells, valueScale, factors):
+  """Yield (factor, cells) of the overviews of cells (2-D array).
+
+  cells has the type and missing value written by csf.writeArray(); factors
+  are increasing, each a multiple of the one before.
+
+  """
+  mean = valueScale in MEAN_SCALES
+  if mean:
+    valid = ~numpy.isnan(cells)
+    sums = numpy.where(valid, cells, 0).astype(numpy.float64)
+    counts = valid.astype(numpy.int32)
+  else:
+    mv = csf.WRITE_TYPES[cells.dtype][1]
+    classes = numpy.unique(cells[cells != mv])
+  previous = 1
+  for aFactor in factors:
+    step = aFactor // previous
+    shape = (-(-cells.shape[0] // aFactor), -(-cells.shape[1] // aFactor))
+    if mean:
+      sums = blockSum(sums, step)
+      counts = blockSum(counts, step)
+      with numpy.errstate(invalid='ignore', divide='ignore'):
+        level = (sums / counts).astype(numpy.float32)
+    else:
+      level = numpy.full(shape, mv, dtype=cells.dtype)
+      if len(classes) == 0:
+        yield aFactor, level
+        continue
+      if previous == 1:
+        counts = countClasses(cells, mv, classes, step, shape)
+      else:
+        counts = blockSum(counts, step)
+      counted = counts.max(axis=0) > 0
+      level[counted] = classes[counts.argmax(axis=0)[counted]]
+    previous = aFactor
+    yield aFactor, level
+
+def write(path, cells, valueScale, west, north, cellSize, factors=(2, 4, 8)):
+  """Write the overviews of the map at path, given its cells (2-D array)."""
+  for aFactor, level in getLevels(cells, valueScale, factors):
+    csf.writeArray(getPath(path, aFactor), level, valueScale, west, north, \
+                   cellSize * aFactor)
+
+def getFactors(path):
+  """Return the factors of the overviews of path that are up to date."""
+  if not os.path.exists(path):
+    return []
+  modified = os.path.getmtime(path)
+  factors = []
+  for anOverview in glob.glob(glob.escape(path) + '.ov*'):
+    factor = anOverview[len(path) + 3:]
+    if factor.isdigit() and os.path.getmtime(anOverview) >= modified:
+      factors.append(int(factor))
+  return sorted(factors)
+
+def getLevelPath(path, size):
+  """Return the path of the smallest level of path with size cells or more.
+
+  size -- nr of cells needed along the longest side; the map itself when
+  no overview has as many
+
+  """
+  factors = getFactors(path)
+  if len(factors) == 0:
+    return path
+  header = csf.CsfMap(path)
+  longest = max(header.nrRows, header.nrCols)
+  for aFactor in reversed(factors):
+    if -(-longest // aFactor) >= size:
+      return getPath(path, aFactor)
+  return path
+
+def readArray(path, mv, size=None, dtype=None):
+  """Return map path as array, its smallest level of size cells if given."""
+  if size is not None:
+    path = getLevelPath(path, size)
+  return csf.readArray(path, mv, dtype)
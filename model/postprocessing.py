@@ -0,0 +1,309 @@
+"""In-process post-processing of the land use change model of Mozambique
+
+Post-processing stages (movies, statistics, ...) are consumers registered on
+a pipeline. The model hands finished time steps and samples to the pipeline,
+which calls the consumers from one background thread, so that they run
+while later samples are still being simulated.
+
+"""
+
+import os
+import queue
+import threading
+
+import numpy
+from pcraster import *
+from pcraster.framework import generateNameS, generateNameST, generateNameT
+import csf
+import inputs
+from instrumentation import log
+import movie_availability
+import movie_common
+import movie_land_use
+import overviews
+
+#######################################
+
+class Consumer:
+  """Base class of a post-processing stage; all methods are optional.
+
+  names -- outputs the consumer needs as arrays in timeStep()
+
+  """
+
+  names = []
+
+  def getNames(self, sample):
+    """Return the names of the outputs needed for a sample."""
+    return self.names
+
+  def timeStep(self, sample, timeStep, outputs):
+    """Handle the outputs (dict of name: array) of a finished time step."""
+    pass
+
+  def sample(self, sample):
+    """Handle a finished Monte Carlo sample."""
+    pass
+
+  def close(self):
+    """Finish up after the last sample."""
+    pass
+
+#######################################
+
+class PostProcessingPipeline:
+  def __init__(self, maxQueued=64):
+    """Start the background worker; maxQueued bounds memory held in queue."""
+    self.consumers = []
+    self.queue = queue.Queue(maxQueued)
+    self.error = None
+    self.worker = threading.Thread(target=self.work, daemon=True)
+    self.worker.start()
+
+  def register(self, consumer):
+    """Add a consumer; consumers are called in order of registration."""
+    self.consumers.append(consumer)
+
+  def getNames(self, sample):
+    """Return the names of the outputs of a sample wanted by the consumers."""
+    names = set()
+    for aConsumer in self.consumers:
+      names.update(aConsumer.getNames(sample))
+    return names
+
+  def work(self):
+    """Call the consumers for every queued event, until closed."""
+    while True:
+      method, arguments = self.queue.get()
+      try:
+        if self.error is None:
+          for aConsumer in self.consumers:
+            getattr(aConsumer, method)(*arguments)
+      except Exception as error:
+        ## Keep draining the queue, the error is raised in the model thread
+        self.error = error
+      finally:
+        self.queue.task_done()
+      if method == 'close':
+        break
+
+  def put(self, method, *arguments):
+    self.checkError()
+    self.queue.put((method, arguments))
+
+  def checkError(self):
+    if self.error is not None:
+      raise RuntimeError('post-processing failed') from self.error
+
+  def timeStepFinished(self, sample, timeStep, outputs):
+    """Queue the wanted outputs (dict of name: map) of a time step.
+
+    Only outputs a consumer asks for in this sample are converted; outputs
+    that are arrays already, such as values per zone, are copied.
+
+    """
+    names = self.getNames(sample)
+    arrays = {}
+    for aName in names:
+      aMap = outputs.get(aName)
+      if isinstance(aMap, numpy.ndarray):
+        arrays[aName] = aMap.copy()
+      elif aMap is not None:
+        arrays[aName] = toArray(aMap)
+    self.put('timeStep', sample, timeStep, arrays)
+
+  def sampleFinished(self, sample):
+    self.put('sample', sample)
+
+  def close(self):
+    """Wait until all consumers are done; raise their error if any."""
+    self.queue.put(('close', ()))
+    self.worker.join()
+    self.checkError()
+
+#######################################
+
+def toArray(aMap):
+  """Return a (non-)spatial map as float32 or uint8 numpy array."""
+  if not aMap.isSpatial():
+    aMap = spatial(aMap)
+  if aMap.dataType() in (VALUESCALE.Scalar, VALUESCALE.Directional):
+    return pcr2numpy(aMap, numpy.nan).astype(numpy.float32)
+  ## Classes of the land use map fit in one byte, 0 is missing value
+  return pcr2numpy(aMap, 0).astype(numpy.uint8)
+
+def writeArray(array, name, timeStep, location, overviewFactors=()):
+  """Write a float array with NaN as missing value to name for a time step.
+
+  location -- west, north and cell size of the clone, taken in the model
+  thread as PCRaster is not called from the pipeline thread
+  overviewFactors -- factors of the overviews written next to the map
+
+  """
+  path = generateNameT(name, timeStep)
+  cells = array.astype(numpy.float32)
+  csf.writeArray(path, cells, csf.VS_SCALAR, *location)
+  if len(overviewFactors) > 0:
+    overviews.write(path, cells, csf.VS_SCALAR, *location, \
+                    factors=overviewFactors)
+
+#######################################
+
+class LandUseMovie(Consumer):
+  """Render the land use movie of one sample as soon as that sample is done."""
+
+  def __init__(self, sample=1, name='landUse', dpi=300):
+    self.names = [name]
+    self.name = name
+    self.movieSample = sample
+    self.dpi = dpi
+    self.frames = []
+
+  def getNames(self, sample):
+    if sample == self.movieSample:
+      return self.names
+    return []
+
+  def timeStep(self, sample, timeStep, outputs):
+    if sample == self.movieSample:
+      self.frames.append(outputs[self.name])
+
+  def sample(self, sample):
+    if sample != self.movieSample:
+      return
+    movie = movie_land_use
+    cmap, norm = movie.cmap_long, movie.norm_without_mv
+    frames = (cmap(norm(aFrame), bytes=True) for aFrame in self.frames)
+    movie_common.writeMovie(frames, 'movie_' + self.name + '.gif', \
+                            'land use for Monte Carlo sample ' + str(sample), \
+                            movie.init_year, dpi=self.dpi, \
+                            decorate=movie.add_legend)
+    self.frames = []
+    log(1, '...made movie of land use for sample', sample)
+
+class McStatistics(Consumer):
+  """Write mean, variance and relative error over all samples per time step.
+
+  Statistics of a time step are computed as soon as the last sample has
+  finished it, using the in-memory output of that sample and the outputs of
+  the other samples on disk. Outputs with a value per zone (1-D arrays) are
+  summed in memory over the samples and spread over the zones when written.
+
+  """
+
+  def __init__(self, names, sampleNumbers, zones=None, overviewFactors=()):
+    self.names = list(names)
+    self.overviewFactors = overviewFactors
+    ## Created in the model thread, so clone() is called here
+    self.location = (clone().west(), clone().north(), clone().cellSize())
+    self.sampleNumbers = list(sampleNumbers)
+    self.lastSample = max(self.sampleNumbers)
+    self.zones = zones
+    self.zonalNames = [aName for aName in self.names \
+                       if aName in inputs.PROVINCE_OUTPUTS]
+    ## Sums and sums of squares per (name, time step) of values per zone
+    self.zonalSums = {}
+
+  def getNames(self, sample):
+    if sample == self.lastSample:
+      return self.names
+    ## Maps of the other samples are read from disk
+    return self.zonalNames
+
+  def timeStep(self, sample, timeStep, outputs):
+    n = len(self.sampleNumbers)
+    for aName in self.names:
+      values = outputs.get(aName)
+      if values is None:
+        continue
+      values = values.astype(numpy.float64)
+      if values.ndim == 1:
+        total, squares = self.zonalSums.get((aName, timeStep), (0, 0))
+        self.zonalSums[(aName, timeStep)] = (total + values, \
+                                             squares + values ** 2)
+        if sample != self.lastSample:
+          continue
+        total, squares = self.zonalSums.pop((aName, timeStep))
+      elif sample != self.lastSample:
+        continue
+      else:
+        total = values
+        squares = values ** 2
+        for aSample in self.sampleNumbers:
+          if aSample == sample:
+            continue
+          ## Memory mapped, so the file is read straight into the sum
+          aMap = csf.CsfMap(generateNameST(aName, aSample, timeStep))
+          values = aMap.filled(numpy.nan, numpy.float64)
+          total += values
+          squares += values ** 2
+      average = total / n
+      ## Sample variance, as in mcaveragevariance()
+      variance = numpy.maximum(squares - n * average ** 2, 0) / (n - 1)
+      with numpy.errstate(divide='ignore', invalid='ignore'):
+        error = numpy.sqrt(variance) / average
+      error[~numpy.isfinite(error)] = numpy.nan
+      for aStatistic, values in [('-ave', average), ('-var', variance), \
+                                 ('-err', error)]:
+        if values.ndim == 1:
+          values = self.zones.toArray(values)
+        writeArray(values, aName + aStatistic, timeStep, self.location, \
+                   self.overviewFactors)
+
+class ZonalTable(Consumer):
+  """Write count, sum and mean per zone of outputs for every zone set.
+
+  One table per sample, zonal.csv in the sample directory, with a row per
+  time step, output, zone set and zone.
+
+  """
+
+  def __init__(self, names, zoneSets):
+    self.names = list(names)
+    self.zoneSets = zoneSets
+    self.tables = {}
+
+  def timeStep(self, sample, timeStep, outputs):
+    table = self.tables.get(sample)
+    if table is None:
+      table = open(generateNameS('zonal.csv', sample), 'w')
+      table.write('timeStep,output,zones,zone,count,sum,mean\n')
+      self.tables[sample] = table
+    for aName in self.names:
+      values = outputs.get(aName)
+      if values is None:
+        continue
+      for aSetName, zones in self.zoneSets.items():
+        statistics = zones.getStatistics(values)
+        for i in range(zones.nrZones):
+          table.write('%d,%s,%s,%s,%d,%.6g,%.6g\n' %(timeStep, aName, \
+                      aSetName, zones.ids[i], statistics['count'][i], \
+                      statistics['sum'][i], statistics['mean'][i]))
+
+  def sample(self, sample):
+    table = self.tables.pop(sample, None)
+    if table is not None:
+      table.close()
+
+  def close(self):
+    for aTable in self.tables.values():
+      aTable.close()
+
+class AvailabilityMovie(Consumer):
+  """Render the movie of the averaged availability once statistics are done."""
+
+  def __init__(self, name='euSc-ave', timeSteps=26, dpi=300):
+    self.name = name
+    self.timeSteps = timeSteps
+    self.dpi = dpi
+
+  def close(self):
+    movie = movie_availability
+    paths = [movie_common.frameFileName(self.name, t, os.getcwd()) \
+             for t in range(1, self.timeSteps + 1)]
+    movie_common.renderMovie(paths, 'movie_' + self.name + '.gif', \
+                             movie.cmap, movie.norm, -999, \
+                             'probability of availability for ' + \
+                             self.name[0:2], movie.init_year, dpi=self.dpi, \
+                             masked=True, decorate=movie.add_colorbar)
+    log(1, '...made movie of availability')
@@ -0,0 +1,263 @@
+"""Coarse preview runs of the land use change model
+
+Resamples all input maps to a grid of factor x factor input cells and runs
+the normal model on it, for quick answers while exploring scenarios:
+
+- nominal maps (land use, provinces, no-go areas) get the most common class,
+- roads, water and cities are kept when any of the input cells has them, so
+  networks do not break up,
+- scalar maps get the mean of the valid input cells,
+- a coarse cell is in the study area when most of its input cells are.
+
+Demand and maximum yield need no change: the yield per cell is converted
+with getConversionUnit() and cellarea(), which follows the coarse grid.
+Window lengths keep their extent in meters but cover at least 3 x 3 cells;
+distance cutoffs are at least two cells.
+
+The area per land use type is compared with the input map, and, when the
+sample directory of a full resolution run is given, the area per type and
+the national totals are compared per time step.
+
+usage: python preview.py [--factor 4] [--timesteps 26] [--reference 1]
+
+"""
+
+import argparse
+import copy
+import os
+
+import numpy
+from pcraster import *
+from pcraster.framework import *
+import csf
+import inputs
+import LU_Moz
+import Parameters
+
+## Boolean maps of lines and points, kept when any input cell is true
+NETWORKS = ['roads', 'water', 'cities']
+
+## National totals that are compared with a full resolution run
+TOTALS = ['scTo', 'sYTo', 'euTo', 'eYTo']
+
+VALUE_SCALES = {csf.VS_BOOLEAN: Boolean, csf.VS_NOMINAL: Nominal, \
+                csf.VS_ORDINAL: Ordinal, csf.VS_SCALAR: Scalar, \
+                csf.VS_DIRECTION: Directional, csf.VS_LDD: Ldd}
+
+#######################################
+## Resampling
+
+def toBlocks(values, factor, fill):
+  """Return an array (rows, cols, factor * factor) of the blocks of values."""
+  nrRows = -(-values.shape[0] // factor)
+  nrCols = -(-values.shape[1] // factor)
+  padded = numpy.full((nrRows * factor, nrCols * factor), fill, \
+                      dtype=values.dtype)
+  padded[:values.shape[0], :values.shape[1]] = values
+  blocks = padded.reshape(nrRows, factor, nrCols, factor)
+  return blocks.transpose(0, 2, 1, 3).reshape(nrRows, nrCols, -1)
+
+def aggregate(values, valid, factor, method):
+  """Return the coarse values and validity of a map by mode, any or mean."""
+  validBlocks = toBlocks(valid, factor, False)
+  nrValid = validBlocks.sum(axis=2)
+  if method == 'any':
+    ## Networks are missing off the lines, so one valid cell is enough
+    coarseValid = nrValid > 0
+  else:
+    coarseValid = nrValid * 2 >= factor * factor
+  blocks = toBlocks(values, factor, 0)
+  if method == 'mean':
+    total = numpy.where(validBlocks, blocks, 0).sum(axis=2, \
+                                                    dtype=numpy.float64)
+    coarse = total / numpy.maximum(nrValid, 1)
+  elif method == 'any':
+    coarse = (validBlocks & (blocks != 0)).any(axis=2)
+  else:
+    classes = numpy.unique(values[valid])
+    counts = numpy.zeros((len(classes),) + coarseValid.shape, \
+                         dtype=numpy.int32)
+    for i, aClass in enumerate(classes):
+      counts[i] = (validBlocks & (blocks == aClass)).sum(axis=2)
+    coarse = classes[counts.argmax(axis=0)]
+  return coarse, coarseValid
+
+def resampleInputs(source, target, factor):
+  """Write all input maps in source to target on a coarser grid.
+
+  Returns the land use area (km2) per type on the fine and the coarse grid.
+
+  """
+  clone = csf.CsfMap(os.path.join(source, 'landuse.map'))
+  nrRows = -(-clone.nrRows // factor)
+  nrCols = -(-clone.nrCols // factor)
+  setclone(nrRows, nrCols, clone.cellSize * factor, clone.west, clone.north)
+  areas = {}
+  for aName in sorted(os.listdir(source)):
+    if not aName.endswith('.map'):
+      continue
+    aMap = csf.CsfMap(os.path.join(source, aName))
+    if (aMap.nrRows, aMap.nrCols) != (clone.nrRows, clone.nrCols):
+      continue
+    name = aName[:-4]
+    valid = ~aMap.mask
+    if aMap.valueScale == csf.VS_SCALAR:
+      method = 'mean'
+      mv = -9999
+      values = aMap.filled(0, numpy.float64)
+    else:
+      method = 'mode'
+      if name in NETWORKS:
+        method = 'any'
+      mv = -1
+      if aMap.valueScale in (csf.VS_BOOLEAN, csf.VS_LDD):
+        mv = 255
+      values = aMap.filled(0, numpy.int32)
+    coarse, coarseValid = aggregate(values, valid, factor, method)
+    coarse = numpy.where(coarseValid, coarse, mv)
+    report(numpy2pcr(VALUE_SCALES[aMap.valueScale], coarse, mv), \
+           os.path.join(target, aName))
+    if name == 'landuse':
+      areas['fine'] = getAreas(values[valid], clone.cellSize)
+      areas['coarse'] = getAreas(coarse[coarseValid], clone.cellSize * factor)
+  inputs.linkInputs(source, target, extensions=('.tss', '.txt'))
+  return areas
+
+def scaleVariables(variableSuperDict, cellSize):
+  """Return the suitability parameters adapted to cells of cellSize meters."""
+  scaled = copy.deepcopy(variableSuperDict)
+  for variableDict in scaled.values():
+    if 1 in variableDict:
+      ## Odd nr of cells, at least 3, so that the window has a centre
+      nrCells = max(3, int(round(variableDict[1][0] / cellSize)) | 1)
+      variableDict[1][0] = nrCells * cellSize
+    for aFactor in (2, 3, 4):
+      if aFactor in variableDict:
+        variableDict[aFactor][1] = max(variableDict[aFactor][1], 2 * cellSize)
+  return scaled
+
+#######################################
+## Comparison
+
+def getAreas(landUse, cellSize):
+  """Return the area (km2) per land use type in an array of types."""
+  counts = numpy.bincount(landUse.astype(numpy.int64))
+  return {aType: counts[aType] * cellSize ** 2 / 1e6 \
+          for aType in numpy.flatnonzero(counts)}
+
+def readOutput(directory, name, timeStep):
+  """Return an output map of a sample directory as CsfMap, None if absent."""
+  path = os.path.join(directory, generateNameT(name, timeStep))
+  if not os.path.exists(path):
+    return None
+  return csf.CsfMap(path)
+
+def compareAreas(reference, preview):
+  """Return lines with area per type and relative difference."""
+  lines = []
+  for aType in sorted(set(reference) | set(preview)):
+    full = reference.get(aType, 0.0)
+    coarse = preview.get(aType, 0.0)
+    difference = ''
+    if full > 0:
+      difference = '%+.1f %%' %(100 * (coarse - full) / full)
+    lines.append('  type %-4d %12.0f %12.0f %10s' %(aType, full, coarse, \
+                                                   difference))
+  return lines
+
+def toNational(name, landUse, total):
+  """Return a total output, a mean per study cell, for the whole country.
+
+  landUse -- CsfMap of the land use, of which the valid cells are the study
+  area; areas (scTo, euTo) are in km2, yields in the unit of the max yield
+
+  """
+  nrCells = numpy.count_nonzero(~landUse.mask)
+  ## Yields per cell already include the cell area
+  if name in ('scTo', 'euTo'):
+    return total * nrCells * landUse.cellSize ** 2 / 1e6
+  return total * nrCells
+
+def compareRuns(referenceDirectory, previewDirectory, timeSteps):
+  """Return lines comparing area per type and totals per time step."""
+  lines = []
+  for timeStep in range(1, timeSteps + 1):
+    fullLandUse = readOutput(referenceDirectory, 'landUse', timeStep)
+    coarseLandUse = readOutput(previewDirectory, 'landUse', timeStep)
+    if fullLandUse is None or coarseLandUse is None:
+      continue
+    lines.append('time step %d, area (km2) full, preview, difference' \
+                 %timeStep)
+    lines += compareAreas(getAreas(fullLandUse.data[~fullLandUse.mask], \
+                                   fullLandUse.cellSize), \
+                          getAreas(coarseLandUse.data[~coarseLandUse.mask], \
+                                   coarseLandUse.cellSize))
+    for aName in TOTALS:
+      full = readOutput(referenceDirectory, aName, timeStep)
+      coarse = readOutput(previewDirectory, aName, timeStep)
+      if full is None or coarse is None:
+        continue
+      ## Totals are non-spatial, every valid cell has the value; they are
+      ## means per cell, so they are compared for the whole country
+      fullTotal = toNational(aName, fullLandUse, \
+                             float(full.data[~full.mask][0]))
+      coarseTotal = toNational(aName, coarseLandUse, \
+                               float(coarse.data[~coarse.mask][0]))
+      difference = ''
+      if fullTotal != 0:
+        difference = '%+.1f %%' %(100 * (coarseTotal - fullTotal) / fullTotal)
+      lines.append('  %-9s %12.4g %12.4g %10s' %(aName, fullTotal, \
+                                                 coarseTotal, difference))
+  return lines
+
+#######################################
+
+def main():
+  parser = argparse.ArgumentParser(description='Run the model on a coarser ' \
+                                   'grid for a quick preview.')
+  parser.add_argument('--factor', type=int, default=4, \
+                      help='nr of input cells along a preview cell')
+  parser.add_argument('--timesteps', type=int, \
+                      default=Parameters.getNrTimesteps())
+  parser.add_argument('--samples', type=int, default=1)
+  parser.add_argument('--inputs', default='.', \
+                      help='directory with the input maps and time series')
+  parser.add_argument('--output', help='preview directory, default ' \
+                      'preview<factor>')
+  parser.add_argument('--reference', help='sample directory of a full ' \
+                      'resolution run to compare with, e.g. 1')
+  args = parser.parse_args()
+
+  source = os.path.abspath(args.inputs)
+  target = os.path.abspath(args.output or 'preview%d' %args.factor)
+  reference = None
+  if args.reference is not None:
+    reference = os.path.abspath(args.reference)
+  os.makedirs(target, exist_ok=True)
+  areas = resampleInputs(source, target, args.factor)
+  cellSize = clone().cellSize()
+  lines = ['preview on %d m cells' %cellSize, \
+           'initial area (km2) full, preview, difference']
+  lines += compareAreas(areas['fine'], areas['coarse'])
+
+  variableSuperDict = scaleVariables(Parameters.getVariableSuperDict(), \
+                                     cellSize)
+  Parameters.getVariableSuperDict = lambda: variableSuperDict
+  workingDirectory = os.getcwd()
+  os.chdir(target)
+  try:
+    myModel = LU_Moz.LandUseChangeModel()
+    dynamicModel = DynamicFramework(myModel, args.timesteps)
+    mcModel = MonteCarloFramework(dynamicModel, args.samples)
+    mcModel.run()
+  finally:
+    os.chdir(workingDirectory)
+
+  if reference is not None:
+    lines += compareRuns(reference, os.path.join(target, '1'), args.timesteps)
+  with open(os.path.join(target, 'preview_report.txt'), 'w') as reportFile:
+    reportFile.write('\n'.join(lines) + '\n')
+  print('\n'.join(lines))
+
+if __name__ == '__main__':
+  main()
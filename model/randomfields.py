@@ -0,0 +1,92 @@
+"""Spatially correlated random error fields for the stochastic inputs
+
+A field is white noise filtered in the frequency domain (FFT), which gives a
+stationary Gaussian random field with mean 0, variance 1 and correlation
+exp(-(d / length) ** 2) between cells at distance d. The grid is padded with
+two correlation lengths before the transform, so the field does not wrap
+around from one edge of the map to the other. All fields with the same
+correlation length are filtered in one batch.
+
+Generators are seeded with a seed and the sample nr, so every sample has its
+own fields and a sample can be repeated on its own.
+
+"""
+
+import math
+
+import numpy
+
+#######################################
+
+def getGenerator(seed, sample):
+  """Return the random generator of one sample."""
+  return numpy.random.default_rng([seed, sample])
+
+def getFastLength(length):
+  """Return the smallest length >= length with only factors 2, 3 and 5.
+
+  FFTs of such lengths are several times faster than of lengths with a
+  large prime factor.
+
+  """
+  while True:
+    rest = length
+    for aFactor in (2, 3, 5):
+      while rest % aFactor == 0:
+        rest //= aFactor
+    if rest == 1:
+      return length
+    length += 1
+
+def getKernel(length, correlationLength, cellSize):
+  """Return the filter along one axis of length cells, and its variance.
+
+  The variance is the mean squared filter over all frequencies; dividing by
+  its square root scales the filtered noise to variance 1.
+
+  """
+  frequencies = numpy.fft.fftfreq(length)
+  kernel = numpy.exp(-0.5 * (numpy.pi * correlationLength / cellSize) ** 2 \
+                     * frequencies ** 2)
+  return kernel, float(numpy.mean(kernel ** 2))
+
+def gaussianFields(nrFields, shape, cellSize, correlationLength, rng):
+  """Return an array (nrFields, rows, cols) of standard normal fields."""
+  pad = int(math.ceil(2 * correlationLength / cellSize))
+  padded = (getFastLength(shape[0] + pad), getFastLength(shape[1] + pad))
+  kernelY, varianceY = getKernel(padded[0], correlationLength, cellSize)
+  kernelX, varianceX = getKernel(padded[1], correlationLength, cellSize)
+  ## rfft2 keeps the non-negative frequencies of the last axis only
+  kernel = kernelY[:, None] * kernelX[None, :padded[1] // 2 + 1]
+  ## White noise drawn directly as spectrum, which saves the forward FFT.
+  ## irfft2 keeps only the real part of the columns of frequency 0 (and
+  ## 1/2), which halves their variance, so those are drawn larger.
+  spectrumShape = (nrFields, padded[0], padded[1] // 2 + 1)
+  scale = math.sqrt(padded[0] * padded[1] / 2.0)
+  kernel = kernel * scale
+  kernel[:, 0] *= math.sqrt(2)
+  if padded[1] % 2 == 0:
+    kernel[:, -1] *= math.sqrt(2)
+  spectrum = rng.standard_normal(spectrumShape, dtype=numpy.float32) + \
+             1j * rng.standard_normal(spectrumShape, dtype=numpy.float32)
+  spectrum *= kernel.astype(numpy.float32)
+  fields = numpy.fft.irfft2(spectrum, s=padded)[:, :shape[0], :shape[1]]
+  fields /= math.sqrt(varianceY * varianceX)
+  return fields.astype(numpy.float32)
+
+def getErrorFields(correlationLengths, shape, cellSize, rng):
+  """Return a dict with a standard normal field per name.
+
+  correlationLengths -- dict with the correlation length (m) per name
+
+  """
+  byLength = {}
+  for aName in sorted(correlationLengths):
+    byLength.setdefault(correlationLengths[aName], []).append(aName)
+  fields = {}
+  for aLength in sorted(byLength):
+    names = byLength[aLength]
+    batch = gaussianFields(len(names), shape, cellSize, aLength, rng)
+    for aName, aField in zip(names, batch):
+      fields[aName] = aField
+  return fields
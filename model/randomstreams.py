@@ -0,0 +1,104 @@
+"""Counter-based random streams per Monte Carlo sample
+
+mapuniform(), mapnormal(), uniform() and normal() of PCRaster draw from one
+global stream, so the draws of a sample depend on all samples run before
+it. Here the draws come from Philox generators, which compute their numbers
+from a key and a counter instead of carrying a state along. The key is the
+run seed and the sample nr, and every kind of draw (demand, maximum yield,
+window length, ...) starts at its own part of the counter. The draws of a
+sample are the same whichever samples run before it and whichever other
+kinds of draws are switched on, so a sample can be run again on its own
+(see rerun.py).
+
+Draws made once for the whole run, such as the noise that breaks ties in
+suitability, use sample nr 0. A kind of draws can also be taken from the
+streams of another sample than the others, which is how sensitivity.py
+combines the draws of two samples.
+
+"""
+
+import numpy
+from pcraster import *
+
+## Kinds of draws, each at its own part of the counter
+KINDS = ['noise', 'demand', 'maxYield', 'bioMaxYield', 'window', 'distance', \
+         'yield', 'biomass', 'scYield', 'popDensity', 'cattleDensity', 'dem']
+
+#######################################
+
+def getGenerator(seed, sample, kind):
+  """Return the generator of one kind of draws of a sample."""
+  counter = numpy.zeros(4, dtype=numpy.uint64)
+  ## The highest word of the counter, 2 ** 192 blocks apart per kind
+  counter[3] = KINDS.index(kind)
+  key = numpy.array([seed, sample], dtype=numpy.uint64)
+  return numpy.random.Generator(numpy.random.Philox(counter=counter, key=key))
+
+class RandomStreams:
+  def __init__(self):
+    """Draws from the global PCRaster stream until configured."""
+    self.enabled = 0
+    self.seed = 0
+    self.sample = 0
+    self.kindSamples = {}
+    self.generators = {}
+
+  def configure(self, enabled, seed):
+    """Switch the streams on (1) or off (0) with the seed of the run."""
+    self.enabled = enabled
+    self.seed = seed
+    self.setSample(0)
+
+  def setSample(self, sample, kindSamples=None):
+    """Start the draws of a sample from the beginning of its streams.
+
+    kindSamples -- dict with the sample nr of kinds of draws that come from
+    the streams of another sample
+
+    """
+    self.sample = sample
+    self.kindSamples = kindSamples or {}
+    self.generators = {}
+
+  def getSample(self, kind):
+    """Return the nr of the sample whose streams give kind of draws."""
+    return self.kindSamples.get(kind, self.sample)
+
+  def get(self, kind):
+    if kind not in self.generators:
+      self.generators[kind] = getGenerator(self.seed, self.getSample(kind), \
+                                           kind)
+    return self.generators[kind]
+
+  def getShape(self):
+    return (clone().nrRows(), clone().nrCols())
+
+  def mapuniform(self, kind):
+    """Return a non-spatial value from [0, 1), as mapuniform()."""
+    if self.enabled == 0:
+      return mapuniform()
+    return scalar(float(self.get(kind).random()))
+
+  def mapnormal(self, kind):
+    """Return a non-spatial standard normal value, as mapnormal()."""
+    if self.enabled == 0:
+      return mapnormal()
+    return scalar(float(self.get(kind).standard_normal()))
+
+  def uniform(self, kind):
+    """Return a map with a value from [0, 1) per cell, as uniform(1)."""
+    if self.enabled == 0:
+      return uniform(1)
+    values = self.get(kind).random(self.getShape(), dtype=numpy.float32)
+    return numpy2pcr(Scalar, values, -9999)
+
+  def normal(self, kind):
+    """Return a map with a standard normal value per cell, as normal(1)."""
+    if self.enabled == 0:
+      return normal(1)
+    values = self.get(kind).standard_normal(self.getShape(), \
+                                            dtype=numpy.float32)
+    return numpy2pcr(Scalar, values, -9999)
+
+## Streams of the run, set to the current sample by the model
+streams = RandomStreams()
@@ -0,0 +1,131 @@
+"""Run single Monte Carlo samples of an earlier run again
+
+With getRandomStreams() 1 the random draws of a sample depend only on the
+seed and the sample nr (see randomstreams.py), so a sample, e.g. an outlier
+among 500, can be run again without the samples before it. With the same
+inputs and Parameters the results are those of the original run.
+
+The samples run in a directory of their own with links to the inputs and
+write to sample directories with their original nrs there, only for the
+time steps asked for. Every sample still starts at time step 1, because the
+land use of a time step follows from the steps before it. Movies, statistics
+over the samples and zonal tables are not made.
+
+usage: python rerun.py 347 [340-350 ...] [--timesteps 10 26]
+                       [--inputs .] [--directory rerun]
+
+"""
+
+import argparse
+import os
+
+from pcraster import *
+from pcraster.framework import *
+import inputs
+from instrumentation import log
+import LU_Moz
+import Parameters
+from randomstreams import streams
+
+#######################################
+
+def parseSamples(arguments):
+  """Return the sample nrs of arguments such as '347' or '340-350'."""
+  samples = []
+  for anArgument in arguments:
+    first, separator, last = anArgument.partition('-')
+    if separator == '':
+      last = first
+    for aSample in range(int(first), int(last) + 1):
+      if aSample not in samples:
+        samples.append(aSample)
+  return samples
+
+class RerunModel(LU_Moz.LandUseChangeModel):
+  def __init__(self, samples, firstStep=1):
+    """Model that runs the samples (list of nrs), reporting from firstStep."""
+    LU_Moz.LandUseChangeModel.__init__(self)
+    self.samples = samples
+    self.firstStep = firstStep
+
+  def currentSampleNumber(self):
+    ## Framework sample i runs the i-th sample asked for
+    return self.samples[MonteCarloModel.currentSampleNumber(self) - 1]
+
+  def getSampleNumbers(self):
+    return list(self.samples)
+
+  def premcloop(self):
+    LU_Moz.LandUseChangeModel.premcloop(self)
+    if streams.enabled == 0:
+      log(0, 'getRandomStreams() is 0, so the samples draw other random ' \
+             'numbers than in the original run')
+    for aSample in self.samples:
+      os.makedirs(str(aSample), exist_ok=True)
+
+  def registerPostProcessing(self, zoneMaps):
+    ## Movies, statistics and tables are about whole runs
+    pass
+
+  def dynamic(self):
+    counter = self.landUse.transitions
+    if counter is not None and self.currentTimeStep() == self.nrTimeSteps():
+      ## Only the transitions of the time steps asked for are written
+      counter.rows = [aRow for aRow in counter.rows \
+                      if aRow[0] >= self.firstStep]
+    LU_Moz.LandUseChangeModel.dynamic(self)
+
+  def reportOutputs(self, outputs):
+    if self.currentTimeStep() >= self.firstStep:
+      LU_Moz.LandUseChangeModel.reportOutputs(self, outputs)
+
+def rerun(samples, firstStep, lastStep, inputDirectory, directory):
+  """Run the samples up to lastStep in directory, reporting from firstStep."""
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+    inputs.linkInputs(inputDirectory, directory)
+  workingDirectory = os.getcwd()
+  try:
+    os.chdir(directory)
+    myModel = RerunModel(samples, firstStep)
+    dynamicModel = DynamicFramework(myModel, lastStep)
+    ## Sample directories of other reruns are kept
+    mcModel = MonteCarloFramework(dynamicModel, len(samples), \
+                                  remove_dirs=False)
+    mcModel.run()
+    ## The framework makes directories 1 to n, which stay empty when those
+    ## samples are not asked for
+    for aSample in range(1, len(samples) + 1):
+      aDirectory = str(aSample)
+      if aSample not in samples and os.path.isdir(aDirectory) and \
+         len(os.listdir(aDirectory)) == 0:
+        os.rmdir(aDirectory)
+  finally:
+    os.chdir(workingDirectory)
+
+def main():
+  parser = argparse.ArgumentParser(description='Run Monte Carlo samples of ' \
+                                   'an earlier run again, on their own.')
+  parser.add_argument('samples', nargs='+', \
+                      help='sample nrs or ranges, e.g. 347 or 340-350')
+  parser.add_argument('--timesteps', type=int, nargs=2, \
+                      default=[1, Parameters.getNrTimesteps()], \
+                      metavar=('FIRST', 'LAST'), \
+                      help='time steps for which outputs are written')
+  parser.add_argument('--inputs', default='.', \
+                      help='directory with the input maps and time series')
+  parser.add_argument('--directory', default='rerun', \
+                      help='directory for the sample directories')
+  args = parser.parse_args()
+
+  samples = parseSamples(args.samples)
+  firstStep, lastStep = args.timesteps
+  if not 1 <= firstStep <= lastStep:
+    parser.error('time steps should be 1 <= FIRST <= LAST')
+  rerun(samples, firstStep, lastStep, os.path.abspath(args.inputs), \
+        args.directory)
+  print('ran samples', ', '.join(str(aSample) for aSample in samples), \
+        'to', args.directory)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,261 @@
+"""Variance-based sensitivity of the outputs to the stochastic inputs
+
+Which of the stochastic inputs switched on in Parameters (demand fraction,
+errors of the maximum yields and of the input maps, window length and
+maximum distances) drive the variance of outputs such as eYTo and euPr?
+The first order Sobol index of an input is the share of the variance it
+causes on its own, the total index the share it causes including its
+interactions with the other inputs.
+
+The design is that of Saltelli: two matrices A and B of N independent
+samples of all inputs, and for every input i the matrix AB_i, which is A
+with the values of input i taken from B. The N (d + 2) runs for d inputs
+give both indices of all inputs, instead of separate runs per input and
+value. An input need not be one number: every input is a kind of random
+draws (see randomstreams.py), so the whole error map of an input is one
+input, and row j of A and B are the streams of samples j and N + j. AB_i
+takes the draws of input i from the streams of sample N + j, the other
+draws from those of sample j.
+
+First order indices use the estimator of Saltelli (2010), total indices
+that of Jansen (1999); their 95% confidence intervals come from bootstrap
+resampling of the N rows. Indices are computed per output, time step and,
+for outputs per province, per province, and written as one table:
+
+output,zone,timeStep,input,first,firstConfidence,total,totalConfidence,variance
+
+with zone 'all' for national outputs. The runs use the inputs of the
+model directory, in a scratch directory, and write no maps.
+
+usage: python sensitivity.py [--rows 64] [--outputs eYTo eYPr euTo euPr]
+                             [--timesteps 26] [--inputs .]
+                             [--results sensitivity.csv]
+
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+
+import numpy
+from pcraster import *
+from pcraster.framework import *
+import inputs
+from instrumentation import log
+import LU_Moz
+import Parameters
+from randomstreams import streams
+
+#######################################
+
+def getFactors():
+  """Return (name, kinds of draws) of the stochastic inputs switched on."""
+  factors = [('demand', ['demand'])]
+  stochYield = Parameters.getStochYield()[0] == 1
+  if stochYield:
+    factors.append(('maxYield', ['maxYield']))
+    factors.append(('bioMaxYield', ['bioMaxYield']))
+  maps = []
+  if stochYield:
+    maps.append(('yieldMaps', ['yield', 'biomass', 'scYield']))
+  for aName, stochastic in \
+      [('popDensity', Parameters.getStochPopulationDensity()), \
+       ('cattleDensity', Parameters.getStochCattleDensity()), \
+       ('dem', Parameters.getStochDem())]:
+    if stochastic[0] == 1:
+      maps.append((aName, [aName]))
+  if len(maps) > 0 and Parameters.getErrorFields()[0] == 1:
+    ## The correlated fields of all maps come from one generator
+    maps = [('errorFields', ['fields'])]
+  factors.extend(maps)
+  if Parameters.getStochWindow() == 1:
+    factors.append(('window', ['window']))
+  if Parameters.getStochDistance() == 1:
+    factors.append(('distance', ['distance']))
+  return factors
+
+def getStreamSamples(run, nrRows, factors):
+  """Return the sample nr and the sample nr per kind of draws of a run.
+
+  Runs 1 to N are matrix A, N + 1 to 2 N matrix B and the next blocks of N
+  the matrices AB_i in the order of factors.
+
+  """
+  block, row = divmod(run - 1, nrRows)
+  row += 1
+  if block == 0:
+    return row, {}
+  if block == 1:
+    return nrRows + row, {}
+  return row, {aKind: nrRows + row for aKind in factors[block - 2][1]}
+
+def getIndices(outputA, outputB, outputAB):
+  """Return first order and total indices and the variance of an output.
+
+  outputA, outputB -- arrays (N, ...) of the runs of A and B
+  outputAB -- array (d, N, ...) of the runs of every AB_i
+
+  Indices have the shape of outputAB without the axis of the runs; they
+  are NaN where the output does not vary.
+
+  """
+  variance = numpy.var(numpy.concatenate([outputA, outputB]), axis=0)
+  with numpy.errstate(invalid='ignore', divide='ignore'):
+    first = numpy.mean(outputB * (outputAB - outputA), axis=1) / variance
+    total = 0.5 * numpy.mean((outputA - outputAB) ** 2, axis=1) / variance
+  return first, total, variance
+
+def getConfidence(outputA, outputB, outputAB, nrResamples, rng):
+  """Return half the width of the 95% intervals of the indices."""
+  nrRows = outputA.shape[0]
+  firsts = []
+  totals = []
+  for i in range(nrResamples):
+    rows = rng.integers(nrRows, size=nrRows)
+    first, total, variance = getIndices(outputA[rows], outputB[rows], \
+                                        outputAB[:, rows])
+    firsts.append(first)
+    totals.append(total)
+  return 1.96 * numpy.std(firsts, axis=0), 1.96 * numpy.std(totals, axis=0)
+
+class SensitivityModel(LU_Moz.LandUseChangeModel):
+  def __init__(self, factors, nrRows, names):
+    """Model that runs the design of factors with nrRows rows per matrix.
+
+    names -- outputs of which the values are kept per run and time step
+
+    """
+    LU_Moz.LandUseChangeModel.__init__(self)
+    self.factors = factors
+    self.nrRows = nrRows
+    self.names = names
+    ## Per output a dict with the values per (run, time step)
+    self.results = {aName: {} for aName in names}
+
+  def startRandomStreams(self):
+    sample, kindSamples = getStreamSamples(self.currentSampleNumber(), \
+                                           self.nrRows, self.factors)
+    streams.setSample(sample, kindSamples)
+
+  def registerPostProcessing(self, zoneMaps):
+    ## Nothing is written but the indices
+    pass
+
+  def reportOutputs(self, outputs):
+    key = (self.currentSampleNumber(), self.currentTimeStep())
+    for aName in self.names:
+      values = outputs.get(aName)
+      if values is None:
+        continue
+      if not isinstance(values, numpy.ndarray):
+        values = numpy.array([float(values)])
+      self.results[aName][key] = values
+
+  def getOutputs(self, name):
+    """Return the values of output name as arrays of A, B and every AB_i.
+
+    The arrays have axes (matrix,) run, time step and zone.
+
+    """
+    results = self.results[name]
+    nrRuns = self.nrRows * (len(self.factors) + 2)
+    values = numpy.array([[results[(aRun, aStep)] \
+                           for aStep in self.timeSteps()] \
+                          for aRun in range(1, nrRuns + 1)], \
+                         dtype=numpy.float64)
+    values = values.reshape((len(self.factors) + 2, self.nrRows) + \
+                            values.shape[1:])
+    return values[0], values[1], values[2:]
+
+  def getZones(self, name):
+    if name in inputs.PROVINCE_OUTPUTS:
+      return [str(anId) for anId in self.provinces.ids]
+    return ['all']
+
+def runSensitivity(nrRows, names, nrTimeSteps, inputDirectory):
+  """Run the design on the inputs in inputDirectory; return the model."""
+  ## No maps are written, and the design needs the streams of the samples
+  overrides = {'getOutputList': names, 'getOutputWriting': [0, 1], \
+               'getOverviews': [0, []], \
+               'getRandomStreams': [1, Parameters.getRandomStreams()[1]]}
+  originals = {}
+  for aName, aValue in overrides.items():
+    originals[aName] = getattr(Parameters, aName)
+    setattr(Parameters, aName, lambda aValue=aValue: aValue)
+  factors = getFactors()
+  nrRuns = nrRows * (len(factors) + 2)
+  log(0, 'sensitivity of', ', '.join(names), 'to', \
+      ', '.join(aFactor[0] for aFactor in factors), 'in', nrRuns, 'runs')
+  directory = tempfile.mkdtemp(prefix='pluc_sensitivity_')
+  workingDirectory = os.getcwd()
+  try:
+    inputs.linkInputs(inputDirectory, directory)
+    os.chdir(directory)
+    myModel = SensitivityModel(factors, nrRows, names)
+    dynamicModel = DynamicFramework(myModel, nrTimeSteps)
+    mcModel = MonteCarloFramework(dynamicModel, nrRuns)
+    mcModel.run()
+  finally:
+    os.chdir(workingDirectory)
+    shutil.rmtree(directory)
+    for aName, aMethod in originals.items():
+      setattr(Parameters, aName, aMethod)
+  return myModel
+
+def writeIndices(model, path, nrResamples=100):
+  """Write the indices of all outputs of a finished model as csv to path."""
+  rng = numpy.random.default_rng(Parameters.getRandomStreams()[1])
+  with open(path, 'w', newline='') as resultsFile:
+    writer = csv.writer(resultsFile)
+    writer.writerow(['output', 'zone', 'timeStep', 'input', 'first', \
+                     'firstConfidence', 'total', 'totalConfidence', \
+                     'variance'])
+    for aName in model.names:
+      if len(model.results[aName]) == 0:
+        continue
+      outputA, outputB, outputAB = model.getOutputs(aName)
+      first, total, variance = getIndices(outputA, outputB, outputAB)
+      firstConfidence, totalConfidence = getConfidence(outputA, outputB, \
+                                         outputAB, nrResamples, rng)
+      zones = model.getZones(aName)
+      for i, (aFactor, kinds) in enumerate(model.factors):
+        for t, aStep in enumerate(model.timeSteps()):
+          for z, aZone in enumerate(zones):
+            writer.writerow([aName, aZone, aStep, aFactor] + \
+                            ['%.6g' %aValue for aValue in \
+                             (first[i, t, z], firstConfidence[i, t, z], \
+                              total[i, t, z], totalConfidence[i, t, z], \
+                              variance[t, z])])
+
+def main():
+  parser = argparse.ArgumentParser(description='Compute Sobol indices of ' \
+                                   'outputs for the stochastic inputs.')
+  parser.add_argument('--rows', type=int, default=64, \
+                      help='nr of samples N in the matrices A and B')
+  parser.add_argument('--outputs', nargs='+', \
+                      default=['eYTo', 'eYPr', 'euTo', 'euPr'], \
+                      help='national (..To) or per province (..Pr) outputs')
+  parser.add_argument('--timesteps', type=int, \
+                      default=Parameters.getNrTimesteps())
+  parser.add_argument('--inputs', default='.', \
+                      help='directory with the input maps and time series')
+  parser.add_argument('--bootstrap', type=int, default=100, \
+                      help='nr of resamples for the confidence intervals')
+  parser.add_argument('--results', default='sensitivity.csv')
+  args = parser.parse_args()
+
+  totals = [aName for aName in inputs.SC_OUTPUTS + inputs.EU_OUTPUTS \
+            if aName.endswith('To') or aName in inputs.PROVINCE_OUTPUTS]
+  for aName in args.outputs:
+    if aName not in totals:
+      parser.error('%s is not one of %s' %(aName, ', '.join(totals)))
+  model = runSensitivity(args.rows, args.outputs, args.timesteps, \
+                         os.path.abspath(args.inputs))
+  writeIndices(model, args.results, args.bootstrap)
+  print('wrote the indices of', len(model.factors), 'inputs to', \
+        args.results)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,289 @@
+"""Warm scenario server for the land use change model
+
+Reading the inputs and computing the static suitability takes most of the
+time of a short run. The server does that once, for one sample on the
+engine of ensemble.py, keeps the state after initial() in memory and
+answers scenario questions over HTTP on localhost. Every scenario starts
+from a copy of that state and returns the national and per province area
+and yield of the bioenergy crops per time step; no maps are written.
+
+POST /scenario with a JSON object, all keys optional:
+
+{"series": {"demandUp": "tss/BAU/demandUp.tss",
+            "demandLow": "tss/BAU/demandLow.tss"},
+ "scale": {"bioMaxYield": {"1": 1.1}},
+ "parameters": {"getRegrowthDelay": 5},
+ "demandFraction": 0.5,
+ "timeSteps": 26}
+
+series replaces maxYield, bioMaxYield, demandUp or demandLow by another
+file (relative to the input directory); scale multiplies columns of a
+series, e.g. column 1 (eucalyptus) of bioMaxYield by 1.1. parameters gives
+the values that methods of Parameters.py return; a state is built for
+every distinct set of parameters and the last few are kept. demandFraction
+replaces the random position of the demand between demandLow and demandUp.
+GET /status lists the states in memory.
+
+usage: python server.py [--port 8642] [--inputs .]
+
+"""
+
+import argparse
+import collections
+import copy
+import http.server
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from pcraster.framework import *
+import ensemble
+import inputs
+from instrumentation import log
+import Parameters
+
+## Outputs returned per time step; they decide which inputs are read
+SCENARIO_OUTPUTS = ['scTo', 'scPr', 'sYTo', 'sYPr', \
+                    'euTo', 'euPr', 'eYTo', 'eYPr']
+
+#######################################
+
+class ScenarioModel(ensemble.EnsembleModel):
+  def __init__(self):
+    """Model that keeps one sample after initial() for scenario runs."""
+    ensemble.EnsembleModel.__init__(self, 1)
+
+  def initial(self):
+    ensemble.EnsembleModel.initial(self)
+    self.initialState = self.ensemble.getState()
+
+  def dynamic(self):
+    ## Nothing is simulated while the state is built, see run()
+    pass
+
+  def postmcloop(self):
+    self.writer.close()
+    self.postProcessing.close()
+
+  def run(self, series, nrTimeSteps, demandFraction=None):
+    """Return the bioenergy outputs per time step of one scenario."""
+    self.ensemble.setState(self.initialState)
+    baseSeries = self.series
+    baseDraws = self.draws
+    self.series = series
+    if demandFraction is not None:
+      self.draws = self.draws.copy()
+      self.draws[:, 0] = demandFraction
+    try:
+      results = []
+      for timeStep in range(1, nrTimeSteps + 1):
+        maxYield, demand, scMaxYield, euMaxYield = self.getDrivers(timeStep)
+        self.ensemble.step(maxYield, demand)
+        result = self.getTotals(scMaxYield, euMaxYield)
+        result['timeStep'] = timeStep
+        results.append(result)
+    finally:
+      self.series = baseSeries
+      self.draws = baseDraws
+    return results
+
+  def getTotals(self, scMaxYield, euMaxYield):
+    """Return the national and per province outputs of the bioenergy crops."""
+    landUse = self.ensemble
+    noBiofuels = landUse.getBiofuelExclusion(self.bioNoGo, self.food)
+    totals = {}
+    for crop, names, slope, maxYield in \
+        [('sc', inputs.SC_OUTPUTS, 0.09, scMaxYield), \
+         ('eu', inputs.EU_OUTPUTS, 1, euMaxYield)]:
+      potential, perProvince, total = landUse.getBiofuelPotential( \
+                                      noBiofuels, slope)
+      results = [None, None, total, perProvince]
+      results += landUse.getPotentialBiofuelYield(potential, crop, maxYield)
+      for aName, values in zip(names, results):
+        if aName not in SCENARIO_OUTPUTS:
+          continue
+        if values is None:
+          totals[aName] = None
+        elif aName in inputs.PROVINCE_OUTPUTS:
+          totals[aName] = self.perProvince(values[0])
+        else:
+          totals[aName] = toNumber(values[0])
+    return totals
+
+  def perProvince(self, values):
+    """Return a dict with the value per province id."""
+    return {str(anId): toNumber(aValue) for anId, aValue \
+            in zip(self.provinces.ids, values)}
+
+def toNumber(value):
+  """Return a float for JSON, None for NaN."""
+  value = float(value)
+  if math.isnan(value):
+    return None
+  return value
+
+def fromJson(value):
+  """Return a JSON value with dict keys that are numbers as int."""
+  if isinstance(value, dict):
+    return {(int(aKey) if aKey.lstrip('-').isdigit() else aKey): \
+            fromJson(aValue) for aKey, aValue in value.items()}
+  if isinstance(value, list):
+    return [fromJson(aValue) for aValue in value]
+  return value
+
+def buildModel(parameters, inputDirectory):
+  """Return a ScenarioModel after initial(), with parameters overridden.
+
+  The model runs in a scratch directory with links to the inputs, like the
+  sweep, so no sample directories are left behind.
+
+  """
+  overrides = {'getOutputList': SCENARIO_OUTPUTS, 'getOutputWriting': [0, 1], \
+               'getOverviews': [0, []], 'getActiveCells': 1, 'getVerbosity': 0}
+  overrides.update(parameters)
+  originals = {}
+  for aName, aValue in overrides.items():
+    originals[aName] = getattr(Parameters, aName)
+    setattr(Parameters, aName, lambda aValue=aValue: copy.deepcopy(aValue))
+  directory = tempfile.mkdtemp(prefix='pluc_server_')
+  workingDirectory = os.getcwd()
+  try:
+    inputs.linkInputs(inputDirectory, directory)
+    os.chdir(directory)
+    myModel = ScenarioModel()
+    dynamicModel = DynamicFramework(myModel, 1)
+    mcModel = MonteCarloFramework(dynamicModel, 1)
+    mcModel.run()
+  finally:
+    os.chdir(workingDirectory)
+    shutil.rmtree(directory)
+    for aName, aMethod in originals.items():
+      setattr(Parameters, aName, aMethod)
+  return myModel
+
+#######################################
+
+class ScenarioCache:
+  def __init__(self, inputDirectory, nrTimeSteps, maxStates=3):
+    """Keep the models of the last maxStates sets of parameters."""
+    self.inputDirectory = inputDirectory
+    self.nrTimeSteps = nrTimeSteps
+    self.maxStates = maxStates
+    self.models = collections.OrderedDict()
+
+  def getModel(self, parameters):
+    """Return the model for parameters and whether it was in memory."""
+    for aName in parameters:
+      if not aName.startswith('get') or \
+         not callable(getattr(Parameters, aName, None)):
+        raise ValueError('unknown parameter method: ' + aName)
+    key = json.dumps(parameters, sort_keys=True)
+    if key in self.models:
+      self.models.move_to_end(key)
+      return self.models[key], True
+    log(0, 'building state for parameters', key)
+    myModel = buildModel(fromJson(parameters), self.inputDirectory)
+    self.models[key] = myModel
+    if len(self.models) > self.maxStates:
+      self.models.popitem(last=False)
+    return myModel, False
+
+  def getSeries(self, myModel, request):
+    """Return the time series of the model with the overrides of request."""
+    series = dict(myModel.series)
+    for aName, aPath in request.get('series', {}).items():
+      if aName not in ensemble.SERIES:
+        raise ValueError('unknown time series: ' + aName)
+      series[aName] = inputs.readTimeSeries(os.path.join( \
+                                            self.inputDirectory, aPath))
+    for aName, factors in request.get('scale', {}).items():
+      if aName not in ensemble.SERIES:
+        raise ValueError('unknown time series: ' + aName)
+      series[aName] = series[aName].copy()
+      for aColumn, aFactor in factors.items():
+        ## Column 0 holds the time steps
+        if int(aColumn) < 1:
+          raise ValueError('column %s of %s is not a data column, data ' \
+                           'columns start at 1' %(aColumn, aName))
+        series[aName][:, int(aColumn)] *= float(aFactor)
+    return series
+
+  def run(self, request):
+    """Return the result of a scenario request (dict)."""
+    start = time.time()
+    myModel, warm = self.getModel(request.get('parameters', {}))
+    series = self.getSeries(myModel, request)
+    nrTimeSteps = int(request.get('timeSteps', self.nrTimeSteps))
+    demandFraction = request.get('demandFraction')
+    if demandFraction is not None:
+      demandFraction = float(demandFraction)
+    results = myModel.run(series, nrTimeSteps, demandFraction)
+    return {'warm': warm, 'seconds': round(time.time() - start, 3), \
+            'timeSteps': results}
+
+  def getStatus(self):
+    return {'inputs': self.inputDirectory, 'timeSteps': self.nrTimeSteps, \
+            'states': [json.loads(aKey) for aKey in self.models]}
+
+class ScenarioHandler(http.server.BaseHTTPRequestHandler):
+  """Requests are handled one at a time; they share the models in memory."""
+
+  def sendJson(self, status, content):
+    body = json.dumps(content).encode()
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    if self.path != '/status':
+      self.sendJson(404, {'error': 'unknown path ' + self.path})
+      return
+    self.sendJson(200, self.server.cache.getStatus())
+
+  def do_POST(self):
+    if self.path != '/scenario':
+      self.sendJson(404, {'error': 'unknown path ' + self.path})
+      return
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+      request = json.loads(self.rfile.read(length) or b'{}')
+      result = self.server.cache.run(request)
+    except (ValueError, KeyError, IndexError, OSError) as error:
+      self.sendJson(400, {'error': str(error)})
+      return
+    except Exception as error:
+      ## A failing model run, e.g. in PCRaster, is not the request's fault
+      self.sendJson(500, {'error': str(error)})
+      return
+    self.sendJson(200, result)
+
+def main():
+  parser = argparse.ArgumentParser(description='Answer scenario questions ' \
+                                   'from a model kept warm in memory.')
+  parser.add_argument('--port', type=int, default=8642)
+  parser.add_argument('--inputs', default='.', \
+                      help='directory with the input maps and time series')
+  parser.add_argument('--timesteps', type=int, \
+                      default=Parameters.getNrTimesteps(), \
+                      help='default nr of time steps of a scenario')
+  args = parser.parse_args()
+
+  cache = ScenarioCache(os.path.abspath(args.inputs), args.timesteps)
+  ## The state with the parameters of Parameters.py is built at once
+  cache.getModel({})
+  server = http.server.HTTPServer(('127.0.0.1', args.port), ScenarioHandler)
+  server.cache = cache
+  print('serving scenarios on http://127.0.0.1:%d' %args.port)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  server.server_close()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+"""Window totals from summed-area tables
+
+windowtotal() adds up every cell of the window around every cell, so its
+cost grows with the square of the window length. A summed-area table holds
+in every cell the sum of all cells above and left of it; the sum of any box
+is then four lookups in the table, whatever its size. getWindowWeights()
+splits a window with fractional edges, as windowtotal() has them, into a
+weighted sum of such boxes. windowTotal() does this for a 2-D grid;
+ActiveCells (activecells.py) for the active cells only.
+
+"""
+
+import math
+
+import numpy
+
+#######################################
+
+def getWindowWeights(windowLength, cellSize):
+  """Return the boxes of a window, as ((row radius, col radius), weight).
+
+  Like windowtotal(): the window is windowLength map units wide and cells
+  partly inside count for the fraction inside. The weights are 1 within
+  radius - 1 cells and edge at radius cells along both axes, so the window
+  is a weighted sum of four boxes: radius and radius - 1 wide, along the
+  rows and the columns. A window of at most one cell is the centre cell,
+  for the fraction of it inside the window.
+
+  """
+  half = windowLength / (2.0 * cellSize)
+  radius = max(0, int(math.ceil(half - 0.5)))
+  if radius == 0:
+    return [((0, 0), min(1.0, 2 * half) ** 2)]
+  edge = min(1.0, half + 0.5 - radius)
+  weights = [((radius, radius), edge * edge), \
+             ((radius, radius - 1), edge * (1 - edge)), \
+             ((radius - 1, radius), (1 - edge) * edge), \
+             ((radius - 1, radius - 1), (1 - edge) * (1 - edge))]
+  return [(aBox, aWeight) for aBox, aWeight in weights if aWeight > 0]
+
+def getTable(grid):
+  """Return the summed-area table of a 2-D grid (NaN as 0).
+
+  table[i, j] is the sum of the cells above row i and left of column j, so
+  the table has an extra row and column of zeros in front.
+
+  """
+  nrRows, nrCols = grid.shape
+  table = numpy.zeros((nrRows + 1, nrCols + 1))
+  table[1:, 1:] = numpy.nan_to_num(grid)
+  numpy.cumsum(table, axis=0, out=table)
+  numpy.cumsum(table, axis=1, out=table)
+  return table
+
+def getBounds(nrCells, radius):
+  """Return the first and last + 1 position of the boxes along an axis.
+
+  Positions are in the summed-area table; boxes are clipped to the grid.
+
+  """
+  positions = numpy.arange(nrCells)
+  return numpy.maximum(positions - radius, 0), \
+         numpy.minimum(positions + radius, nrCells - 1) + 1
+
+def boxTotal(table, rowRadius, colRadius):
+  """Return a grid with the sum in the box around every cell."""
+  top, bottom = getBounds(table.shape[0] - 1, rowRadius)
+  left, right = getBounds(table.shape[1] - 1, colRadius)
+  return table[numpy.ix_(bottom, right)] - table[numpy.ix_(top, right)] - \
+         table[numpy.ix_(bottom, left)] + table[numpy.ix_(top, left)]
+
+def windowTotal(grid, windowLength, cellSize):
+  """Return the sum of grid in a square window around every cell.
+
+  Like windowtotal(): No Data (NaN) is skipped and gives No Data on the
+  cell itself. The cost does not depend on the window length.
+
+  """
+  table = getTable(grid)
+  total = numpy.zeros(grid.shape)
+  for (rowRadius, colRadius), aWeight in getWindowWeights(windowLength, \
+                                                          cellSize):
+    total += aWeight * boxTotal(table, rowRadius, colRadius)
+  total[numpy.isnan(grid)] = numpy.nan
+  return total
@@ -0,0 +1,239 @@
+"""Weight and parameter sweeps of the suitability of the land use types
+
+The total suitability of a land use type is a weighted sum of normalized
+factor maps. The sweep computes the factor maps of every type once, on the
+initial land use map of one sample, and evaluates many weight sets as
+batched linear combinations on the cells the type may occupy. Sets can also
+change the window length of factor 1 or the maximum distance of factors 2, 3
+and 4; each distinct value is computed once as an extra layer.
+
+The weight file holds a JSON list of sets; types that are left out of a set
+use the weights from Parameters:
+
+[{"weights": {"1": [0.2, 0.1, 0.1, 0.1, 0.2, 0.2, 0.1]},
+  "windowLength": {"1": 5000}, "maxDist": {"1": {"2": 10000}}}, ...]
+
+Per set and type the results file gives the share of the cells now taken by
+the type that are among its most suitable cells (hit rate) and the mean
+suitability of those cells.
+
+usage: python sweep.py weights.json [--inputs .] [--results sweep.csv]
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+from pcraster import *
+from pcraster.framework import *
+import compact
+import inputs
+from instrumentation import log, profiler
+import LU_Moz
+import Parameters
+
+STATIC_FACTORS = (2, 3, 4, 5, 6, 7)
+DISTANCE_FACTORS = (2, 3, 4)
+
+#######################################
+
+class SuitabilitySweep:
+  def __init__(self, landUseType, distRoads, distWater, distCities, \
+               densPopulation, densCattle, chunkSize=32):
+    """Collect the factor maps of a land use type as arrays of its cells.
+
+    The type must have computed its static suitability with keepFactorMaps.
+    chunkSize is the nr of weight sets combined at once, it bounds memory.
+
+    """
+    self.landUseType = landUseType
+    self.distances = (distRoads, distWater, distCities, densPopulation, \
+                      densCattle)
+    self.chunkSize = chunkSize
+    allowed = pcr2numpy(pcrnot(compact.load(landUseType.mask)), 0) == 1
+    self.cells = numpy.flatnonzero(allowed)
+    environment = pcr2numpy(landUseType.environment, 0).ravel()[self.cells]
+    self.occupied = environment == landUseType.typeNr
+    ## Layers per (factor, window length or maximum distance)
+    self.layers = {}
+    for aFactor, aMap in landUseType.factorMaps.items():
+      self.layers[(aFactor, None)] = self.compress(aMap)
+    self.layers[('noise', None)] = self.compress(landUseType.noise)
+
+  def compress(self, aMap):
+    """Return the values of aMap on the cells of the type, NaN for No Data."""
+    values = pcr2numpy(spatial(scalar(aMap)), numpy.nan)
+    return values.ravel()[self.cells].astype(numpy.float32)
+
+  def getLayer(self, aFactor, variant=None):
+    """Return factor aFactor with another window length or maximum distance.
+
+    Layers are computed on first use and kept for the following sets.
+
+    """
+    key = (aFactor, variant)
+    if key not in self.layers:
+      aType = self.landUseType
+      if aFactor == 1:
+        aMap = aType.getNeighborSuitability(variant)
+      elif aFactor == 8:
+        aMap = aType.getEdgeSuitability()
+      elif aFactor == 9:
+        aMap = aType.getCurrentLandUseSuitability()
+      else:
+        aMap = aType.getStaticFactorMap(aFactor, *self.distances, \
+                                        maxDist=variant)
+      self.layers[key] = self.compress(aMap)
+    return self.layers[key]
+
+  def getVariants(self, aSet):
+    """Return the layer keys and coefficients of one weight set."""
+    aType = self.landUseType
+    typeKey = str(aType.typeNr)
+    weights = aSet.get('weights', {}).get(typeKey, aType.weightList)
+    if len(weights) != len(aType.suitFactorList):
+      raise ValueError('type %d needs %d weights, got %d' \
+                       %(aType.typeNr, len(aType.suitFactorList), len(weights)))
+    windowLength = aSet.get('windowLength', {}).get(typeKey)
+    maxDist = aSet.get('maxDist', {}).get(typeKey, {})
+    staticWeight = sum([aWeight for aFactor, aWeight \
+                        in zip(aType.suitFactorList, weights) \
+                        if aFactor in STATIC_FACTORS])
+    keys = []
+    coefficients = []
+    for aFactor, aWeight in zip(aType.suitFactorList, weights):
+      variant = None
+      if aFactor == 1:
+        variant = windowLength
+      elif aFactor in DISTANCE_FACTORS:
+        variant = maxDist.get(str(aFactor))
+      keys.append((aFactor, variant))
+      ## Static factors enter through the initial map, times its weight
+      if aFactor in STATIC_FACTORS:
+        coefficients.append(aWeight * staticWeight)
+      else:
+        coefficients.append(aWeight)
+    keys.append(('noise', None))
+    coefficients.append(staticWeight)
+    return tuple(keys), coefficients
+
+  def combine(self, keys, coefficients):
+    """Return normalized total suitability, one row per coefficient list."""
+    layers = numpy.stack([self.getLayer(*aKey) for aKey in keys])
+    totals = numpy.asarray(coefficients, dtype=numpy.float32) @ layers
+    ## Same normalization as LandUseType.normalizeMap, per row
+    mapMin = numpy.nanmin(totals, axis=1, keepdims=True)
+    diff = numpy.nanmax(totals, axis=1, keepdims=True) - mapMin
+    return (totals - mapMin) / numpy.maximum(diff, 0.000001)
+
+  def evaluate(self, weightSets):
+    """Return a dict with hit rate and mean suitability per weight set."""
+    groups = {}
+    for i, aSet in enumerate(weightSets):
+      keys, coefficients = self.getVariants(aSet)
+      groups.setdefault(keys, []).append((i, coefficients))
+    nrOccupied = int(self.occupied.sum())
+    results = [None] * len(weightSets)
+    for keys, members in groups.items():
+      for start in range(0, len(members), self.chunkSize):
+        chunk = members[start:start + self.chunkSize]
+        suitability = self.combine(keys, [aMember[1] for aMember in chunk])
+        profiler.count(len(chunk))
+        for (i, coefficients), row in zip(chunk, suitability):
+          results[i] = self.summarize(i, row, nrOccupied)
+    return results
+
+  def summarize(self, setNr, suitability, nrOccupied):
+    """Compare the suitability of one set with the current land use."""
+    hitRate = numpy.nan
+    if nrOccupied > 0:
+      ranked = numpy.where(numpy.isnan(suitability), -numpy.inf, suitability)
+      best = numpy.argpartition(-ranked, nrOccupied - 1)[:nrOccupied]
+      hitRate = float(self.occupied[best].mean())
+    return {'set': setNr, 'landUseType': self.landUseType.typeNr, \
+            'hitRate': hitRate, \
+            'meanOccupied': float(numpy.nanmean(suitability[self.occupied])), \
+            'cells': len(self.cells)}
+
+#######################################
+
+class SweepModel(LU_Moz.LandUseChangeModel):
+  def __init__(self, weightSets):
+    """Model that only evaluates weightSets on the initial land use map."""
+    LU_Moz.LandUseChangeModel.__init__(self, keepFactorMaps=True)
+    self.weightSets = weightSets
+    self.results = []
+
+  def initial(self):
+    LU_Moz.LandUseChangeModel.initial(self)
+    landUse = self.landUse
+    for aType in landUse.landUseTypes:
+      with profiler.phase('sweep', landUseType=aType.typeNr):
+        sweep = SuitabilitySweep(aType, landUse.distRoads, landUse.distWater, \
+                                 landUse.distCities, landUse.populationDensity, \
+                                 landUse.cattleDensity)
+        self.results.extend(sweep.evaluate(self.weightSets))
+      log(1, 'evaluated', len(self.weightSets), 'weight sets for type', \
+          aType.typeNr, 'with', len(sweep.layers), 'layers')
+
+  def dynamic(self):
+    ## Nothing is allocated, the sweep only looks at the initial map
+    pass
+
+def runSweep(weightSets, inputDirectory):
+  """Run the sweep on the inputs in inputDirectory; return the results."""
+  ## Nothing is reported, so only the inputs of the suitability are read;
+  ## the sweep reads the maps of the types, which competitive allocation
+  ## would replace by active cells
+  overrides = {'getOutputList': [], 'getActiveCells': 0, \
+               'getCompetitiveAllocation': 0}
+  ## Maximum distances of the sets can be beyond those of Parameters
+  if Parameters.getDistanceTransform() == 2:
+    overrides['getDistanceTransform'] = 1
+  originals = {}
+  for aName, aValue in overrides.items():
+    originals[aName] = getattr(Parameters, aName)
+    setattr(Parameters, aName, lambda aValue=aValue: aValue)
+  directory = tempfile.mkdtemp(prefix='pluc_sweep_')
+  workingDirectory = os.getcwd()
+  try:
+    inputs.linkInputs(inputDirectory, directory)
+    os.chdir(directory)
+    myModel = SweepModel(weightSets)
+    dynamicModel = DynamicFramework(myModel, 1)
+    mcModel = MonteCarloFramework(dynamicModel, 1)
+    mcModel.run()
+  finally:
+    os.chdir(workingDirectory)
+    shutil.rmtree(directory)
+    for aName, aMethod in originals.items():
+      setattr(Parameters, aName, aMethod)
+  return myModel.results
+
+def main():
+  parser = argparse.ArgumentParser(description='Evaluate many suitability ' \
+                                   'weight sets on the initial land use map.')
+  parser.add_argument('weights', help='JSON file with a list of weight sets')
+  parser.add_argument('--inputs', default='.', \
+                      help='directory with the input maps and time series')
+  parser.add_argument('--results', default='sweep.csv')
+  args = parser.parse_args()
+
+  with open(args.weights) as weightFile:
+    weightSets = json.load(weightFile)
+  results = runSweep(weightSets, os.path.abspath(args.inputs))
+  with open(args.results, 'w', newline='') as resultsFile:
+    writer = csv.DictWriter(resultsFile, ['set', 'landUseType', 'hitRate', \
+                                          'meanOccupied', 'cells'])
+    writer.writeheader()
+    writer.writerows(sorted(results, key=lambda aResult: \
+                            (aResult['set'], aResult['landUseType'])))
+  print('wrote', len(results), 'results to', args.results)
+
+if __name__ == '__main__':
+  main()
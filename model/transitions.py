@@ -0,0 +1,76 @@
+"""Land use transitions counted during the run
+
+The allocation knows which cells it changes. Every change set (the cells
+and their class before the change) is recorded; at the end of a time step
+the first recorded class of a cell is its class at the start of the step,
+so a cell taken by one type and then by another counts once, from its old
+to its final class. Cells that end in their old class are not counted.
+
+Per time step the cells and area per (from, to) pair are kept for the whole
+country and per zone (province), and written as one table per sample:
+
+timeStep,zone,from,to,cells,area
+
+with zone 'all' for the whole country.
+
+"""
+
+import numpy
+
+#######################################
+
+class TransitionCounter:
+  def __init__(self, zoneLabels=None, zoneIds=None, cellArea=1.0):
+    """Count transitions of the land use values of a sample.
+
+    zoneLabels -- zone (position in zoneIds) of every cell of the land use
+    values, -1 when in no zone; None to count for the whole country only
+    cellArea -- area of one cell in the unit of the table
+
+    """
+    self.zoneLabels = zoneLabels
+    self.zoneIds = zoneIds
+    self.cellArea = cellArea
+    self.changes = []
+    ## Per time step: zone (-1 is all), from, to and nr of cells
+    self.rows = []
+
+  def record(self, cells, oldClasses):
+    """Record that cells (positions) are changed from oldClasses."""
+    if len(cells) > 0:
+      self.changes.append((numpy.asarray(cells), numpy.array(oldClasses)))
+
+  def finishStep(self, timeStep, values):
+    """Count the transitions of a time step, values at the end of it."""
+    if len(self.changes) == 0:
+      return
+    cells = numpy.concatenate([aChange[0] for aChange in self.changes])
+    oldClasses = numpy.concatenate([aChange[1] for aChange in self.changes])
+    self.changes = []
+    ## Changes are recorded in order, so the first is the class at the start
+    cells, first = numpy.unique(cells, return_index=True)
+    oldClasses = oldClasses[first]
+    newClasses = values[cells]
+    changed = oldClasses != newClasses
+    cells = cells[changed]
+    pairs = numpy.stack([oldClasses[changed], newClasses[changed]], axis=1)
+    self.addRows(timeStep, -1, pairs)
+    if self.zoneLabels is not None:
+      labels = self.zoneLabels[cells]
+      for aZone in numpy.unique(labels[labels >= 0]):
+        self.addRows(timeStep, aZone, pairs[labels == aZone])
+
+  def addRows(self, timeStep, zone, pairs):
+    pairs, counts = numpy.unique(pairs, axis=0, return_counts=True)
+    for (fromClass, toClass), aCount in zip(pairs, counts):
+      self.rows.append((timeStep, zone, int(fromClass), int(toClass), \
+                        int(aCount)))
+
+  def write(self, path):
+    """Write all rows so far as csv to path."""
+    with open(path, 'w') as table:
+      table.write('timeStep,zone,from,to,cells,area\n')
+      for aStep, aZone, fromClass, toClass, aCount in self.rows:
+        zone = 'all' if aZone < 0 else self.zoneIds[aZone]
+        table.write('%d,%s,%d,%d,%d,%.6g\n' %(aStep, zone, fromClass, \
+                    toClass, aCount, aCount * self.cellArea))
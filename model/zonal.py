@@ -0,0 +1,79 @@
+"""Zonal statistics over provinces and other zone maps
+
+A zone map (provinces, districts, watersheds, ...) is indexed once into a
+label per cell. Sums, means and counts of any variable per zone are then one
+bincount over those labels, and are kept as short vectors with a value per
+zone instead of maps. toArray() spreads a vector over the zones again, like
+areaaverage(), for outputs that are written as maps.
+
+"""
+
+import numpy
+import csf
+
+#######################################
+
+class Zones:
+  def __init__(self, name, zoneMap, mv):
+    """Index a 2-D array of zone ids; cells with mv belong to no zone."""
+    self.name = name
+    self.shape = zoneMap.shape
+    self.cells = numpy.flatnonzero(zoneMap != mv)
+    self.ids, self.labels = numpy.unique(zoneMap.ravel()[self.cells], \
+                                         return_inverse=True)
+    self.nrZones = len(self.ids)
+
+  def getValues(self, values):
+    """Return the values (2-D array) of the cells that are in a zone."""
+    return values.ravel()[self.cells]
+
+  def count(self, values):
+    """Return the nr of cells with a value (not NaN) per zone."""
+    valid = ~numpy.isnan(self.getValues(values))
+    return numpy.bincount(self.labels, weights=valid, minlength=self.nrZones)
+
+  def total(self, values):
+    """Return the sum of values per zone, NaN is skipped."""
+    zoneValues = numpy.nan_to_num(self.getValues(values).astype(numpy.float64))
+    return numpy.bincount(self.labels, weights=zoneValues, \
+                          minlength=self.nrZones)
+
+  def mean(self, values):
+    """Return the mean of values per zone, as areaaverage(); NaN if none."""
+    return self.getStatistics(values)['mean']
+
+  def getStatistics(self, values):
+    """Return a dict with count, sum and mean per zone."""
+    count = self.count(values)
+    total = self.total(values)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      mean = numpy.where(count > 0, total / count, numpy.nan)
+    return {'count': count, 'sum': total, 'mean': mean}
+
+  def toArray(self, vector, mv=numpy.nan):
+    """Return a 2-D float array with the value of its zone in every cell."""
+    values = numpy.full(self.shape[0] * self.shape[1], mv, dtype=numpy.float32)
+    values[self.cells] = vector[self.labels]
+    values[numpy.isnan(values)] = mv
+    return values.reshape(self.shape)
+
+def readZones(name, path, shape, location):
+  """Return the Zones of a nominal or ordinal map file.
+
+  shape -- (rows, columns) of the clone, which the map must have
+  location -- (west, north, cell size) of the clone, which the map must have
+
+  """
+  zoneMap = csf.CsfMap(path)
+  if zoneMap.data.shape != tuple(shape):
+    raise ValueError('zone map %s (%s) has %d x %d cells, the clone %d x %d' \
+                     %(name, path, zoneMap.data.shape[0], \
+                       zoneMap.data.shape[1], shape[0], shape[1]))
+  mapLocation = (zoneMap.west, zoneMap.north, zoneMap.cellSize)
+  ## Allow for rounding of the coordinates, up to a millionth of a cell
+  if not numpy.allclose(mapLocation, location, rtol=0, \
+                        atol=1e-6 * location[2]):
+    raise ValueError('zone map %s (%s) has west, north and cell size ' \
+                     '%s, the clone %s' %(name, path, mapLocation, \
+                                          tuple(location)))
+  return Zones(name, zoneMap.data, zoneMap.getMissingValue())